@@ -0,0 +1,136 @@
+# Compare SQLite storage profiles under contention: concurrent writer processes keep saving
+# small batches of detections (like camera workers), while reader processes keep running
+# dashboard queries (like the frontend). Each profile runs on a fresh DB file.
+
+# Usage: python bench_db_contention.py --writers 2 --readers 4 --duration 20 --db-dir /tmp
+
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import text
+
+import config
+from storage import create_storage_engine, get_pragmas
+
+# pragmas of the default SQLite setup (rollback journal, fsync on each commit)
+DEFAULT_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': config.STORAGE_BUSY_TIMEOUT_MS}
+
+
+def get_profiles() -> dict:
+    return {'default': (DEFAULT_PRAGMAS, DEFAULT_PRAGMAS), 'tuned': (get_pragmas(), get_pragmas(read_only=True))}
+
+
+def prepare_db(db_file_path: str, pragmas: dict, n_rows: int):
+    """Create schema and fill it with N-rows of detections from last 7 days"""
+    from database import Base
+    import models  # noqa: F401 (register models)
+    engine = create_storage_engine(db_file_path, pragmas=pragmas)
+    Base.metadata.create_all(engine)
+    now = datetime.now()
+    rows = [{'create_ts': now - timedelta(seconds=random.randint(0, 7 * 24 * 3600)), 'x': 0, 'y': 0, 'w': 10, 'h': 10,
+             'area': 100, 'label': random.choice(config.TRACK_OBJECTS), 'obj_id': random.randint(0, 500)}
+            for _ in range(n_rows)]
+    with engine.begin() as conn:
+        conn.execute(models.ObjectDetection.__table__.insert(), rows)
+    engine.dispose()
+
+
+def run_writer(db_file_path: str, pragmas: dict, duration: float, batch_size: int, interval: float) -> dict:
+    """Keep inserting batches of detections (one transaction per batch), return commit latencies"""
+    import models
+    engine = create_storage_engine(db_file_path, pragmas=pragmas)
+    latencies, errors = [], 0
+    end_ts = time.time() + duration
+    while time.time() < end_ts:
+        rows = [{'create_ts': datetime.now(), 'x': 0, 'y': 0, 'w': 10, 'h': 10, 'area': 100,
+                 'label': random.choice(config.TRACK_OBJECTS), 'obj_id': random.randint(0, 500)}
+                for _ in range(batch_size)]
+        start_ts = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(models.ObjectDetection.__table__.insert(), rows)
+            latencies.append(time.perf_counter() - start_ts)
+        except Exception as e:
+            logging.debug(f'Write failed: {str(e)}')
+            errors += 1
+        time.sleep(interval)
+    return {'latencies': latencies, 'errors': errors}
+
+
+def run_reader(db_file_path: str, pragmas: dict, duration: float, interval: float) -> dict:
+    """Keep running dashboard like queries (hourly distinct objects of last 7 days), return query latencies"""
+    engine = create_storage_engine(db_file_path, read_only=True, pragmas=pragmas)
+    latencies, errors = [], 0
+    end_ts = time.time() + duration
+    while time.time() < end_ts:
+        start_ts = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("""
+                    SELECT strftime('%Y-%m-%d %H', create_ts), label, COUNT(DISTINCT obj_id)
+                    FROM object_detections
+                    WHERE create_ts >= :since
+                    GROUP BY 1, 2
+                """), {'since': str(datetime.now() - timedelta(days=7))}).fetchall()
+            latencies.append(time.perf_counter() - start_ts)
+        except Exception as e:
+            logging.debug(f'Read failed: {str(e)}')
+            errors += 1
+        time.sleep(interval)
+    return {'latencies': latencies, 'errors': errors}
+
+
+def summarize(results: list, duration: float) -> dict:
+    latencies = np.array([lat for r in results for lat in r['latencies']]) * 1000
+    return {'ops_per_sec': len(latencies) / duration, 'errors': sum(r['errors'] for r in results),
+            'p50_ms': np.percentile(latencies, 50) if len(latencies) else 0.0,
+            'p95_ms': np.percentile(latencies, 95) if len(latencies) else 0.0,
+            'max_ms': latencies.max() if len(latencies) else 0.0}
+
+
+def bench_profile(db_file_path: str, write_pragmas: dict, read_pragmas: dict, args) -> dict:
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(db_file_path + suffix):
+            os.unlink(db_file_path + suffix)
+    prepare_db(db_file_path, write_pragmas, args.rows)
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(args.writers + args.readers) as pool:
+        writers = [pool.apply_async(run_writer, (db_file_path, write_pragmas, args.duration, args.batch_size,
+                                                 args.write_interval)) for _ in range(args.writers)]
+        readers = [pool.apply_async(run_reader, (db_file_path, read_pragmas, args.duration, args.read_interval))
+                   for _ in range(args.readers)]
+        return {'write': summarize([w.get() for w in writers], args.duration),
+                'read': summarize([r.get() for r in readers], args.duration)}
+
+
+if __name__ == '__main__':
+    # set up logger
+    logging.basicConfig(format=config.LOGGING_FORMAT, level=config.LOGGING_LEVEL, datefmt=config.LOGGING_DATE_FORMAT)
+    logger = logging.getLogger()
+
+    parser = argparse.ArgumentParser(description='SQLite storage profile contention benchmark')
+    parser.add_argument('--writers', type=int, help='number of writer processes', default=2)
+    parser.add_argument('--readers', type=int, help='number of reader processes', default=4)
+    parser.add_argument('--duration', type=float, help='duration of each profile run in seconds', default=20)
+    parser.add_argument('--rows', type=int, help='number of detections in the DB before the run', default=50000)
+    parser.add_argument('--batch-size', type=int, help='detections saved in a single transaction', default=5)
+    parser.add_argument('--write-interval', type=float, help='pause between writes in seconds', default=0.05)
+    parser.add_argument('--read-interval', type=float, help='pause between reads in seconds', default=0.2)
+    parser.add_argument('--db-dir', type=str, help='folder for the benchmark DB files', default='/tmp')
+    parser.add_argument('--profiles', type=str, help='comma separated profiles (default, tuned)', default='default,tuned')
+    args = parser.parse_args()
+
+    profiles = get_profiles()
+    print(f'{"profile":<10} {"op":<6} {"ops/sec":>8} {"p50 ms":>8} {"p95 ms":>8} {"max ms":>8} {"errors":>7}')
+    for name in args.profiles.split(','):
+        logging.info(f'Running profile: {name}')
+        res = bench_profile(f'{args.db_dir}/bench_contention_{name}.db', *profiles[name], args)
+        for op, r in res.items():
+            print(f'{name:<10} {op:<6} {r["ops_per_sec"]:>8.1f} {r["p50_ms"]:>8.2f} {r["p95_ms"]:>8.2f}'
+                  f' {r["max_ms"]:>8.2f} {r["errors"]:>7}')
@@ -0,0 +1,86 @@
+# Compare motion detection recall and per-frame cost across motion frame widths
+# on recorded clips. Motion detected on the 400px analysis frame is used as the reference.
+
+# Usage: python bench_motion_scales.py --clip driveway.mp4 --clip porch.mp4 --widths 400,240,160
+
+import argparse
+import logging
+import time
+
+import cv2
+import imutils
+
+import config
+from motion import MotionDetector
+from zones import get_zone_set
+
+# width of the analysis frame (same as in the processing pipeline)
+ANALYSIS_FRAME_WIDTH = 400
+
+
+def bench_clip(clip_path: str, widths: list, max_frames: int = None) -> dict:
+    """
+    Run a motion detector for each width over the clip, and return per-width stats:
+    number of frames with motion, recall/precision vs the reference width and avg time per frame
+    """
+    detectors = {w: MotionDetector() for w in widths}
+    motion_frames = {w: set() for w in widths}
+    proc_times = {w: 0.0 for w in widths}
+    n_frames = 0
+
+    stream = cv2.VideoCapture(clip_path)
+    while max_frames is None or n_frames < max_frames:
+        grabbed, frame = stream.read()
+        if not grabbed:
+            break
+        # prepare the frame the same way as the pipeline does
+        frame_sm = imutils.resize(frame, width=ANALYSIS_FRAME_WIDTH)
+        zone_set = get_zone_set(frame_sm.shape)
+        frame_sm = zone_set.apply(frame_sm)
+        if config.MOTION_ROI_ONLY:
+            frame_gray = cv2.cvtColor(zone_set.crop(frame_sm), cv2.COLOR_BGR2GRAY)
+            offset = zone_set.rect[:2]
+        else:
+            frame_gray = cv2.cvtColor(frame_sm, cv2.COLOR_BGR2GRAY)
+            offset = (0, 0)
+        for w in widths:
+            start_ts = time.perf_counter()
+            boxes = detectors[w].detect(frame_gray, offset=offset, scale=min(w / ANALYSIS_FRAME_WIDTH, 1.0))
+            proc_times[w] += time.perf_counter() - start_ts
+            if len(boxes) > 0:
+                motion_frames[w].add(n_frames)
+        n_frames += 1
+    stream.release()
+
+    ref = motion_frames[max(widths)]
+    results = {}
+    for w in widths:
+        hits = len(motion_frames[w] & ref)
+        results[w] = {
+            'frames': n_frames,
+            'motion_frames': len(motion_frames[w]),
+            'recall': hits / len(ref) if len(ref) > 0 else 1.0,
+            'precision': hits / len(motion_frames[w]) if len(motion_frames[w]) > 0 else 1.0,
+            'ms_per_frame': 1000 * proc_times[w] / max(n_frames, 1)
+        }
+    return results
+
+
+if __name__ == '__main__':
+    # set up logger
+    logging.basicConfig(format=config.LOGGING_FORMAT, level=config.LOGGING_LEVEL, datefmt=config.LOGGING_DATE_FORMAT)
+    logger = logging.getLogger()
+
+    parser = argparse.ArgumentParser(description='Motion detection scale benchmark')
+    parser.add_argument('--clip', type=str, action='append', help='path to a recorded clip', required=True)
+    parser.add_argument('--widths', type=str, help='comma separated motion frame widths', default='400,240,160')
+    parser.add_argument('--max-frames', type=int, help='max number of frames to read from each clip', default=None)
+    args = parser.parse_args()
+
+    bench_widths = sorted({int(w) for w in args.widths.split(',')}, reverse=True)
+    logging.info(f'Reference width: {bench_widths[0]}px')
+    print(f'{"clip":<30} {"width":>6} {"frames":>7} {"motion":>7} {"recall":>7} {"precision":>9} {"ms/frame":>9}')
+    for clip in args.clip:
+        for width, res in bench_clip(clip, bench_widths, args.max_frames).items():
+            print(f'{clip[-30:]:<30} {width:>6} {res["frames"]:>7} {res["motion_frames"]:>7} {res["recall"]:>7.2f}'
+                  f' {res["precision"]:>9.2f} {res["ms_per_frame"]:>9.2f}')
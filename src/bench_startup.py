@@ -0,0 +1,78 @@
+# Measure start up time of a camera worker: imports and start up of its components (model, camera,
+# DB queries, ...), one by one vs concurrently. Each run is done in a fresh process (like a restarted
+# worker), so imports and model load are not cached. With --max-sec, the script exits with an error
+# if the concurrent start up is slower than that (can be used to catch start up time regressions).
+
+# Usage: python bench_startup.py --src 0 --runs 3 --max-sec 10
+
+import argparse
+import logging
+import multiprocessing as mp
+import sys
+import threading
+import time
+
+import numpy as np
+
+import config
+
+
+def run_startup(camera_src, parallel: bool, engine: str = None) -> dict:
+    """Import camera worker module and start its components (in a fresh process), return timings"""
+    start_ts = time.perf_counter()
+    import camera_worker
+    import_sec = time.perf_counter() - start_ts
+    if engine is not None:
+        config.OBJ_DET_ENGINE = engine
+    preview_stop = threading.Event()
+    startup = camera_worker.create_worker_startup({'id': 'bench', 'src': camera_src}, lambda frame: None,
+                                                  preview_stop)
+    components = startup.run(parallel=parallel)
+    stats = startup.stats()
+    # stop started components
+    preview_stop.set()
+    components['camera'].stop()
+    components['writer'].stop()
+    return {'import_sec': import_sec, 'startup_sec': stats['duration_sec'],
+            'components': {name: c['duration_sec'] for name, c in stats['components'].items()}}
+
+
+def bench_mode(camera_src, parallel: bool, runs: int, engine: str = None) -> list:
+    ctx = mp.get_context('spawn')
+    results = []
+    for _ in range(runs):
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(run_startup, (camera_src, parallel, engine)))
+    return results
+
+
+if __name__ == '__main__':
+    # set up logger
+    logging.basicConfig(format=config.LOGGING_FORMAT, level=config.LOGGING_LEVEL, datefmt=config.LOGGING_DATE_FORMAT)
+    logger = logging.getLogger()
+
+    parser = argparse.ArgumentParser(description='Camera worker start up benchmark')
+    parser.add_argument('--src', type=str, help='camera source (device index or video file)', default='0')
+    parser.add_argument('--runs', type=int, help='number of runs of each mode', default=3)
+    parser.add_argument('--engine', type=str, help='object detection engine (default from config)', default=None)
+    parser.add_argument('--modes', type=str, help='comma separated modes (serial, parallel)', default='serial,parallel')
+    parser.add_argument('--max-sec', type=float, help='max median start up time (imports included) of the'
+                                                      ' parallel mode, exit with an error if exceeded', default=None)
+    args = parser.parse_args()
+    camera_src = int(args.src) if args.src.isdigit() else args.src
+
+    medians = {}
+    print(f'{"mode":<9} {"import s":>9} {"startup s":>10} {"total s":>8}  components (median s)')
+    for mode in args.modes.split(','):
+        logging.info(f'Running mode: {mode}')
+        results = bench_mode(camera_src, mode == 'parallel', args.runs, args.engine)
+        import_sec = np.median([r['import_sec'] for r in results])
+        startup_sec = np.median([r['startup_sec'] for r in results])
+        medians[mode] = np.median([r['import_sec'] + r['startup_sec'] for r in results])
+        components = {name: np.median([r['components'][name] for r in results]) for name in results[0]['components']}
+        print(f'{mode:<9} {import_sec:>9.2f} {startup_sec:>10.2f} {medians[mode]:>8.2f}  '
+              f'{", ".join(f"{name}: {sec:.2f}" for name, sec in components.items())}')
+
+    if args.max_sec is not None and 'parallel' in medians and medians['parallel'] > args.max_sec:
+        logging.error(f'Start up took {medians["parallel"]:.2f} sec., more than {args.max_sec:.2f} sec.')
+        sys.exit(1)
@@ -0,0 +1,82 @@
+# Compare object trackers on synthetic scenes: N objects moving with random velocities (and box jitter),
+# some detections randomly missed. Reports time per update and ID churn (IDs given per true object,
+# 1.0 means each object kept a single ID for the whole run).
+
+# Usage: python bench_tracker.py --objects 1,5,10,25,50 --frames 500 --miss-rate 0.1
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+import config
+import object_tracker
+from object_tracker import EuclideanDistTracker, ObjectTracker
+
+# size of the analysis frame, objects bounce off its borders
+FRAME_W, FRAME_H = 400, 300
+
+
+def generate_scene(n_objects: int, n_frames: int, miss_rate: float, seed: int = 0) -> list:
+    """Return list of frames, each frame is a list of (x, y, w, h) boxes (in random order)"""
+    rng = np.random.default_rng(seed)
+    pos = rng.uniform([0, 0], [FRAME_W - 40, FRAME_H - 40], size=(n_objects, 2))
+    vel = rng.uniform(-4, 4, size=(n_objects, 2))
+    size = rng.uniform(15, 40, size=(n_objects, 2))
+    frames = []
+    for _ in range(n_frames):
+        pos += vel
+        # bounce off the frame borders
+        out = (pos < 0) | (pos + size > [FRAME_W, FRAME_H])
+        vel[out] *= -1
+        pos = np.clip(pos, 0, [FRAME_W, FRAME_H] - size)
+        boxes = np.hstack([pos + rng.normal(0, 1, size=pos.shape), size]).astype(int)
+        visible = rng.random(n_objects) >= miss_rate
+        frames.append([tuple(b) for b in rng.permutation(boxes[visible])])
+    return frames
+
+
+def bench_tracker(tracker, frames: list, n_objects: int) -> dict:
+    ids = set()
+    start_ts = time.perf_counter()
+    for boxes in frames:
+        for *_, obj_id in tracker.update(boxes):
+            ids.add(obj_id)
+    elapsed = time.perf_counter() - start_ts
+    return {'us_per_update': elapsed / len(frames) * 1e6, 'ids_per_object': len(ids) / n_objects}
+
+
+def get_trackers(max_distance: int) -> dict:
+    return {'euclidean': lambda: EuclideanDistTracker(max_distance=max_distance),
+            'hungarian': lambda: ObjectTracker(max_distance=max_distance),
+            'greedy': lambda: ObjectTracker(max_distance=max_distance),
+            'hungarian-iou': lambda: ObjectTracker(max_distance=max_distance, cost='iou')}
+
+
+if __name__ == '__main__':
+    # set up logger
+    logging.basicConfig(format=config.LOGGING_FORMAT, level=config.LOGGING_LEVEL, datefmt=config.LOGGING_DATE_FORMAT)
+    logger = logging.getLogger()
+
+    parser = argparse.ArgumentParser(description='Object tracker micro-benchmark')
+    parser.add_argument('--objects', type=str, help='comma separated numbers of objects per frame',
+                        default='1,5,10,25,50')
+    parser.add_argument('--frames', type=int, help='number of frames in each scene', default=500)
+    parser.add_argument('--miss-rate', type=float, help='probability of a missed detection', default=0.1)
+    parser.add_argument('--max-distance', type=int, help='max distance to link objects',
+                        default=config.MAX_SAME_OBJ_DIST)
+    args = parser.parse_args()
+
+    hungarian = object_tracker.load_solver()
+    if hungarian is None:
+        logging.warning('scipy is not installed, hungarian trackers will use greedy assignment')
+    print(f'{"objects":>7} {"tracker":<14} {"us/update":>10} {"IDs/object":>10}')
+    for n_objects in [int(n) for n in args.objects.split(',')]:
+        frames = generate_scene(n_objects, args.frames, args.miss_rate)
+        for name, create_tracker in get_trackers(args.max_distance).items():
+            # greedy assignment is used when scipy is not available
+            object_tracker.linear_sum_assignment = None if name == 'greedy' else hungarian
+            res = bench_tracker(create_tracker(), frames, n_objects)
+            print(f'{n_objects:>7} {name:<14} {res["us_per_update"]:>10.1f} {res["ids_per_object"]:>10.2f}')
+        object_tracker.linear_sum_assignment = hungarian
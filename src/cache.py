@@ -0,0 +1,96 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+
+class TTLCache:
+    """
+    Cache of computed values, which expire after ttl seconds. Concurrent misses of the same key
+    are coalesced, so the value is computed only once and shared with all the waiting callers.
+    Cache can be invalidated (e.g. when new data is written), values computed before
+    the invalidation are never stored. Frequent invalidations can be debounced (min_interval),
+    so the cache is still useful when new data is written every few seconds: an invalidation
+    within min_interval of the previous one only makes the entries expire once the interval is over.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # misses which waited for a computation already in progress
+        self.invalidations = 0
+        self.debounced = 0  # invalidations postponed, as the previous one was less than min_interval ago
+        self._last_invalidation_ts = None
+        self._entries = {}  # key -> (expiration ts, value)
+        self._in_progress = {}  # key -> Future of the value being computed
+        self._generation = 0  # incremented on each invalidation
+        self._lock = threading.Lock()
+
+    def get(self, key, compute: Callable):
+        """Return cached value of the key, or compute it (only once for concurrent callers)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            future = self._in_progress.get(key)
+            if future is not None:
+                self.coalesced += 1
+                computing = False
+            else:
+                self.misses += 1
+                future = self._in_progress[key] = Future()
+                generation = self._generation
+                computing = True
+        if not computing:
+            # wait for the value computed by another caller
+            return future.result()
+        try:
+            value = compute()
+        except Exception as e:
+            with self._lock:
+                if self._in_progress.get(key) is future:
+                    del self._in_progress[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if self._in_progress.get(key) is future:
+                del self._in_progress[key]
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, key=None, min_interval: float = 0.0) -> bool:
+        """
+        Remove the key (or all keys if not provided) from the cache, return True if the cache was invalidated,
+        if the previous invalidation was less than min_interval seconds ago, entries expire at the end
+        of the interval instead (so they are never stale for longer than min_interval)
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._last_invalidation_ts is not None and now - self._last_invalidation_ts < min_interval:
+                self.debounced += 1
+                expire_ts = self._last_invalidation_ts + min_interval
+                for k in (self._entries if key is None else [key]):
+                    if k in self._entries and self._entries[k][0] > expire_ts:
+                        self._entries[k] = (expire_ts, self._entries[k][1])
+                return False
+            self._last_invalidation_ts = now
+            if key is None:
+                self._entries.clear()
+                self._in_progress.clear()
+            else:
+                self._entries.pop(key, None)
+                self._in_progress.pop(key, None)
+            # values being computed right now may be stale, so they will not be stored
+            self._generation += 1
+            self.invalidations += 1
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                    'invalidations': self.invalidations, 'debounced': self.debounced,
+                    'entries': len(self._entries)}
@@ -0,0 +1,254 @@
+import logging
+import queue
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+import imagezmq
+
+import config
+from cameras import SharedFrame, apply_camera_config, get_cameras, mp_ctx
+from database import engine
+from detections import DetectionWriter, get_max_obj_ids, get_obj_det_comps
+from object_tracker import ObjectTracker, load_solver
+from pipeline import Pipeline
+from security import create_alert_worker
+from stages import CaptureStage, PreprocessStage, MotionStage, InferenceStage, PersistStage, orient_frame
+from startup import ComponentStartup
+from video_capture import CaptureStream
+
+
+def create_obj_trackers(max_dist, track_objects, now, camera_id: str = None) -> dict:
+    """Create an instance of Object Tracker for each label"""
+    logging.info("Creating object trackers")
+    try:
+        max_obj_ids = get_max_obj_ids(now, engine, camera_id)
+    except Exception as e:
+        logging.error('Could not retrieve max object IDs for today')
+        raise e
+    # import assignment solver now, not on the first detection
+    load_solver()
+    # each tracker will be initialized with the last ID registered in the DB in last hour
+    object_trackers = {label: ObjectTracker(id_start=max_obj_ids[label] if label in max_obj_ids else 0,
+                                             max_distance=max_dist) for label in track_objects}
+    return object_trackers
+
+
+def create_video_stream(cam_src: int = 0) -> CaptureStream:
+    """Initialize stream from the camera (frames are grabbed in a separate thread)"""
+    logging.info('Starting video stream...')
+    vs = CaptureStream(src=cam_src, resolution=config.STREAM_RES).start()
+    # update stream properties, like brightness, contrast, etc. (if it's defined in the config)
+    for props in config.STREAM_PROPS:
+        vs.stream.set(props[0], props[1])
+    return vs
+
+
+def create_heart_beat_sender() -> imagezmq.ImageSender:
+    """Create a PUB server to send images for monitoring purposes in a non-blocking mode"""
+    logging.info(f'Starting Heart Beat MQ (Publisher) on {config.HEART_BEAT_PUB_URL}...')
+    return imagezmq.ImageSender(connect_to=config.HEART_BEAT_PUB_URL, REQ_REP=False)
+
+
+def create_detection_writer() -> DetectionWriter:
+    """Start a writer thread, which saves detections into the DB in batches"""
+    max_queue, policy = config.DETECTION_WRITER_QUEUE
+    return DetectionWriter(engine, batch_size=config.DETECTION_WRITER_BATCH_SIZE,
+                           flush_interval=config.DETECTION_WRITER_FLUSH_SEC, max_queue=max_queue, policy=policy).start()
+
+
+def forward_preview_frames(video_stream: CaptureStream, on_output_frame, stop_event: threading.Event):
+    """
+    Publish camera frames (oriented, but not processed) until the processing pipeline
+    starts, so the camera feed is not dark while other components are still starting
+    """
+    last_seq = 0
+    while not stop_event.is_set():
+        captured = video_stream.read(last_seq, timeout=0.5)
+        if captured is None:
+            continue
+        last_seq = captured.seq
+        on_output_frame(orient_frame(captured.image))
+
+
+def create_worker_startup(camera: dict, on_output_frame, preview_stop: threading.Event,
+                          on_change=None, last_alert=None) -> ComponentStartup:
+    """
+    Create start up of the camera worker components, which are started concurrently
+    (model load, camera open and DB queries do not depend on each other)
+    """
+
+    def start_camera() -> CaptureStream:
+        video_stream = create_video_stream(camera['src'])
+        t = threading.Thread(target=forward_preview_frames, args=(video_stream, on_output_frame, preview_stop),
+                             name='preview')
+        t.daemon = True
+        t.start()
+        return video_stream
+
+    return (ComponentStartup(f'Camera worker {camera["id"]}', on_change=on_change)
+            .add('model', lambda: get_obj_det_comps(config.OBJ_DET_ENGINE, config.LABELS_FILE))
+            .add('camera', start_camera)
+            .add('trackers', lambda: create_obj_trackers(config.MAX_SAME_OBJ_DIST, config.TRACK_OBJECTS,
+                                                         datetime.now(), camera['id']))
+            .add('alerts', lambda: create_alert_worker(last_alert))
+            .add('writer', create_detection_writer)
+            .add('heart_beat', lambda: create_heart_beat_sender() if config.HEART_BEAT_ENABLED else None))
+
+
+def create_pipeline(video_stream, object_trackers, model, labels, hb_sender, detection_writer, alert_worker,
+                    on_output_frame) -> Pipeline:
+    """
+    Create processing pipeline for the frames from the camera, each stage
+    runs in its own thread, so e.g. preprocessing of the next frame can overlap
+    with the object detection on the current one:
+    capture -> preprocess -> motion detection -> object detection -> persist
+    """
+    logging.info('Creating frame processing pipeline...')
+    pipeline = Pipeline()
+    pipeline.add_stage('capture', CaptureStage(video_stream))
+    for name, stage in (('preprocess', PreprocessStage()),
+                        ('motion', MotionStage()),
+                        ('inference', InferenceStage(model, labels, object_trackers)),
+                        ('persist', PersistStage(hb_sender, on_output_frame, detection_writer, alert_worker,
+                                                 video_stream))):
+        maxsize, policy = config.PIPELINE_QUEUES[name]
+        pipeline.add_stage(name, stage, maxsize=maxsize, policy=policy)
+    return pipeline
+
+
+def run_camera_worker(camera: dict, shared_frame: SharedFrame, stats_queue, last_alert=None):
+    """
+    Entry point of the camera worker process: apply camera specific config,
+    create app components and keep processing frames from the camera,
+    output frames are passed to the web server via shared memory, and the last alert
+    time is shared with workers of other cameras (alert cooldown applies to all cameras)
+    """
+    logging.basicConfig(format=config.LOGGING_FORMAT, level=config.LOGGING_LEVEL,
+                        datefmt=config.LOGGING_DATE_FORMAT)
+    apply_camera_config(camera)
+    logging.info(f'Starting camera worker: {camera["id"]}')
+
+    def report_stats(stats: dict):
+        try:
+            stats_queue.put_nowait((camera['id'], stats))
+        except queue.Full:
+            pass
+
+    # create app components (concurrently), start up progress is reported to the web server (/ready)
+    preview_stop = threading.Event()
+    startup = create_worker_startup(camera, shared_frame.write, preview_stop,
+                                    on_change=lambda startup_stats: report_stats({'startup': startup_stats}),
+                                    last_alert=last_alert)
+    components = startup.run(parallel=config.STARTUP_PARALLEL)
+    model, labels = components['model']
+    video_stream, object_trackers = components['camera'], components['trackers']
+    alert_worker, detection_writer, hb_sender = components['alerts'], components['writer'], components['heart_beat']
+
+    # start pipeline threads, which will perform motion and object detection
+    preview_stop.set()
+    pipeline = create_pipeline(video_stream, object_trackers, model, labels, hb_sender, detection_writer,
+                               alert_worker, shared_frame.write).start()
+
+    # supervisor terminates the worker with SIGTERM, exit cleanly, so queued detections are saved
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        # periodically report stats to the web server
+        while True:
+            time.sleep(config.CAMERA_STATS_INTERVAL_SEC)
+            report_stats({**pipeline.stats(), 'capture': video_stream.stats(), 'detector': model.stats(),
+                          'writer': detection_writer.stats(), 'alerts': alert_worker.stats(),
+                          'startup': startup.stats()})
+    finally:
+        logging.info(f'Stopping camera worker: {camera["id"]}')
+        pipeline.stop()
+        video_stream.stop()
+        detection_writer.stop()
+
+
+class CameraSupervisor:
+    """Start a worker process for each camera, restart workers which died, and collect their stats"""
+
+    def __init__(self, cameras: list = None):
+        self.cameras = get_cameras() if cameras is None else cameras
+        self.shared_frames = {c['id']: SharedFrame((config.STREAM_RES[1], config.STREAM_RES[0], 3))
+                              for c in self.cameras}
+        self.stats_queue = mp_ctx.Queue(maxsize=100)
+        # time of the last alert (epoch seconds) shared by all camera workers, it outlives worker restarts
+        self.last_alert = mp_ctx.Value('d', 0.0)
+        self.stats = {c['id']: {} for c in self.cameras}
+        self.workers = {}
+        self.restarts = {c['id']: 0 for c in self.cameras}
+        # when the current worker process of each camera was started, and how long it took until it was ready
+        self.started_ts = {}
+        self.ready_after = {}
+        self.stopped = False
+
+    def start_worker(self, camera: dict):
+        logging.info(f'Starting worker process for camera {camera["id"]} (source: {camera["src"]})')
+        self.started_ts[camera['id']] = time.time()
+        self.ready_after.pop(camera['id'], None)
+        self.stats[camera['id']] = {}
+        if camera['id'] in self.workers:
+            # previous worker could have been killed while holding the lock of its shared frame, so the
+            # restarted worker gets a new one (frame collector switches to it, once the old one is closed)
+            self.shared_frames[camera['id']].close()
+            self.shared_frames[camera['id']] = SharedFrame((config.STREAM_RES[1], config.STREAM_RES[0], 3))
+        p = mp_ctx.Process(target=run_camera_worker, name=f'camera-{camera["id"]}',
+                           args=(camera, self.shared_frames[camera['id']], self.stats_queue, self.last_alert))
+        p.daemon = True
+        p.start()
+        self.workers[camera['id']] = p
+
+    def start(self) -> 'CameraSupervisor':
+        for camera in self.cameras:
+            self.start_worker(camera)
+        t = threading.Thread(target=self._supervise, name='camera-supervisor')
+        t.daemon = True
+        t.start()
+        return self
+
+    def _supervise(self):
+        """Collect stats from the workers, and restart the ones which are not alive anymore"""
+        next_check_ts = time.time()
+        while not self.stopped:
+            try:
+                camera_id, stats = self.stats_queue.get(timeout=1.0)
+                self.stats[camera_id] = stats
+                if stats.get('startup', {}).get('ready') and camera_id not in self.ready_after:
+                    # time the camera was dark for (process start, imports and components start up)
+                    self.ready_after[camera_id] = time.time() - self.started_ts[camera_id]
+                    logging.info(f'Camera worker {camera_id} ready in {self.ready_after[camera_id]:.2f} sec.')
+            except queue.Empty:
+                pass
+            if time.time() < next_check_ts:
+                continue
+            next_check_ts = time.time() + config.CAMERA_WORKER_CHECK_INTERVAL_SEC
+            for camera in self.cameras:
+                p = self.workers[camera['id']]
+                if not p.is_alive():
+                    logging.error(f'Worker process for camera {camera["id"]} exited with code {p.exitcode}')
+                    self.restarts[camera['id']] += 1
+                    self.start_worker(camera)
+
+    def readiness(self) -> dict:
+        """Return start up state of each camera worker (and its components)"""
+        readiness = {}
+        for camera in self.cameras:
+            startup = self.stats[camera['id']].get('startup', {})
+            ready_after = self.ready_after.get(camera['id'])
+            readiness[camera['id']] = {'ready': ready_after is not None,
+                                       'ready_after_sec': None if ready_after is None else round(ready_after, 3),
+                                       'restarts': self.restarts[camera['id']],
+                                       'components': startup.get('components', {})}
+        return readiness
+
+    def stop(self):
+        self.stopped = True
+        for p in self.workers.values():
+            p.terminate()
+        for shared_frame in self.shared_frames.values():
+            shared_frame.close()
+
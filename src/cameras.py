@@ -0,0 +1,143 @@
+import importlib
+import logging
+import multiprocessing as mp
+import socket
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+import config
+
+# use spawn, so worker processes do not inherit threads, locks and DB connections of the web server
+mp_ctx = mp.get_context('spawn')
+
+# camera served by the current (worker) process, its config overrides
+# need to be re-applied each time the config is reloaded
+_active_camera = None
+
+
+def get_cameras() -> list:
+    """Return cameras defined in the config"""
+    return config.CAMERAS
+
+
+def get_camera(camera_id: str) -> Optional[dict]:
+    """Return camera definition by its ID (or None if it does not exist)"""
+    for camera in get_cameras():
+        if camera['id'] == camera_id:
+            return camera
+    return None
+
+
+def get_heart_beat_sub_urls() -> list:
+    """Return unique heart beat URLs of all cameras (each camera worker publishes its own heart beats)"""
+    urls = []
+    for camera in get_cameras():
+        url = camera.get('config', {}).get('HEART_BEAT_SUB_URL', config.HEART_BEAT_SUB_URL)
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+
+def apply_camera_config(camera: dict):
+    """
+    Overwrite global config values with the camera specific ones (e.g. secure zones, motion
+    or tracker params), this is only done in the camera worker process, so it does not
+    affect other cameras
+    """
+    global _active_camera
+    _active_camera = camera
+    config.CAMERA_ID = camera['id']
+    for name, value in camera.get('config', {}).items():
+        setattr(config, name, value)
+
+
+def get_device_name() -> str:
+    """Return name used to identify the camera in the heart beats"""
+    return f'{socket.gethostname()}:{config.CAMERA_ID}'
+
+
+def reload_config():
+    """Reimport the config on the fly (debug mode) and re-apply camera overrides"""
+    importlib.reload(config)
+    if _active_camera is not None:
+        apply_camera_config(_active_camera)
+
+
+class SharedFrame:
+    """
+    Latest output frame of a camera worker process, shared with the web server process
+    through shared memory (so frames are not pickled and sent over a pipe). The lock is only held
+    while a frame is copied, and it is always acquired with a timeout, readers poll the frame sequence
+    number (no condition wait), so a worker killed while holding the lock never blocks the web server,
+    and the restarted worker gets a new shared frame (see CameraSupervisor)
+    """
+
+    def __init__(self, max_shape: tuple, lock_timeout: float = 1.0, poll_interval: float = 0.005):
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(max_shape)))
+        # sequence number and shape of the current frame
+        self.meta = mp_ctx.Array('l', 4, lock=False)
+        self.lock = mp_ctx.Lock()
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.closed = False
+        # guards the shared memory of this process, so it is not closed while a reader copies a frame
+        self._close_lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # thread lock of this process is not passed to the worker process
+        state = dict(self.__dict__)
+        del state['_close_lock']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._close_lock = threading.Lock()
+
+    def write(self, frame: np.ndarray):
+        """Copy frame into shared memory (readers will pick it up)"""
+        if frame.nbytes > self.shm.size:
+            logging.warning(f'Frame of shape {frame.shape} does not fit into the shared buffer, skipping')
+            return
+        if not self.lock.acquire(timeout=self.lock_timeout):
+            logging.warning('Shared frame is locked, skipping frame')
+            return
+        try:
+            buffer = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.shm.buf)
+            buffer[:] = frame
+            self.meta[1], self.meta[2], self.meta[3] = frame.shape
+            self.meta[0] += 1
+        finally:
+            self.lock.release()
+
+    def read(self, last_seq: int = 0, timeout: float = 1.0) -> tuple:
+        """
+        Wait for a frame newer than last_seq, return (seq, copy of the frame),
+        or (last_seq, None) if no new frame arrived within timeout (or the shared frame was closed)
+        """
+        deadline = time.monotonic() + timeout
+        while self.meta[0] == last_seq:
+            if self.closed or time.monotonic() >= deadline:
+                return last_seq, None
+            time.sleep(self.poll_interval)
+        with self._close_lock:
+            if self.closed or not self.lock.acquire(timeout=self.lock_timeout):
+                return last_seq, None
+            try:
+                shape = (self.meta[1], self.meta[2], self.meta[3])
+                frame = np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf).copy()
+                return self.meta[0], frame
+            finally:
+                self.lock.release()
+
+    def close(self):
+        """Close the shared memory (once no frame is being copied from it) and remove it"""
+        with self._close_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.shm.close()
+            self.shm.unlink()
@@ -9,6 +9,46 @@ APP_NAME = 'Third Eye'
 STREAM_RES = (1280, 720)  # 720p <- faster ~20 FPS on RPi4
 # STREAM_RES = (1920, 1080)  # 1080p <- more choppy ~12 FPS on RPi4
 
+# cameras, each camera is processed by a separate worker process and streamed on /video-feed/{id},
+# 'src' is the OpenCV camera source, and 'config' can overwrite any of the config values below
+# for the camera (e.g. SECURE_ZONES, MIN_OBJ_AREA, MAX_SAME_OBJ_DIST, FLIP_IMAGE), note that each
+# camera needs its own heart beat port, and only one camera can use the Coral accelerator, example:
+# CAMERAS = [{'id': 'front', 'src': 0},
+#            {'id': 'back', 'src': 2, 'config': {'FLIP_IMAGE': False, 'OBJ_DET_ENGINE': 'tflite',
+#                                                'HEART_BEAT_PUB_URL': 'tcp://*:5556',
+#                                                'HEART_BEAT_SUB_URL': 'tcp://127.0.0.1:5556'}}]
+CAMERAS = [{'id': 'cam0', 'src': 0}]
+
+# ID of the camera processed by the current worker (set by the worker process)
+CAMERA_ID = None
+
+# how often (in seconds) camera workers report stats and are checked (and restarted if they died)
+CAMERA_STATS_INTERVAL_SEC = 5
+CAMERA_WORKER_CHECK_INTERVAL_SEC = 10
+
+# start components of the backend and camera workers (model, camera, DB queries, ...) concurrently,
+# set to False to start them one by one (e.g. to find out which one is slow)
+STARTUP_PARALLEL = True
+
+# max number of seconds to wait for a new frame from the camera
+CAPTURE_READ_TIMEOUT_SEC = 1.0
+
+# frame processing pipeline, each stage runs in its own thread and reads frames from
+# a bounded queue: (max queue size, drop policy), where the policy is 'drop_oldest'
+# (drop the oldest frame when the queue is full) or 'block' (upstream stage waits)
+PIPELINE_QUEUES = {
+    'preprocess': (2, 'drop_oldest'),
+    'motion': (2, 'block'),
+    'inference': (2, 'block'),
+    'persist': (2, 'block'),
+}
+
+# detections are saved by a single writer thread in batches: flushed when batch size is reached,
+# or N-seconds after the oldest queued detection, queue holds detections of up to N-frames
+DETECTION_WRITER_BATCH_SIZE = 200
+DETECTION_WRITER_FLUSH_SEC = 2.0
+DETECTION_WRITER_QUEUE = (500, 'drop_oldest')
+
 # enabling debug mode will show video in reduced resolution
 # with bounding boxes around detected objects
 APP_DEBUG_MODE = False
@@ -17,6 +57,25 @@ APP_DEBUG_MODE = False
 BASE_DIR = '/home/pi/Laboratory/third-eye'
 DB_FILE_PATH = f'{BASE_DIR}-db/app.db'
 IMG_FOLDER = f'{BASE_DIR}-images'
+IMAGES_PAGE_SIZE = 500  # max number of images returned by the image catalog in a single page
+# catalog rows of saved intruder images (no alert) are committed once the alert worker is idle,
+# or after this many images
+IMAGES_CATALOG_BATCH_SIZE = 20
+THUMBS_FOLDER = f'{BASE_DIR}-thumbs'  # thumbnails of the gallery images are cached here
+THUMB_WIDTH = 320
+THUMB_JPEG_QUALITY = 75
+THUMBS_CACHE_MAX_MB = 200  # least recently used thumbnails are removed above this size
+
+# SQLite storage profile (pragmas applied to each new DB connection, see storage.py)
+STORAGE_JOURNAL_MODE = 'WAL'  # readers do not block the writer
+STORAGE_SYNCHRONOUS = 'NORMAL'  # in WAL mode, fsync only on checkpoints (not on each commit)
+STORAGE_CACHE_SIZE_KB = 8192  # page cache per connection
+STORAGE_MMAP_SIZE = 64 * 1024 * 1024  # memory mapped reads
+STORAGE_TEMP_STORE = 'MEMORY'
+STORAGE_BUSY_TIMEOUT_MS = 15000  # wait for locks up to N-ms
+STORAGE_WAL_AUTOCHECKPOINT_PAGES = 4000  # automatic checkpoint by writers (fallback of the checkpoint thread)
+STORAGE_CHECKPOINT_INTERVAL_SEC = 300  # backend checkpoints the WAL file every N-seconds
+STORAGE_WAL_TRUNCATE_SIZE_MB = 64  # truncate the WAL file when it grows above this size
 
 # define how console logs will be displayed (default INFO,
 # set to DEBUG for troubleshooting and dev, and ERROR for
@@ -32,6 +91,16 @@ LOG_DB_EVENTS = False
 VIDEO_STREAM_BASE_URL = 'http://192.168.1.187:8000'
 VIDEO_STREAM_PATH = 'video-feed'
 
+# video stream profiles, which can be selected by the clients, e.g. /video-feed?profile=low,
+# each profile is encoded once (only while someone is watching it) and shared by all its clients,
+# width: None keeps the original resolution, max_fps: None streams every processed frame
+STREAM_PROFILES = {
+    'full': {'width': None, 'quality': 90, 'max_fps': None},
+    'medium': {'width': 960, 'quality': 75, 'max_fps': 10},
+    'low': {'width': 640, 'quality': 60, 'max_fps': 5},
+}
+STREAM_DEFAULT_PROFILE = 'full'
+
 # Heart beat configuration, when enabled - backend
 # will be sending heart beat images every N-seconds to
 # the message queue listening for heart beats
@@ -41,6 +110,12 @@ HEART_BEAT_SUB_URL = 'tcp://127.0.0.1:5555'
 HEART_BEAT_INTERVAL_N_FRAMES = 200
 HEART_BEAT_INTERVAL_MAX_IDLE_N_SEC = 60
 HEART_BEAT_FILES_IDENTIFIER = 'HEART-BEAT'
+HEART_BEAT_IMG_WIDTH = None  # downscale heart beat images to this width (None keeps the original size)
+HEART_BEAT_JPEG_QUALITY = 85
+HEART_BEAT_DB_FLUSH_SEC = 60  # heart beats are kept in memory and written to the DB in batches every N-seconds
+HEART_BEAT_STATE_BIND_URL = 'tcp://127.0.0.1:5557'  # heart beat hub serves the last heart beats here (REQ/REP)
+HEART_BEAT_STATE_URL = 'tcp://127.0.0.1:5557'
+HEART_BEAT_STATE_TIMEOUT_MS = 500  # fall back to the DB if the hub does not reply in time
 
 # Set up stream properties, set these if the camera used requires some adjustments
 STREAM_PROPS = (
@@ -58,12 +133,28 @@ SHOW_HOME_OCCUPANCY_STATUS = False
 # and below is a list of points, which will be connected to create a poly shape
 SECURE_ZONE_POLY = [[1, 8], [100, 6], [200, 12], [300, 30], [398, 50], [398, 223], [1, 223]]
 
+# Define any number of named secure zones (polygons can be non-convex), detections will be
+# tagged with the zone they fall in, example:
+# SECURE_ZONES = {'driveway': [[1, 120], [200, 120], [200, 223], [1, 223]],
+#                 'porch': [[250, 60], [398, 60], [398, 223], [250, 223]]}
+# if not set, SECURE_ZONE_POLY is used as a single zone
+SECURE_ZONES = {'secure': SECURE_ZONE_POLY}
+
 # Flip image vertically (if camera is mounted upside down)
 FLIP_IMAGE = True
 
 # Cache DB calls
 DETECTIONS_DATA_CACHE_TTL = 10
+# not used by the FastAPI frontend, it does not show home occupancy (see SHOW_HOME_OCCUPANCY_STATUS),
+# and alerts use occupancy kept in memory (updated by the device finder events), not the DB
 OCCUPANCY_DATA_CACHE_TTL = 2
+HEART_BEAT_DATA_CACHE_TTL = 2
+# cached analysis is dropped at most once per N-seconds (several cameras save detections at the same time),
+# detections saved in the meantime drop it at the end of the interval
+DETECTIONS_CACHE_DEBOUNCE_SEC = 1
+# camera workers publish an event when new detections are saved (frontend drops cached analysis)
+DETECTION_EVENTS_URL = 'tcp://127.0.0.1:5558'
+DETECTION_EVENTS_BIND_URL = 'tcp://127.0.0.1:5558'
 
 # How many days use for historical data vs today charts
 USE_HISTORICAL_DAYS = 7
@@ -75,15 +166,60 @@ BG_SUB_SHADOWS = False
 MIN_OBJ_AREA = 80
 MIN_MOTION_FRAMES = 6
 
+# run motion detection only within the bounding rectangle of the secure zones
+# (pixels outside of the zones are blacked out anyway), detected boxes are
+# translated back to the frame coordinates
+MOTION_ROI_ONLY = True
+
+# width of the frame used for motion detection (e.g. 160 or 240), cost of background
+# subtraction grows with the number of pixels, boxes and areas are projected back to
+# the 400px analysis frame, set to None to run motion detection on the analysis frame
+MOTION_FRAME_WIDTH = None
+
+# object detection engine: 'edgetpu' (Coral USB accelerator via pycoral), 'tflite' (CPU via
+# tflite_runtime) or 'opencv' (CPU via OpenCV DNN), each engine needs its own model file
+OBJ_DET_ENGINE = 'edgetpu'
+
 # object detection model and labels location
 MODEL_FILE = f'{BASE_DIR}/src/models/ssd_mobilenet_v2_coco_quant_postprocess_edgetpu.tflite'
+CPU_MODEL_FILE = f'{BASE_DIR}/src/models/ssd_mobilenet_v2_coco_quant_postprocess.tflite'
+OPENCV_MODEL_FILE = f'{BASE_DIR}/src/models/ssd_mobilenet_v2_coco.pb'
+OPENCV_CONFIG_FILE = f'{BASE_DIR}/src/models/ssd_mobilenet_v2_coco.pbtxt'
 LABELS_FILE = f'{BASE_DIR}/src/models/coco_labels.txt'
 
+# number of CPU threads used by the tflite engine
+TFLITE_NUM_THREADS = 4
+
+# where to run object detection: 'zone' - on the secure zones ROI of the resized frame,
+# 'tiles' - on model-sized tiles cropped around the motion boxes from the full resolution frame
+# (better recall of small objects, overlapping results are removed with non-max suppression)
+OBJ_DET_MODE = 'zone'
+OBJ_DET_TILE_PADDING = 0.2  # pad motion boxes by this fraction of their size
+OBJ_DET_TILE_MERGE_GAP = 20  # merge motion boxes closer than this many pixels (full resolution)
+OBJ_DET_NMS_THRESH = 0.5  # IoU threshold of the cross-tile non-max suppression
+
 # minimum probability to filter weak detections (and prevent false positives)
 PRED_CONFIDENCE = 0.5
 
 # max distance to link objects as same in object tracking
 MAX_SAME_OBJ_DIST = 30
+# objects not detected in N inference frames in a row lose their tracking IDs
+TRACKER_MAX_MISSED = 5
+# cost of linking boxes with tracked objects: 'distance' (between the centers, max MAX_SAME_OBJ_DIST)
+# or 'iou' (1 - intersection over union of the boxes, min TRACKER_MIN_IOU)
+TRACKER_COST = 'distance'
+TRACKER_MIN_IOU = 0.2
+# constant-velocity Kalman filter of the tracked objects (pixels, seconds): std of the detected box centers,
+# of the initial velocity and of the acceleration, objects are predicted until their position std exceeds the max
+TRACKER_MEAS_STD = 2.0
+TRACKER_INIT_VEL_STD = 40.0
+TRACKER_ACCEL_STD = 100.0
+TRACKER_MAX_POSITION_STD = 12.0
+
+# detection cadence: while objects are tracked (and there is motion), run object detection every N-th frame
+# (or sooner, when tracked positions become uncertain), and only predict tracked objects in the frames between,
+# set to 1 to run object detection only on the frames selected by the motion detection (MIN_MOTION_FRAMES)
+DETECTION_INTERVAL_FRAMES = 1
 
 # detect only these objects
 TRACK_OBJECTS = ('person', 'car', 'truck', 'bird', 'cat', 'dog')
@@ -95,13 +231,28 @@ OBJ_PROBA = (0.3, 0.3, 0.1, 0.1, 0.1, 0.1)
 # it's a good idea to disable Private IP Address for home Wi-Fi's,
 # otherwise single device will have a few dynamic Mac addresses for
 # each network (if one has a few in a single house)
-SUBNET_MASK = '192.168.1.0/24'
+SUBNET_MASK = '192.168.1.0/24'  # swept with nmap, only when devices can not be found in the neighbour table
 HOME_OWNERS_MAC_ADDR = [{'mac_addr': '14:F2:87:0E:9A:54', 'owner': 'Edo', 'device': 'phone'},
                         {'mac_addr': '44:F2:1B:29:C3:ED', 'owner': 'Enio', 'device': 'phone'}]
 
+# presence of the devices is checked in the kernel neighbour table: 'proc' (/proc/net/arp) or 'ip' (ip neigh),
+# known IPs are probed before each check, device is only considered away after N consecutive misses
+PRESENCE_NEIGHBOUR_SOURCE = 'proc'
+PRESENCE_CHECK_INTERVAL_SEC = 30
+# probed entries are confirmed by the kernel within ~8 sec. (DELAY 5 sec., then 3 probes 1 sec. apart),
+# entries read from /proc/net/arp are only trusted after the whole wait
+PRESENCE_PROBE_WAIT_SEC = 8
+PRESENCE_PROBE_POLL_SEC = 0.5  # neighbour table is read every N-seconds during the wait
+PRESENCE_AWAY_MISSES = 4
+PRESENCE_SWEEP_INTERVAL_SEC = 300  # full nmap sweep (fallback) at most every N-seconds
+
 # if home owner devices have not been detected in Wi-Fi for N-minutes,
 # system will qualify them as outside
 OWNERS_OUTSIDE_HOME_MIN = 20
+# device finder publishes occupancy on each check, camera workers keep it in memory
+# (bound to localhost only, occupancy must not be exposed on the network)
+OCCUPANCY_PUB_URL = 'tcp://127.0.0.1:5559'
+OCCUPANCY_SUB_URL = 'tcp://127.0.0.1:5559'
 
 # set the hours between which will be triggered even when house is occupied by owners
 # - to disable: set to None to disable this feature,
@@ -113,6 +264,7 @@ INTRUDER_OBJECTS = ['person', 'cat', 'dog']
 
 # define intruder image identification string
 INTRUDER_FILES_IDENTIFIER = 'INTRUDER'
+INTRUDER_JPEG_QUALITY = 95  # quality of the saved intruder images
 
 # if objects of interest have been detected in an image,
 # wait this many seconds before checking if alert needs to be triggered
@@ -127,7 +279,21 @@ SMTP_SERVER_HOST = os.environ['SMTP_SERVER_HOST']  # example: smtp.gmail.com
 SMTP_SERVER_PORT = int(os.environ['SMTP_SERVER_PORT'])  # example: 587 for TLS
 EMAIL_SENDER_ADDRESS = os.environ['EMAIL_SENDER_ADDRESS']
 EMAIL_SENDER_PASSWORD = os.environ['EMAIL_SENDER_PASSWORD']
+SMTP_TIMEOUT_SEC = 20  # socket timeout of the SMTP connection
+SMTP_IDLE_TIMEOUT_SEC = 300  # SMTP connection is reused between emails, and closed after N-seconds of inactivity
+# TLS is mandatory (SSL on port 465, STARTTLS otherwise), set to True only for a trusted local relay
+# without STARTTLS (emails are then sent unencrypted, without login)
+SMTP_ALLOW_INSECURE = False
 
 # these emails will receive Email notifications
 # example format: adam12@gmail.com,anna81@gmail.com
 RECEIVER_EMAIL_ADDRESSES = os.environ['RECEIVER_EMAIL_ADDRESSES']  # comma separated list of addresses
+
+# alerts only add notifications into the outbox (DB table), which are sent by the notification worker
+# (in the backend), failed notifications are retried after 30s, 60s, 120s, ... (max 15 minutes), N-times
+NOTIFICATION_POLL_INTERVAL_SEC = 2  # how often the worker checks the outbox
+NOTIFICATION_MAX_ATTEMPTS = 8
+NOTIFICATION_RETRY_BASE_SEC = 30
+NOTIFICATION_RETRY_MAX_SEC = 900
+NOTIFICATION_IMG_MAX_WIDTH = 960  # attached images are downscaled to this width
+NOTIFICATION_JPEG_QUALITY = 80  # and recompressed with this quality
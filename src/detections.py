@@ -1,16 +1,36 @@
-from models import MotionDetection, ObjectDetection
 import config
-import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
-from edgetpu.detection.engine import DetectionEngine
-from database import Session
-
-
-def get_obj_det_comps(model_file: str, labels_file: str) -> tuple:
-    """Load object detection model file and labels"""
-    logging.info("Loading Edge TPU object detection model and labels")
-    model = DetectionEngine(model_file)
+import queue
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import text
+from pipeline import StageQueue, DROP_OLDEST
+from detectors import create_detector
+from events import EventPublisher
+from rollups import RollupUpdater, fetch_motion_rollups, fetch_object_rollups, hourly_profile, hour_start
+
+# hourly rollups are updated in the same transaction as the detections
+rollup_updater = RollupUpdater()
+
+# publisher of "new detections" events (created on first use, in the process saving detections)
+_detection_events = None
+
+
+def publish_detections_saved(n_detections: int):
+    """Let subscribers (frontend caches) know that new detections were saved"""
+    global _detection_events
+    if _detection_events is None:
+        _detection_events = EventPublisher(config.DETECTION_EVENTS_URL)
+    _detection_events.publish('detections', {'n': n_detections, 'camera_id': config.CAMERA_ID})
+
+
+def get_obj_det_comps(engine: str, labels_file: str) -> tuple:
+    """Load object detection model (for the engine selected in config) and labels"""
+    logging.info("Loading object detection model and labels")
+    model = create_detector(engine)
+    model.warm_up()
     labels = {}
     # loop over the class labels file
     for row in open(labels_file):
@@ -20,114 +40,128 @@ def get_obj_det_comps(model_file: str, labels_file: str) -> tuple:
     return model, labels
 
 
-def save_detections(detections: list) -> None:
-    """Save detections into DB"""
-    logging.debug(f'Saving {len(detections)} detection(s)')
-    try:
-        # stage detections for DB insert
-        Session.add_all(detections)
-        # flush inserts into DB
-        Session.commit()
-    except Exception as e:
-        logging.error(f'Detection(s) not saved: {str(e)}')
-
-
-def get_max_obj_ids(now, db_conn) -> dict:
-    """Get a dictionary of labels and max object IDs for current date"""
+class DetectionWriter:
+    """
+    Long-lived writer thread saving detections into the DB: detections of each frame are queued
+    (so the pipeline never waits for the DB), and written in batches with bulk inserts, when
+    the batch size is reached or the oldest queued detection waited for flush interval.
+    If the queue is full, oldest detections are dropped (or the caller waits, with the block policy).
+    """
+
+    def __init__(self, db_engine, batch_size: int = 200, flush_interval: float = 2.0, max_queue: int = 500,
+                 policy: str = DROP_OLDEST):
+        self.db_engine = db_engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = StageQueue('detections', maxsize=max_queue, policy=policy)
+        self.stopped = False
+        self._thread = None
+        self.queued = 0
+        self.rejected = 0  # detections not queued (block policy, queue still full after timeout)
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_latency = 0.0
+
+    def put(self, detections: list) -> bool:
+        """Queue detections of a frame to be saved, return False if they were rejected"""
+        if self.queue.put(detections, timeout=0.05):
+            self.queued += len(detections)
+            return True
+        self.rejected += len(detections)
+        return False
+
+    def start(self) -> 'DetectionWriter':
+        # objects saved in the current hour (before a restart) are already counted in the rollups
+        rollup_updater.seed(self.db_engine)
+        self._thread = threading.Thread(target=self._run, name='detection-writer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the writer, after the queued detections are written"""
+        self.stopped = True
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        pending = []
+        flush_deadline = None
+        while True:
+            try:
+                timeout = 0.5 if flush_deadline is None else max(flush_deadline - time.monotonic(), 0.0)
+                detections = self.queue.get(timeout=timeout)
+                if not pending:
+                    flush_deadline = time.monotonic() + self.flush_interval
+                pending.extend(detections)
+            except queue.Empty:
+                if self.stopped:
+                    break
+            if pending and (len(pending) >= self.batch_size or time.monotonic() >= flush_deadline or self.stopped):
+                self.flush(pending)
+                pending, flush_deadline = [], None
+        if pending:
+            self.flush(pending)
+
+    def flush(self, detections: list):
+        """Insert detections (with executemany for each table) and update rollups in a single transaction"""
+        start_ts = time.perf_counter()
+        rows = defaultdict(list)
+        for d in detections:
+            table = d.__table__
+            rows[table].append({c.name: getattr(d, c.name) for c in table.columns if c.name != 'id'})
+        try:
+            with self.db_engine.begin() as conn:
+                for table, table_rows in rows.items():
+                    conn.execute(table.insert(), table_rows)
+                # update hourly rollups used by the analysis
+                new_seen = rollup_updater.update(conn, detections)
+        except Exception as e:
+            self.failed += len(detections)
+            logging.error(f'{len(detections)} detection(s) not saved: {str(e)}')
+            return
+        # objects are counted in the rollups only once the transaction is committed
+        rollup_updater.mark_seen(new_seen)
+        self.written += len(detections)
+        self.flushes += 1
+        self.last_flush_latency = time.perf_counter() - start_ts
+        logging.debug(f'Saved {len(detections)} detection(s) in {self.last_flush_latency:.3f} sec.')
+        publish_detections_saved(len(detections))
+
+    def stats(self) -> dict:
+        return {'queue': self.queue.stats(), 'queued': self.queued, 'rejected': self.rejected,
+                'written': self.written, 'failed': self.failed, 'flushes': self.flushes,
+                'last_flush_latency_ms': round(self.last_flush_latency * 1000, 2)}
+
+
+def get_max_obj_ids(now, db_conn, camera_id: str = None) -> dict:
+    """Get a dictionary of labels and max object IDs for current date (and camera, if provided)"""
 
     # calculate start of current hour
     curr_dt_start = f'{str(now.date())} 00:00:00'
 
-    # fetch results from DB
-    df = pd.read_sql(f"""
-        SELECT label, COUNT (DISTINCT obj_id) as next_obj_id
-        FROM object_detections
-        WHERE create_ts >= :curr_dt_start
-        GROUP BY 1
-    """, params={'curr_dt_start': curr_dt_start}, con=db_conn)
-
-    # convert dataframe to a {label:count} dictionary
-    return {rec['label']: rec['next_obj_id'] for rec in df.to_dict(orient='records')}
-
-
-def get_motion_analysis(db_conn) -> list:
-    """Get means of motion detections by hour for last N-days and today"""
-
-    # fetch results from DB
-    df = pd.read_sql(f"""
-        SELECT id, create_ts, '1' as motion_count
-        FROM motion_detections
-        WHERE create_ts BETWEEN datetime('now', '-{config.USE_HISTORICAL_DAYS} days') AND datetime('now', 'localtime')
-        GROUP BY 1,2,3
-    """, con=db_conn)
-    # update data types
-    df.create_ts = pd.to_datetime(df.create_ts)
-    df.motion_count = df.motion_count.astype(int)
-    # resample data by hour
-    motion_det_df_resampled = df.set_index('create_ts').resample(
-        'H').count().reset_index()[['create_ts', 'motion_count']].fillna(0)
-    # split historical dates and today
-    td = datetime.now().date()
-    motion_det_df_resampled_hist = motion_det_df_resampled.loc[motion_det_df_resampled['create_ts'].dt.date != td]
-    motion_det_df_resampled_td = motion_det_df_resampled.loc[motion_det_df_resampled['create_ts'].dt.date == td]
-    # calculate avg hourly count for historical detections
-    motion_det_df_resampled_avg_hist = motion_det_df_resampled_hist.groupby(
-        motion_det_df_resampled_hist.create_ts.dt.hour)['motion_count'].mean()
-    hist = motion_det_df_resampled_avg_hist.reset_index()
-    hist.columns = ['Hour', 'Historical']
-    # calculate hourly count for today's detections
-    motion_det_df_resampled_avg_td = motion_det_df_resampled_td.groupby(
-        motion_det_df_resampled_td.create_ts.dt.hour)['motion_count'].sum()
-    today = motion_det_df_resampled_avg_td.reset_index()
-    today.columns = ['Hour', 'Today']
-    # return merged: historical and today's datasets
-    return hist.merge(today, how='left').fillna(0).to_dict(orient='records')
-
-
-def get_objects_analysis(db_conn) -> dict:
-    """Get means of object detections by hour for last N-days and today"""
-
-    # fetch detections from db
-    object_det_df = pd.read_sql(f"""
-        SELECT id, label, create_ts, obj_id
-        FROM object_detections
-        WHERE create_ts BETWEEN datetime('now', '-{config.USE_HISTORICAL_DAYS} days') AND datetime('now', 'localtime')
-        GROUP BY 1,2,3,4
-    """, con=db_conn)
-    # update data types
-    object_det_df.create_ts = pd.to_datetime(object_det_df.create_ts)
-    object_det_df.obj_id = object_det_df.obj_id.astype(int)
-    # initialize final results
-    results = {}
-    for label in config.TRACK_OBJECTS:
-        # filter records only for the label
-        obj_df = object_det_df.loc[object_det_df['label'] == label]
-
-        # resample date at hourly level
-        object_det_df_resampled = obj_df.set_index('create_ts').resample(
-            'H').nunique().reset_index()[['label', 'create_ts', 'obj_id']]
-
-        # fill NaN's
-        idx = object_det_df_resampled['label'].isnull()
-        object_det_df_resampled.loc[idx, 'label'] = label
-        object_det_df_resampled.loc[idx, 'obj_id'] = 0
-
-        # split historical dates and today
-        td = datetime.now().date()
-        object_det_df_resampled_hist = object_det_df_resampled.loc[object_det_df_resampled['create_ts'].dt.date != td]
-        object_det_df_resampled_td = object_det_df_resampled.loc[object_det_df_resampled['create_ts'].dt.date == td]
-
-        # calculate avg hourly count for historical detections
-        object_det_df_resampled_avg_hist = object_det_df_resampled_hist.groupby(
-            object_det_df_resampled_hist.create_ts.dt.hour)['obj_id'].mean()
-        hist = object_det_df_resampled_avg_hist.reset_index()
-        hist.columns = ['Hour', 'Historical']
-
-        # calculate avg hourly count for today's detections
-        object_det_df_resampled_avg_td = object_det_df_resampled_td.groupby(
-            object_det_df_resampled_td.create_ts.dt.hour)['obj_id'].mean()
-        today = object_det_df_resampled_avg_td.reset_index()
-        today.columns = ['Hour', 'Today']
-        # add to results
-        results[label] = hist.merge(today, how='left').fillna(0).to_dict(orient='records')
-    return results
+    # fetch results from DB (plain query, pandas is not needed for a {label:count} dictionary)
+    with db_conn.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT label, COUNT (DISTINCT obj_id) as next_obj_id
+            FROM object_detections
+            WHERE create_ts >= :curr_dt_start
+                AND (:camera_id IS NULL OR camera_id = :camera_id)
+            GROUP BY 1
+        """), {'curr_dt_start': curr_dt_start, 'camera_id': camera_id}).fetchall()
+    return {label: next_obj_id for label, next_obj_id in rows}
+
+
+def get_motion_analysis() -> list:
+    """Get means of motion detections by hour for last N-days and today (from the hourly rollups)"""
+    now = datetime.now()
+    counts = fetch_motion_rollups(hour_start(now - timedelta(days=config.USE_HISTORICAL_DAYS)))
+    return hourly_profile(counts, now)
+
+
+def get_objects_analysis() -> dict:
+    """Get means of distinct objects detected by hour for last N-days and today (from the hourly rollups)"""
+    now = datetime.now()
+    counts = fetch_object_rollups(hour_start(now - timedelta(days=config.USE_HISTORICAL_DAYS)))
+    return {label: hourly_profile(counts.get(label, {}), now) for label in config.TRACK_OBJECTS}
@@ -0,0 +1,247 @@
+import abc
+import logging
+import time
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+import config
+
+
+class DetectedObject(NamedTuple):
+    """Single object detected by the detector"""
+    label_id: int
+    score: float
+    box: tuple  # (start_x, start_y, end_x, end_y) in the input image coordinates
+
+
+class ObjectDetector(abc.ABC):
+    """
+    Base class for object detection engines. Engines take BGR images (as read by OpenCV)
+    and return a list of DetectedObject. Model load and warm-up time as well as
+    per-inference latency are measured, so they can be reported.
+    """
+
+    name = 'base'
+
+    def __init__(self):
+        self.input_size = (300, 300)  # (width, height) of the model input
+        self.load_time = 0.0
+        self.warmup_time = None
+        self.inferences = 0
+        self.last_latency = 0.0
+        self.avg_latency = 0.0  # exponential moving average
+
+    @abc.abstractmethod
+    def _detect(self, image_rgb: np.ndarray, threshold: float) -> list:
+        """Run inference on RGB image, to be implemented by the engines"""
+
+    def detect(self, image: np.ndarray, threshold: float) -> list:
+        """Detect objects in the BGR image and return those with score of at least threshold"""
+        start_ts = time.perf_counter()
+        results = self._detect(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), threshold)
+        latency = time.perf_counter() - start_ts
+        self.inferences += 1
+        self.last_latency = latency
+        self.avg_latency = latency if self.inferences == 1 else 0.9 * self.avg_latency + 0.1 * latency
+        return results
+
+    def detect_batch(self, images: list, threshold: float) -> list:
+        """
+        Detect objects in a batch of BGR images, return a list of results for each image
+        (SSD models with postprocessing op take a single image, so the batch is run back to back
+        on the already allocated interpreter)
+        """
+        return [self.detect(image, threshold) for image in images]
+
+    def warm_up(self, shape: tuple = (225, 400, 3)) -> float:
+        """Run first (usually much slower) inference on a blank image, return its duration"""
+        start_ts = time.perf_counter()
+        self._detect(np.zeros(shape, np.uint8), 1.0)
+        self.warmup_time = time.perf_counter() - start_ts
+        logging.info(f'Object detector {self.name} loaded in {self.load_time:.2f} sec.'
+                     f' and warmed up in {self.warmup_time:.2f} sec.')
+        return self.warmup_time
+
+    def stats(self) -> dict:
+        return {'engine': self.name, 'load_time_sec': round(self.load_time, 3),
+                'warmup_time_sec': None if self.warmup_time is None else round(self.warmup_time, 3),
+                'inferences': self.inferences, 'last_latency_ms': round(self.last_latency * 1000, 2),
+                'avg_latency_ms': round(self.avg_latency * 1000, 2)}
+
+
+def _resize_to_input(image: np.ndarray, input_size: tuple) -> tuple:
+    """
+    Resize image to fit into the model input keeping the aspect ratio
+    (rest of the input is padded with zeros), return input tensor and the scale
+    """
+    in_w, in_h = input_size
+    h, w = image.shape[:2]
+    scale = min(in_w / w, in_h / h)
+    resized = cv2.resize(image, (max(int(w * scale), 1), max(int(h * scale), 1)))
+    tensor = np.zeros((in_h, in_w, 3), image.dtype)
+    tensor[:resized.shape[0], :resized.shape[1]] = resized
+    return tensor, scale
+
+
+class EdgeTpuDetector(ObjectDetector):
+    """SSD model compiled for the Coral Edge TPU, run via pycoral"""
+
+    name = 'edgetpu'
+
+    def __init__(self, model_file: str):
+        super().__init__()
+        from pycoral.adapters import common, detect
+        from pycoral.utils.edgetpu import make_interpreter
+        self._common, self._detect_adapter = common, detect
+        start_ts = time.perf_counter()
+        self.interpreter = make_interpreter(model_file)
+        self.interpreter.allocate_tensors()
+        self.load_time = time.perf_counter() - start_ts
+        self.input_size = common.input_size(self.interpreter)
+
+    def _detect(self, image_rgb: np.ndarray, threshold: float) -> list:
+        _, scale = self._common.set_resized_input(self.interpreter, (image_rgb.shape[1], image_rgb.shape[0]),
+                                                  lambda size: cv2.resize(image_rgb, size))
+        self.interpreter.invoke()
+        return [DetectedObject(o.id, float(o.score), (o.bbox.xmin, o.bbox.ymin, o.bbox.xmax, o.bbox.ymax))
+                for o in self._detect_adapter.get_objects(self.interpreter, threshold, scale)]
+
+
+class TFLiteCpuDetector(ObjectDetector):
+    """SSD model (with postprocessing op) run on the CPU via tflite_runtime"""
+
+    name = 'tflite'
+
+    def __init__(self, model_file: str, num_threads: int = 4):
+        super().__init__()
+        from tflite_runtime.interpreter import Interpreter
+        start_ts = time.perf_counter()
+        self.interpreter = Interpreter(model_path=model_file, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.load_time = time.perf_counter() - start_ts
+        input_details = self.interpreter.get_input_details()[0]
+        self.input_index = input_details['index']
+        self.input_size = (input_details['shape'][2], input_details['shape'][1])
+        # SSD postprocessing op outputs: boxes, classes, scores, count
+        self.output_indexes = [d['index'] for d in self.interpreter.get_output_details()]
+
+    def _detect(self, image_rgb: np.ndarray, threshold: float) -> list:
+        tensor, scale = _resize_to_input(image_rgb, self.input_size)
+        self.interpreter.set_tensor(self.input_index, tensor[np.newaxis, ...])
+        self.interpreter.invoke()
+        boxes, classes, scores, count = [self.interpreter.get_tensor(i) for i in self.output_indexes]
+        in_w, in_h = self.input_size
+        results = []
+        for i in range(int(count[0])):
+            if scores[0][i] < threshold:
+                continue
+            # boxes are normalized to the model input (ymin, xmin, ymax, xmax)
+            ymin, xmin, ymax, xmax = boxes[0][i]
+            results.append(DetectedObject(int(classes[0][i]), float(scores[0][i]),
+                                          (xmin * in_w / scale, ymin * in_h / scale,
+                                           xmax * in_w / scale, ymax * in_h / scale)))
+        return results
+
+
+class OpenCvDnnDetector(ObjectDetector):
+    """SSD model (e.g. TensorFlow frozen graph + pbtxt) run via OpenCV DNN module"""
+
+    name = 'opencv'
+
+    def __init__(self, model_file: str, config_file: str, input_size: tuple = (300, 300), label_offset: int = 1):
+        super().__init__()
+        start_ts = time.perf_counter()
+        self.net = cv2.dnn.readNet(model_file, config_file)
+        self.load_time = time.perf_counter() - start_ts
+        self.input_size = input_size
+        # TensorFlow object detection models use 1-based class IDs (0 is background)
+        self.label_offset = label_offset
+
+    def _detect(self, image_rgb: np.ndarray, threshold: float) -> list:
+        h, w = image_rgb.shape[:2]
+        self.net.setInput(cv2.dnn.blobFromImage(image_rgb, size=self.input_size, swapRB=False))
+        # output shape is [1, 1, N, 7]: image_id, class_id, score, x1, y1, x2, y2 (normalized)
+        out = self.net.forward()
+        return [DetectedObject(int(d[1]) - self.label_offset, float(d[2]), (d[3] * w, d[4] * h, d[5] * w, d[6] * h))
+                for d in out[0, 0] if d[2] >= threshold]
+
+
+def merge_boxes(boxes: list, gap: int = 0) -> list:
+    """
+    Merge overlapping (or closer than gap pixels) boxes (start_x, start_y, end_x, end_y)
+    into their union, until no boxes can be merged
+    """
+    merged = [list(b) for b in boxes]
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                a, b = merged[i], merged[j]
+                if a[0] - gap <= b[2] and b[0] - gap <= a[2] and a[1] - gap <= b[3] and b[1] - gap <= a[3]:
+                    merged[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return [tuple(b) for b in merged]
+
+
+def make_tile(box: tuple, frame_shape: tuple, tile_size: tuple, padding: float) -> tuple:
+    """
+    Pad the box (start_x, start_y, end_x, end_y) by a fraction of its size, and grow it
+    to at least the tile size (model input size) around its center, keeping it within the frame
+    """
+    frame_h, frame_w = frame_shape[:2]
+    pad_x, pad_y = int((box[2] - box[0]) * padding), int((box[3] - box[1]) * padding)
+    w = min(max(box[2] - box[0] + 2 * pad_x, tile_size[0]), frame_w)
+    h = min(max(box[3] - box[1] + 2 * pad_y, tile_size[1]), frame_h)
+    cx, cy = (box[0] + box[2]) // 2, (box[1] + box[3]) // 2
+    start_x = min(max(cx - w // 2, 0), frame_w - w)
+    start_y = min(max(cy - h // 2, 0), frame_h - h)
+    return start_x, start_y, start_x + w, start_y + h
+
+
+def nms(results: list, iou_threshold: float) -> list:
+    """Non-max suppression of DetectedObjects (per label), used to remove duplicates from overlapping tiles"""
+    kept = []
+    for label_id in {r.label_id for r in results}:
+        label_results = [r for r in results if r.label_id == label_id]
+        boxes = [[int(r.box[0]), int(r.box[1]), int(r.box[2] - r.box[0]), int(r.box[3] - r.box[1])]
+                 for r in label_results]
+        idx = cv2.dnn.NMSBoxes(boxes, [r.score for r in label_results], 0.0, iou_threshold)
+        kept.extend(label_results[i] for i in np.array(idx).flatten())
+    return kept
+
+
+def detect_tiles(detector: ObjectDetector, frame: np.ndarray, boxes: list, threshold: float) -> list:
+    """
+    Run object detection on model-sized tiles cropped around the boxes (start_x, start_y, end_x, end_y)
+    from the frame, and return DetectedObjects in the frame coordinates (with duplicates suppressed)
+    """
+    tiles = [make_tile(b, frame.shape, detector.input_size, config.OBJ_DET_TILE_PADDING)
+             for b in merge_boxes(boxes, gap=config.OBJ_DET_TILE_MERGE_GAP)]
+    batch_results = detector.detect_batch([frame[t[1]:t[3], t[0]:t[2]] for t in tiles], threshold)
+    results = []
+    for (tile_x, tile_y, _, _), tile_results in zip(tiles, batch_results):
+        # translate tile coordinates back to the frame coordinates
+        results.extend(DetectedObject(r.label_id, r.score, (r.box[0] + tile_x, r.box[1] + tile_y,
+                                                            r.box[2] + tile_x, r.box[3] + tile_y))
+                       for r in tile_results)
+    return nms(results, config.OBJ_DET_NMS_THRESH) if len(tiles) > 1 else results
+
+
+def create_detector(engine: str = None) -> ObjectDetector:
+    """Create object detector for the engine selected in the config"""
+    engine = config.OBJ_DET_ENGINE if engine is None else engine
+    logging.info(f'Loading {engine} object detection model')
+    if engine == 'edgetpu':
+        return EdgeTpuDetector(config.MODEL_FILE)
+    if engine == 'tflite':
+        return TFLiteCpuDetector(config.CPU_MODEL_FILE, num_threads=config.TFLITE_NUM_THREADS)
+    if engine == 'opencv':
+        return OpenCvDnnDetector(config.OPENCV_MODEL_FILE, config.OPENCV_CONFIG_FILE)
+    raise ValueError(f'Unknown object detection engine: {engine}')
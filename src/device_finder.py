@@ -1,12 +1,12 @@
 # Usage: python device_finder.py
 
-import subprocess
-import re
 import logging
 from datetime import datetime
 import config
 from database import Session
 from models import HomeOccupancy
+from occupancy import create_occupancy_publisher, publish_occupancy
+from presence import PresenceDetector
 import traceback
 import sys
 import time
@@ -14,39 +14,30 @@ import time
 
 def main():
     """
-    Find devices of home owners in local network and save
-    in the database if change is detected vs previous run
+    Find devices of home owners in local network, save in the database
+    if change is detected vs previous run, and publish it to the camera workers
     """
 
     # how many seconds to sleep for between checks
-    SLEEP_TIME = 30
+    SLEEP_TIME = config.PRESENCE_CHECK_INTERVAL_SEC
 
     try:
+        publisher = create_occupancy_publisher()
+        presence_detector = PresenceDetector(config.HOME_OWNERS_MAC_ADDR)
         while True:  # receive images until Ctrl-C is pressed
-            # construct command
-            CMD = f'/usr/bin/sudo /usr/bin/nmap -sn {config.SUBNET_MASK}'
-            logging.info(f'Executing cmd: {CMD}')
-
-            # execute CLI process
-            p = subprocess.Popen(CMD.split(' '), stdout=subprocess.PIPE)
-            out, err = p.communicate()
-
-            # extract Mac addresses in local network
-            mac_addresses = [m[0] for m in re.findall(r'(([0-9a-fA-F:]){17})', str(out))]
-
-            # find devices of interest
-            cfg_mac_addr = [d['mac_addr'] for d in config.HOME_OWNERS_MAC_ADDR]
+            # find devices of home owners (from the neighbour table, with nmap sweep as a fallback)
+            present_devices = presence_detector.check()
             cfg_owner_names = [d['owner'] for d in config.HOME_OWNERS_MAC_ADDR]
 
             # find indexes of devices found in the network
-            idx = []
-            for m in mac_addresses:
-                if m in cfg_mac_addr:
-                    idx.append(cfg_mac_addr.index(m))
+            idx = [config.HOME_OWNERS_MAC_ADDR.index(d) for d in present_devices]
 
             # useful initializations
             now = datetime.now()
 
+            # publish occupancy (so alert checks can use it straight away)
+            publish_occupancy(publisher, 'home' if len(idx) > 0 else 'away', [cfg_owner_names[i] for i in idx], now)
+
             # fetch last occupancy
             last_hoc = Session.query(HomeOccupancy).order_by(HomeOccupancy.id.desc()).first()
 
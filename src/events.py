@@ -0,0 +1,62 @@
+import json
+import logging
+import threading
+from typing import Callable
+
+import zmq
+
+
+class EventPublisher:
+    """
+    Publish events (topic and JSON payload) to the subscriber bound on the url (many publishers,
+    e.g. camera worker processes, can connect to a single subscriber), or bind on the url,
+    so many subscribers can connect to a single publisher. Publishing never blocks,
+    events are dropped if no subscriber is running or can not keep up.
+    """
+
+    def __init__(self, url: str, bind: bool = False):
+        self.socket = zmq.Context.instance().socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, 100)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        if bind:
+            self.socket.bind(url)
+        else:
+            self.socket.connect(url)
+        # zmq sockets are not thread safe
+        self._lock = threading.Lock()
+
+    def publish(self, topic: str, payload: dict = None):
+        message = [topic.encode(), json.dumps(payload or {}, default=str).encode()]
+        with self._lock:
+            try:
+                self.socket.send_multipart(message, flags=zmq.NOBLOCK)
+            except zmq.Again:
+                pass
+
+
+def subscribe_events(url: str, topics: list, callback: Callable, bind: bool = True) -> threading.Thread:
+    """
+    Bind subscriber on the url (or connect to the publisher bound on it), and call
+    callback(topic, payload) for each received event (in a thread)
+    """
+
+    def receive_events():
+        socket = zmq.Context.instance().socket(zmq.SUB)
+        if bind:
+            socket.bind(url)
+        else:
+            socket.connect(url)
+        for topic in topics:
+            socket.setsockopt(zmq.SUBSCRIBE, topic.encode())
+        logging.info(f'Subscribed to {", ".join(topics)} events on {url}')
+        while True:
+            topic, payload = socket.recv_multipart()
+            try:
+                callback(topic.decode(), json.loads(payload))
+            except Exception as e:
+                logging.error(f'Could not handle {topic.decode()} event: {str(e)}')
+
+    t = threading.Thread(target=receive_events, name='event-subscriber')
+    t.daemon = True
+    t.start()
+    return t
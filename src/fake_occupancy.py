@@ -0,0 +1,34 @@
+# Stand-in for the device finder: publish given home occupancy every N-seconds,
+# so alert checks can be tested without scanning the network.
+
+# Usage: python fake_occupancy.py --status away
+#        python fake_occupancy.py --status home --owners Edo,Enio --interval 5
+
+import argparse
+import logging
+import time
+from datetime import datetime
+
+import config
+from occupancy import create_occupancy_publisher, publish_occupancy
+
+if __name__ == '__main__':
+    # set up logger
+    logging.basicConfig(format=config.LOGGING_FORMAT, level=config.LOGGING_LEVEL, datefmt=config.LOGGING_DATE_FORMAT)
+    logger = logging.getLogger()
+
+    parser = argparse.ArgumentParser(description='Publish fake home occupancy')
+    parser.add_argument('--status', type=str, choices=['home', 'away'], help='occupancy status', required=True)
+    parser.add_argument('--owners', type=str, help='comma separated owners at home', default='')
+    parser.add_argument('--interval', type=float, help='publish every N-seconds', default=5)
+    parser.add_argument('--count', type=int, help='number of messages to publish (default: until Ctrl-C)', default=None)
+    args = parser.parse_args()
+
+    owners = [o for o in args.owners.split(',') if o]
+    publisher = create_occupancy_publisher()
+    n = 0
+    while args.count is None or n < args.count:
+        publish_occupancy(publisher, args.status, owners, datetime.now())
+        logging.info(f'Published occupancy: {args.status} {owners}')
+        n += 1
+        time.sleep(args.interval)
@@ -1,17 +1,18 @@
 import logging
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
-import pandas as pd
-from datetime import datetime
-import os
+from fastapi.responses import HTMLResponse, FileResponse
 import config
 from socket import gethostname
 import random
-from database import engine
+from cache import TTLCache
+from events import subscribe_events
+from database import Session, read_engine
 from detections import get_motion_analysis, get_objects_analysis
-from heart_beat import fetch_last_heart_beat, is_healthy
+from heart_beat import fetch_latest_heart_beat, is_healthy
+from image_catalog import find_images
+from thumbnails import create_thumbnail_cache
 
 # set up logger
 logging.basicConfig(format=config.LOGGING_FORMAT, level=config.LOGGING_LEVEL, datefmt=config.LOGGING_DATE_FORMAT)
@@ -21,6 +22,9 @@ logger = logging.getLogger()
 logging.info('Starting FastAPI app...')
 app = FastAPI()
 
+# frontend only reads from the DB
+Session.configure(bind=read_engine)
+
 # mount static folders
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/images", StaticFiles(directory=config.IMG_FOLDER), name="images")
@@ -28,6 +32,16 @@ app.mount("/images", StaticFiles(directory=config.IMG_FOLDER), name="images")
 # point Jinja2 to templates directory
 templates = Jinja2Templates(directory="templates")
 
+# gallery thumbnails are created on the first request
+thumbnail_cache = create_thumbnail_cache()
+
+# cache DB calls (many dashboards may be polling the same data), cached analysis is dropped
+# when camera workers save new detections (debounced, as all cameras save them every few seconds)
+analysis_cache = TTLCache(config.DETECTIONS_DATA_CACHE_TTL)
+heart_beat_cache = TTLCache(config.HEART_BEAT_DATA_CACHE_TTL)
+subscribe_events(config.DETECTION_EVENTS_BIND_URL, ['detections'],
+                 lambda topic, payload: analysis_cache.invalidate(min_interval=config.DETECTIONS_CACHE_DEBOUNCE_SEC))
+
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -51,25 +65,37 @@ async def read_root(request: Request):
 
 
 @app.get('/analysis')
-async def fetch_detections_analysis(at: str):
+def fetch_detections_analysis(at: str):
     """
     Return summary of today's detections vs last 6 days avg
     :param at: analysis_type: motion or objects - will determine which type of results to return
     """
+    def compute_analysis():
+        try:
+            # check analysis-type (at) in query string and fetch appropriate DB call
+            return get_motion_analysis() if at == 'motion' else get_objects_analysis()
+        finally:
+            Session.remove()
+
     try:
-        # check analysis-type (at) in query string and fetch appropriate DB call
-        results = get_motion_analysis(engine) if at == 'motion' else get_objects_analysis(engine)
+        results = analysis_cache.get(at, compute_analysis)
     except Exception as e:
         return {"**ERROR**": str(e)}, 500
     return results
 
 
 @app.get('/heart-beat')
-async def heart_beat():
-    """Return last heart beat recorded in the DB"""
+def heart_beat():
+    """Return last heart beat (kept by the heart beat hub, or recorded in the DB if the hub is down)"""
+    def compute_heart_beat():
+        try:
+            # grab last heart beat from the hub
+            return fetch_latest_heart_beat()
+        finally:
+            Session.remove()
+
     try:
-        # grab last heart beat from the DB
-        last_heart_beat = fetch_last_heart_beat()
+        last_heart_beat = heart_beat_cache.get('last', compute_heart_beat)
         # determine if last heart beat occurred within specified time
         heart_beat_status = is_healthy(last_heart_beat)
     except Exception as e:
@@ -77,25 +103,35 @@ async def heart_beat():
     return {"hb": last_heart_beat, "is_ok": heart_beat_status}
 
 
+@app.get('/cache-stats')
+def cache_stats():
+    """Return hit and miss counters of the response caches"""
+    return {'analysis': analysis_cache.stats(), 'heart_beat': heart_beat_cache.stats(),
+            'thumbnails': thumbnail_cache.stats()}
+
+
 @app.get('/get-images')
-async def get_images(inc_im_types: str, from_date: str, to_date: str, from_time: str, to_time: str):
+def get_images(inc_im_types: str, from_date: str, to_date: str, from_time: str, to_time: str,
+               cursor: str = None, limit: int = None):
+    """
+    Return a page of images of given types taken within the date and time ranges (from the image catalog),
+    pass next_cursor of the response as the cursor to get the next page
+    """
     # image types will be easier to compare if they are a list
     inc_im_types = inc_im_types.split(',')
-    filtered_files, filtered_timestamps = [], []
-    for dt in pd.date_range(from_date, to_date, freq='D'):
-        dt_dir = str(dt.date())
-        dt_full_path = f'{config.IMG_FOLDER}/{dt_dir}'
-        if not os.path.exists(dt_full_path):
-            continue
-        # define from timestamp and to timestamp
-        min_ts = datetime.strptime(f'{dt_dir} {from_time}', '%Y-%m-%d %H:%M')
-        max_ts = datetime.strptime(f'{dt_dir} {to_time}:59.999999', '%Y-%m-%d %H:%M:%S.%f')
-        all_images_in_path = [f for f in os.listdir(dt_full_path)]
-        all_images_in_path.sort()
-        for f in all_images_in_path:
-            img_ts = datetime.strptime(f'{dt_dir} {f[:13]}', '%Y-%m-%d %H%M%S.%f')
-            for im_type in inc_im_types:
-                if im_type in f and min_ts <= img_ts <= max_ts:
-                    filtered_files.append(f'{dt_dir}/{f}')
-                    filtered_timestamps.append(img_ts)
-    return {'files': filtered_files, 'timestamps': filtered_timestamps}
+    try:
+        images, next_cursor = find_images(inc_im_types, from_date, to_date, from_time, to_time, cursor, limit)
+        return {'files': [im.im_filename for im in images], 'timestamps': [im.create_ts for im in images],
+                'next_cursor': next_cursor}
+    finally:
+        Session.remove()
+
+
+@app.get('/thumbs/{im_filename:path}')
+def get_thumbnail(im_filename: str):
+    """Return thumbnail of the image (path relative to the images folder), images never change, so cache it forever"""
+    try:
+        thumb = thumbnail_cache.get(im_filename)
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail=f'Image {im_filename} not found')
+    return FileResponse(thumb, media_type='image/jpeg', headers={'Cache-Control': 'public, max-age=31536000, immutable'})
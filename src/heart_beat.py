@@ -4,13 +4,13 @@
 # Heart beats will be used to determine if camera stream is alive (it may
 # need to be restarted on some camera models).
 # Log and notify admin when camera needs to be restarted.
+# Latest heart beat of each device is kept in memory and served to the frontend over
+# a local REQ/REP socket, heart beats are written to the DB in batches.
 
 # Usage: python heart_beat.py
 
 import os
-import pandas as pd
 import imagezmq
-import cv2
 import traceback
 import sys
 import logging
@@ -19,19 +19,24 @@ import subprocess
 import config
 import time
 import threading
-from models import HeartBeat
+import zmq
+from typing import Optional
+from models import HeartBeat, Image
+from cameras import get_cameras, get_heart_beat_sub_urls
 from datetime import datetime, timedelta
 from database import Session
+from image_catalog import delete_images, image_row
 
 
-def is_healthy(heart_beat: HeartBeat) -> bool:
+def is_healthy(heart_beat: HeartBeat, now: datetime = None) -> bool:
     """
     Generate status based on if the heart beat occurred within
     last N-seconds, as per config setting.
     If True is returned, then heart beat is ok, otherwise video stream
     has been in idle mode for too long.
     """
-    max_age = datetime.now() - timedelta(seconds=config.HEART_BEAT_INTERVAL_MAX_IDLE_N_SEC)
+    now = datetime.now() if now is None else now
+    max_age = now - timedelta(seconds=config.HEART_BEAT_INTERVAL_MAX_IDLE_N_SEC)
     return heart_beat.create_ts >= max_age
 
 
@@ -43,13 +48,212 @@ def fetch_last_heart_beat() -> HeartBeat:
             .first())
 
 
-def hear_beat_monitor():
+def heart_beat_to_dict(heart_beat: HeartBeat) -> Optional[dict]:
+    if heart_beat is None:
+        return None
+    return {'create_ts': heart_beat.create_ts.isoformat(), 'im_filename': heart_beat.im_filename}
+
+
+def heart_beat_from_dict(d: dict) -> Optional[HeartBeat]:
+    if d is None:
+        return None
+    return HeartBeat(create_ts=datetime.fromisoformat(d['create_ts']), im_filename=d['im_filename'])
+
+
+class HeartBeatState:
+    """
+    Latest heart beat of each device kept in memory (so nobody needs to query the DB for it),
+    received heart beats (and catalog rows of the saved heart beat images) are queued and written
+    to the DB in batches, instead of a commit (fsync on the SD card) for each message
+    """
+
+    def __init__(self, last_heart_beat: HeartBeat = None):
+        self._lock = threading.Lock()
+        self._devices = {}  # device name -> last HeartBeat
+        self._pending = []  # heart beats not written to the DB yet
+        self._pending_images = []  # catalog rows of the saved images, not written to the DB yet
+        # last heart beat from the DB, used until the first heart beat is received
+        self._initial = None
+        if last_heart_beat is not None:
+            self._initial = HeartBeat(create_ts=last_heart_beat.create_ts, im_filename=last_heart_beat.im_filename)
+        self.flushed = 0
+
+    def update(self, dev_name: str, create_ts: datetime, im_filename: str):
+        with self._lock:
+            self._devices[dev_name] = HeartBeat(create_ts=create_ts, im_filename=im_filename)
+            self._pending.append({'create_ts': create_ts, 'im_filename': im_filename})
+
+    def add_image(self, row: dict):
+        """Queue catalog row of a saved heart beat image (it is written with the next batch)"""
+        with self._lock:
+            self._pending_images.append(row)
+
+    def devices(self) -> dict:
+        """Return last heart beat of each device"""
+        with self._lock:
+            return dict(self._devices)
+
+    def forget(self, dev_names: list):
+        """Drop the devices (e.g. cameras removed from the config), so they are not reported anymore"""
+        with self._lock:
+            for dev_name in dev_names:
+                self._devices.pop(dev_name, None)
+
+    def latest(self) -> Optional[HeartBeat]:
+        """Return last heart beat of any device"""
+        with self._lock:
+            heart_beats = list(self._devices.values())
+        if not heart_beats:
+            return self._initial
+        return max(heart_beats, key=lambda hb: hb.create_ts)
+
+    def to_dict(self) -> dict:
+        return {'latest': heart_beat_to_dict(self.latest()),
+                'devices': {name: heart_beat_to_dict(hb) for name, hb in self.devices().items()}}
+
+    def flush(self) -> int:
+        """
+        Write pending heart beats (and catalog rows of the images) to the DB in a single transaction,
+        return number of heart beats written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            pending_images, self._pending_images = self._pending_images, []
+        if not pending and not pending_images:
+            return 0
+        try:
+            if pending:
+                Session.execute(HeartBeat.__table__.insert(), pending)
+            if pending_images:
+                Session.execute(Image.__table__.insert(), pending_images)
+            Session.commit()
+        except Exception as e:
+            Session.rollback()
+            logging.error(f'Could not save {len(pending)} heart beats and {len(pending_images)} images: {str(e)}')
+            # keep them for the next attempt
+            with self._lock:
+                self._pending = pending + self._pending
+                self._pending_images = pending_images + self._pending_images
+            return 0
+        finally:
+            Session.remove()
+        self.flushed += len(pending)
+        return len(pending)
+
+
+class HeartBeatImages:
+    """
+    Save heart beat images of each device once per minute (to save some space on the Pi),
+    and keep the last saved image of each device, which is reported with its heart beats
+    (images are added to the catalog with the next batch of heart beats)
+    """
+
+    def __init__(self, state: HeartBeatState, img_folder: str = None):
+        self.state = state
+        self.img_folder = config.IMG_FOLDER if img_folder is None else img_folder
+        self._minutes = {}  # device name -> minute of the last saved image
+        self._last_files = {}  # device name -> path of the last saved image
+
+    def save(self, dev_name: str, jpg_buffer: bytes, now: datetime) -> str:
+        """Save the image, unless the device had one saved in this minute, return the last image of the device"""
+        curr_min = now.replace(second=0, microsecond=0)
+        if self._minutes.get(dev_name) != curr_min:
+            date_folder = f'{self.img_folder}/{str(now.date())}'
+            if not path.exists(date_folder):
+                mkdir(date_folder)
+            img_name = f"{str(now)[11:].replace(':', '')}_{config.HEART_BEAT_FILES_IDENTIFIER}.jpg"
+            with open(f'{date_folder}/{img_name}', 'wb') as f:
+                f.write(jpg_buffer)
+            self.state.add_image(image_row(f'{date_folder}/{img_name}', now, config.HEART_BEAT_FILES_IDENTIFIER,
+                                           dev_name.split(':')[-1]))
+            logging.info(f'Saving Heart-Beat file of {dev_name}: {date_folder}/{img_name}')
+            self._minutes[dev_name] = curr_min
+            self._last_files[dev_name] = f'{date_folder}/{img_name}'
+        return self._last_files[dev_name]
+
+
+def persist_heart_beats(state: HeartBeatState):
+    """Keep writing received heart beats to the DB every N-seconds"""
+    while True:
+        time.sleep(config.HEART_BEAT_DB_FLUSH_SEC)
+        n = state.flush()
+        logging.debug(f'Saved {n} heart beats in the DB')
+
+
+def serve_heart_beat_state(state: HeartBeatState):
+    """Reply to each request on the state socket with the last heart beats (as JSON)"""
+    socket = zmq.Context.instance().socket(zmq.REP)
+    socket.bind(config.HEART_BEAT_STATE_BIND_URL)
+    logging.info(f'Serving heart beat state on {config.HEART_BEAT_STATE_BIND_URL}')
+    while True:
+        socket.recv()
+        socket.send_json(state.to_dict())
+
+
+def fetch_heart_beat_state(timeout_ms: int = None) -> Optional[dict]:
+    """Ask the heart beat hub for the last heart beats, return None if it does not reply in time"""
+    timeout_ms = config.HEART_BEAT_STATE_TIMEOUT_MS if timeout_ms is None else timeout_ms
+    socket = zmq.Context.instance().socket(zmq.REQ)
+    # do not block on close, if the hub is not running
+    socket.setsockopt(zmq.LINGER, 0)
+    try:
+        socket.connect(config.HEART_BEAT_STATE_URL)
+        socket.send(b'')
+        if not socket.poll(timeout_ms):
+            return None
+        return socket.recv_json()
+    finally:
+        socket.close()
+
+
+def fetch_latest_heart_beat() -> HeartBeat:
+    """Get last HeartBeat from the heart beat hub, or from the DB if the hub is not available"""
+    state = fetch_heart_beat_state()
+    if state is None or state['latest'] is None:
+        logging.debug('Heart beat hub not available, fetching last heart beat from the DB')
+        return fetch_last_heart_beat()
+    return heart_beat_from_dict(state['latest'])
+
+
+def get_monitored_camera_ids() -> list:
+    """Return IDs of the configured cameras, which send heart beats"""
+    return [c['id'] for c in get_cameras()
+            if c.get('config', {}).get('HEART_BEAT_ENABLED', config.HEART_BEAT_ENABLED)]
+
+
+def find_stalled_cameras(state: HeartBeatState, camera_ids: list, since: datetime, now: datetime = None) -> list:
+    """
+    Return IDs of the cameras without a recent heart beat, cameras are given time to start
+    since the given time (monitor start or backend restart). Devices of the cameras, which are
+    not configured anymore, are forgotten once they stop sending heart beats.
+    """
+    last_heart_beats = {}
+    unknown = []
+    for dev_name, heart_beat in state.devices().items():
+        # device name is <hostname>:<camera ID>
+        camera_id = dev_name.split(':')[-1]
+        if camera_id not in camera_ids:
+            if not is_healthy(heart_beat, now):
+                unknown.append(dev_name)
+        elif camera_id not in last_heart_beats or heart_beat.create_ts > last_heart_beats[camera_id]:
+            last_heart_beats[camera_id] = heart_beat.create_ts
+    if unknown:
+        logging.info(f'Forgetting devices, which are not configured anymore: {", ".join(unknown)}')
+        state.forget(unknown)
+    return [camera_id for camera_id in camera_ids
+            if not is_healthy(HeartBeat(create_ts=max(last_heart_beats.get(camera_id, since), since)), now)]
+
+
+def hear_beat_monitor(state: HeartBeatState):
     """
     Keep running a heart beat every N-seconds:
     - Check if images need to be archived
-    - If heart beat is not detected in N-seconds, restart video capture process
+    - If heart beat is not detected from any camera in N-seconds, restart the backend
+      (dead camera workers are restarted by the camera supervisor in the backend)
     """
     SLEEP_TIME = 30
+    # cameras are given time to start since the monitor start (or the last restart of the backend)
+    start_ts = datetime.now()
     prev_day = None
     while True:
         logging.debug('Heart beat triggered')
@@ -68,7 +272,7 @@ def hear_beat_monitor():
             # calculate dates to keep based on configuration
             now = datetime.now()
             min_date = now - timedelta(days=config.USE_HISTORICAL_DAYS)
-            keep_dates = [str(dt.date()) for dt in pd.date_range(min_date, now)]
+            keep_dates = [str(min_date.date() + timedelta(days=i)) for i in range((now - min_date).days + 1)]
 
             # figure out candidates for image deletion
             del_dirs = [dt for dt in all_im_folders if dt not in keep_dates]
@@ -77,9 +281,12 @@ def hear_beat_monitor():
             for dt in del_dirs:
                 logging.info(f'Checking folder for old heart beat images: {dt}')
                 dt_dir = f'{config.IMG_FOLDER}/{dt}'
-                for f in [f for f in os.listdir(dt_dir) if config.HEART_BEAT_FILES_IDENTIFIER in f]:
+                del_files = [f for f in os.listdir(dt_dir) if config.HEART_BEAT_FILES_IDENTIFIER in f]
+                for f in del_files:
                     logging.info(f'Delete file: {f}')
                     os.unlink(f'{dt_dir}/{f}')
+                # remove deleted images from the catalog
+                delete_images([f'{dt}/{f}' for f in del_files])
 
             # set prev day to curr day
             prev_day = curr_day
@@ -87,14 +294,15 @@ def hear_beat_monitor():
         # ==================================
         # === Detect frozen video stream ===
         # ==================================
-        # grab last heart beat from the DB
-        last_heart_beat = fetch_last_heart_beat()
+        # check last heart beat of each configured camera (kept in memory)
+        camera_ids = get_monitored_camera_ids()
+        stalled = find_stalled_cameras(state, camera_ids, start_ts)
+        if stalled:
+            logging.info(f'No heart beat received from camera(s): {", ".join(stalled)}')
 
-        # determine if last heart beat occurred within specified time
-        heart_beat_status = is_healthy(last_heart_beat)
-
-        # if heart beat is not healthy - restart backend process
-        if not heart_beat_status:
+        # if none of the cameras sends heart beats, the backend is down or frozen - restart backend process
+        # (a single camera worker, which died, is restarted by the backend itself)
+        if camera_ids and len(stalled) == len(camera_ids):
             # construct command
             CMD = f'/usr/bin/sudo /usr/bin/supervisorctl restart third-eye-backend'
             logging.info(f'Video stalled, restarting backend: {CMD}')
@@ -103,56 +311,57 @@ def hear_beat_monitor():
             p = subprocess.Popen(CMD.split(' '), stdout=subprocess.PIPE)
             out, err = p.communicate()
             logging.info(str(out))
+            start_ts = datetime.now()
 
         # wait for a while before going into next iteration
         logging.debug(f'Waiting for {SLEEP_TIME} seconds')
         time.sleep(SLEEP_TIME)
 
 
-def main():
-    """Collect messages from the message queue and save heart beats in the DB"""
+def main(state: HeartBeatState):
+    """Collect messages from the message queue and keep heart beats in memory (saved in the DB in batches)"""
     try:
-        logging.info(f'Starting MQ server on {config.HEART_BEAT_SUB_URL}')
-        with imagezmq.ImageHub(open_port=config.HEART_BEAT_SUB_URL, REQ_REP=False) as image_hub:
+        sub_urls = get_heart_beat_sub_urls()
+        logging.info(f'Starting MQ server on {", ".join(sub_urls)}')
+        with imagezmq.ImageHub(open_port=sub_urls[0], REQ_REP=False) as image_hub:
+            # subscribe to heart beats of other cameras
+            for url in sub_urls[1:]:
+                image_hub.connect(url)
             logging.info(f'Ready to collect messages')
-            # keep track of current minute, as files will be saved once per minute
-            prev_min = None
+            # files are saved once per minute for each device
+            images = HeartBeatImages(state)
             while True:  # receive images until Ctrl-C is pressed
-                dev_name, image = image_hub.recv_image()
-                # logging.debug(f'Heart beat received from {dev_name} with image shape {image.shape}')
+                # heart beat images are sent as JPEG, so they can be saved without decoding
+                dev_name, jpg_buffer = image_hub.recv_jpg()
+                # logging.debug(f'Heart beat received from {dev_name} ({len(jpg_buffer)} bytes)')
                 # get current date/time
                 now = datetime.now()
-                # make sure we only save 1 file per minute (to save some space on the Pi)
-                curr_min = now.minute
-                if curr_min != prev_min:
-                    date_folder = f'{config.IMG_FOLDER}/{str(now.date())}'
-                    if not path.exists(date_folder):
-                        mkdir(date_folder)
-                    # save image in the images folder on each new minute
-                    img_name = f"{str(now)[11:].replace(':', '')}_{config.HEART_BEAT_FILES_IDENTIFIER}.jpg"
-                    cv2.imwrite(f'{date_folder}/{img_name}', image)
-                    logging.info(f'Saving Heart-Beat file: {date_folder}/{img_name}')
-                    prev_min = curr_min
-                # save heart beat in the DB
-                hb = HeartBeat(create_ts=datetime.now(), im_filename=f'{date_folder}/{img_name}')
-                Session.add(hb)
-                Session.commit()
+                im_filename = images.save(dev_name, jpg_buffer, now)
+                # update heart beat state (it will be saved in the DB with the next batch)
+                state.update(dev_name, now, im_filename)
     except (KeyboardInterrupt, SystemExit):
         pass  # Ctrl-C was pressed to end program
     except Exception as e:
         logging.error(f'Python error with no Exception handler: {str(e)}')
         logging.error(str(traceback.print_exc()))
     finally:
+        # do not lose heart beats which were not written to the DB yet
+        state.flush()
         sys.exit()
 
 
 if __name__ == '__main__':
     logging.basicConfig(format=config.LOGGING_FORMAT, level=config.LOGGING_LEVEL, datefmt=config.LOGGING_DATE_FORMAT)
     logger = logging.getLogger()
-    # kick off hear_beat_monitor in a separate thread
-    t = threading.Thread(target=hear_beat_monitor)
-    t.daemon = True
-    t.start()
+    # start with the last heart beat recorded in the DB
+    heart_beat_state = HeartBeatState(fetch_last_heart_beat())
+    Session.remove()
+
+    # kick off hear_beat_monitor, batch DB writer and state server in separate threads
+    for target in (hear_beat_monitor, persist_heart_beats, serve_heart_beat_state):
+        t = threading.Thread(target=target, args=(heart_beat_state,))
+        t.daemon = True
+        t.start()
 
     # kick off main message subscriber in the main thread
-    main()
+    main(heart_beat_state)
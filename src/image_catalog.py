@@ -0,0 +1,129 @@
+# Catalog of images saved in the images folder (intruder and heart beat images).
+# Images are added to the catalog when they are written, so the gallery can find
+# them by type and time with an indexed query, instead of scanning all the folders.
+
+# Usage (add images which are already on disk to the catalog): python image_catalog.py
+
+import logging
+import os
+from datetime import datetime, timedelta
+from os import path
+from typing import Optional
+
+from sqlalchemy import and_, or_
+
+import config
+from database import Session
+from models import Image
+
+
+def parse_image_filename(im_filename: str) -> Optional[tuple]:
+    """
+    Return (create_ts, im_type) of the image from its path: <date>/<HHMMSS.ffffff>_<im_type>.jpg,
+    or None if the file name does not follow this format
+    """
+    try:
+        dt_dir, f = im_filename.replace('\\', '/').split('/')[-2:]
+        ts_part, im_type = path.splitext(f)[0].split('_', 1)
+        # str(datetime) has no microseconds part if they are 0
+        fmt = '%Y-%m-%d %H%M%S.%f' if '.' in ts_part else '%Y-%m-%d %H%M%S'
+        return datetime.strptime(f'{dt_dir} {ts_part}', fmt), im_type
+    except ValueError:
+        return None
+
+
+def image_row(im_path: str, create_ts: datetime, im_type: str, camera_id: str = None) -> dict:
+    """Return catalog row of the image saved in the images folder (e.g. for bulk inserts)"""
+    im_filename = path.relpath(im_path, config.IMG_FOLDER).replace('\\', '/')
+    return {'create_ts': create_ts, 'im_type': im_type, 'im_filename': im_filename, 'camera_id': camera_id}
+
+
+def add_image(im_path: str, create_ts: datetime, im_type: str, camera_id: str = None) -> Image:
+    """
+    Add image saved in the images folder to the catalog (current session), caller commits it,
+    usually together with other rows, so there is no commit (fsync) for each image
+    """
+    image = Image(**image_row(im_path, create_ts, im_type, camera_id))
+    Session.add(image)
+    return image
+
+
+def delete_images(im_filenames: list):
+    """Remove images (paths relative to the images folder) from the catalog"""
+    if not im_filenames:
+        return
+    Session.query(Image).filter(Image.im_filename.in_(im_filenames)).delete(synchronize_session=False)
+    Session.commit()
+
+
+def encode_cursor(image: Image) -> str:
+    return f'{image.create_ts.isoformat()},{image.id}'
+
+
+def decode_cursor(cursor: str) -> tuple:
+    ts, im_id = cursor.rsplit(',', 1)
+    return datetime.fromisoformat(ts), int(im_id)
+
+
+def find_images(im_types: list, from_date: str, to_date: str, from_time: str, to_time: str,
+                cursor: str = None, limit: int = None) -> tuple:
+    """
+    Find images of given types, taken between from_date and to_date, and between from_time and to_time
+    (HH:MM) on each of these days. Images are ordered by time, and returned in pages of
+    up to limit images: return (images, cursor of the next page or None if this is the last page)
+    """
+    limit = config.IMAGES_PAGE_SIZE if limit is None else limit
+    # a range of timestamps for each day, so the (im_type, create_ts) index can be used
+    ranges = []
+    day = datetime.strptime(from_date, '%Y-%m-%d')
+    while day <= datetime.strptime(to_date, '%Y-%m-%d'):
+        dt_dir = str(day.date())
+        min_ts = datetime.strptime(f'{dt_dir} {from_time}', '%Y-%m-%d %H:%M')
+        max_ts = datetime.strptime(f'{dt_dir} {to_time}:59.999999', '%Y-%m-%d %H:%M:%S.%f')
+        ranges.append(Image.create_ts.between(min_ts, max_ts))
+        day += timedelta(days=1)
+    if not ranges:
+        return [], None
+    query = Session.query(Image).filter(Image.im_type.in_(im_types), or_(*ranges))
+    if cursor:
+        # continue after the last image of the previous page
+        last_ts, last_id = decode_cursor(cursor)
+        query = query.filter(or_(Image.create_ts > last_ts, and_(Image.create_ts == last_ts, Image.id > last_id)))
+    images = query.order_by(Image.create_ts, Image.id).limit(limit + 1).all()
+    if len(images) > limit:
+        return images[:limit], encode_cursor(images[limit - 1])
+    return images, None
+
+
+def index_images(img_folder: str = None) -> int:
+    """Add images in the images folder, which are not in the catalog yet, return number of images added"""
+    img_folder = config.IMG_FOLDER if img_folder is None else img_folder
+    n_added = 0
+    for dt_dir in sorted(os.listdir(img_folder)):
+        dt_full_path = f'{img_folder}/{dt_dir}'
+        if not path.isdir(dt_full_path):
+            continue
+        indexed = {im_filename for im_filename, in (Session
+                                                    .query(Image.im_filename)
+                                                    .filter(Image.im_filename.like(f'{dt_dir}/%')))}
+        rows = []
+        for f in sorted(os.listdir(dt_full_path)):
+            im_filename = f'{dt_dir}/{f}'
+            parsed = parse_image_filename(im_filename)
+            if im_filename in indexed or parsed is None:
+                continue
+            rows.append({'create_ts': parsed[0], 'im_type': parsed[1], 'im_filename': im_filename})
+        if rows:
+            # single transaction per folder
+            Session.execute(Image.__table__.insert(), rows)
+            Session.commit()
+            n_added += len(rows)
+        logging.info(f'Folder {dt_dir}: {len(rows)} image(s) added to the catalog')
+    return n_added
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format=config.LOGGING_FORMAT, level=config.LOGGING_LEVEL, datefmt=config.LOGGING_DATE_FORMAT)
+    logging.info(f'Indexing images in {config.IMG_FOLDER}')
+    n = index_images()
+    logging.info(f'Done, {n} image(s) added to the catalog')
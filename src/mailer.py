@@ -2,30 +2,47 @@ import os
 import smtplib
 import ssl
 import logging
-from datetime import datetime
+import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from email.mime.image import MIMEImage
 from email.mime.application import MIMEApplication
 
+import cv2
+import simplejpeg
+
 import config
 
 
-def send(msg_body: str, msg_attachment_path: str = None):
-    ctx = ssl.create_default_context()
-    receivers = config.RECEIVER_EMAIL_ADDRESSES.split(",")
+def prepare_attachment(path: str, max_width: int = None, quality: int = None) -> bytes:
+    """
+    Read the image and downscale it to max width (DCT scaling while decoding, then resize),
+    and recompress it with lower quality, so the alert email stays small
+    """
+    max_width = config.NOTIFICATION_IMG_MAX_WIDTH if max_width is None else max_width
+    quality = config.NOTIFICATION_JPEG_QUALITY if quality is None else quality
+    with open(path, 'rb') as f:
+        data = f.read()
+    if simplejpeg.is_jpeg(data):
+        img = simplejpeg.decode_jpeg(data, colorspace='BGR', min_width=max_width)
+    else:
+        img = cv2.imread(path)
+        if img is None:
+            raise ValueError(f'Could not read image {path}')
+    if img.shape[1] > max_width:
+        height = int(img.shape[0] * max_width / img.shape[1])
+        img = cv2.resize(img, (max_width, height), interpolation=cv2.INTER_AREA)
+    return simplejpeg.encode_jpeg(img, quality=quality, colorspace='BGR')
+
 
-    message = MIMEMultipart("alternative")
-    message["Subject"] = f"Third Eye alert - {str(datetime.now())}"
+def build_message(subject: str, msg_body: str, receivers: list, attachment: bytes = None,
+                  attachment_name: str = None) -> MIMEMultipart:
+    """Compose email with plain text and html body, and an optional (jpeg) attachment"""
+    message = MIMEMultipart("mixed")
+    message["Subject"] = subject
     message["From"] = config.EMAIL_SENDER_ADDRESS
     message["To"] = ", ".join(receivers)
 
-    if msg_attachment_path:
-        with open(msg_attachment_path, "rb") as f:
-            file = MIMEApplication(f.read())
-        disposition = f"attachment; filename={os.path.basename(msg_attachment_path)}"
-        file.add_header("Content-Disposition", disposition)
-        message.attach(file)
-
     html = f"""
     <html>
       <body>
@@ -36,13 +53,118 @@ def send(msg_body: str, msg_attachment_path: str = None):
     </html>
     """
 
-    message.attach(MIMEText(msg_body, "plain"))
-    message.attach(MIMEText(html, "html"))
+    body = MIMEMultipart("alternative")
+    body.attach(MIMEText(msg_body, "plain"))
+    body.attach(MIMEText(html, "html"))
+    message.attach(body)
+
+    if attachment is not None:
+        file = MIMEImage(attachment, "jpeg") if simplejpeg.is_jpeg(attachment) else MIMEApplication(attachment)
+        file.add_header("Content-Disposition", f"attachment; filename={attachment_name}")
+        message.attach(file)
+    return message
+
+
+class SmtpClient:
+    """
+    SMTP connection kept open between emails, so TLS handshake and login are done once, not for each
+    email: SSL is used for port 465, otherwise STARTTLS, which is mandatory, unless unencrypted connections
+    are allowed (SMTP_ALLOW_INSECURE, e.g. for a local relay), credentials are never sent without TLS.
+    Connection is re-opened if the server dropped it, and closed after N-seconds without any email sent.
+    """
+
+    def __init__(self, host: str = None, port: int = None, user: str = None, password: str = None,
+                 timeout: float = None, idle_timeout: float = None, allow_insecure: bool = None):
+        self.host = config.SMTP_SERVER_HOST if host is None else host
+        self.port = config.SMTP_SERVER_PORT if port is None else port
+        self.user = config.EMAIL_SENDER_ADDRESS if user is None else user
+        self.password = config.EMAIL_SENDER_PASSWORD if password is None else password
+        self.timeout = config.SMTP_TIMEOUT_SEC if timeout is None else timeout
+        self.idle_timeout = config.SMTP_IDLE_TIMEOUT_SEC if idle_timeout is None else idle_timeout
+        self.allow_insecure = config.SMTP_ALLOW_INSECURE if allow_insecure is None else allow_insecure
+        self.server = None
+        self.last_used_ts = None
+        self.connects = 0
+        self.sent = 0
+
+    def connect(self):
+        ctx = ssl.create_default_context()
+        logging.info(f'Connecting to SMTP server {self.host}:{self.port}')
+        if self.port == 465:
+            server = smtplib.SMTP_SSL(self.host, port=self.port, context=ctx, timeout=self.timeout)
+            encrypted = True
+        else:
+            server = smtplib.SMTP(self.host, port=self.port, timeout=self.timeout)
+            encrypted = False
+        try:
+            if not encrypted:
+                server.ehlo()
+                if server.has_extn('starttls'):
+                    server.starttls(context=ctx)
+                    server.ehlo()
+                    encrypted = True
+                elif not self.allow_insecure:
+                    # STARTTLS could be stripped from the reply, do not fall back to plain text
+                    raise smtplib.SMTPNotSupportedError(f'SMTP server {self.host}:{self.port} does not support'
+                                                        f' STARTTLS, and unencrypted connections are not allowed')
+                else:
+                    logging.warning(f'Unencrypted connection to SMTP server {self.host}:{self.port}, no login')
+            # login only over TLS, and only if the server supports authentication (local relays often do not)
+            if encrypted and self.password and server.has_extn('auth'):
+                server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.connects += 1
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+        self.server = None
+
+    def close_if_idle(self):
+        if self.server is not None and time.monotonic() - self.last_used_ts >= self.idle_timeout:
+            logging.debug('Closing idle SMTP connection')
+            self.close()
 
-    with smtplib.SMTP_SSL("smtp.gmail.com", port=465, context=ctx) as server:
+    def send(self, message: MIMEMultipart, receivers: list):
+        """Send the message (raises on failure), open the connection again if it was dropped"""
+        if self.server is None:
+            self.connect()
         try:
-            server.login(config.EMAIL_SENDER_ADDRESS, config.EMAIL_SENDER_PASSWORD)
-            server.sendmail(config.EMAIL_SENDER_ADDRESS, receivers, message.as_string())
-            logging.info(f'Email sent to {receivers}.')
-        except Exception as e:
-            logging.error(f'Email error: {str(e)}')
+            self.server.sendmail(self.user, receivers, message.as_string())
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # connection went stale since the last email, try once more with a new one
+            self.server = None
+            self.connect()
+            self.server.sendmail(self.user, receivers, message.as_string())
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # email rejected by the server, connection itself can be reused
+            raise
+        except Exception:
+            # connection state is unknown, start with a new one next time
+            self.close()
+            raise
+        finally:
+            self.last_used_ts = time.monotonic()
+        self.sent += 1
+        logging.info(f'Email sent to {receivers}.')
+
+
+def send_email(client: SmtpClient, subject: str, msg_body: str, msg_attachment_path: str = None):
+    """Send email with a downscaled image attachment to the receivers (raises on failure)"""
+    receivers = config.RECEIVER_EMAIL_ADDRESSES.split(",")
+    attachment = None
+    if msg_attachment_path:
+        # image could be removed (by the clean up) before the email was sent
+        if os.path.exists(msg_attachment_path):
+            attachment = prepare_attachment(msg_attachment_path)
+        else:
+            logging.warning(f'Attachment {msg_attachment_path} not found, sending email without it')
+    attachment_name = os.path.splitext(os.path.basename(msg_attachment_path or ''))[0] + '.jpg'
+    client.send(build_message(subject, msg_body, receivers, attachment, attachment_name), receivers)
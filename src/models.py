@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Float, JSON, Index
 from database import Base, engine
 
 
@@ -9,6 +9,18 @@ class HeartBeat(Base):
     im_filename = Column(String(125), unique=False, index=False, nullable=False)
 
 
+class Image(Base):
+    """Catalog of images saved in the images folder (intruder and heart beat images)"""
+    __tablename__ = "images"
+    id = Column(Integer, primary_key=True, index=True)
+    create_ts = Column(DateTime, unique=False, index=False, nullable=False)
+    im_type = Column(String(25), unique=False, index=False, nullable=False)  # file identifier, e.g. HEART-BEAT
+    im_filename = Column(String(125), unique=True, index=False, nullable=False)  # relative to the images folder
+    camera_id = Column(String(25), unique=False, index=False, nullable=True)
+    # range queries by image type and time
+    __table_args__ = (Index('ix_images_im_type_create_ts', 'im_type', 'create_ts'),)
+
+
 class StreamConnection(Base):
     __tablename__ = "stream_connections"
     id = Column(Integer, primary_key=True, index=True)
@@ -29,6 +41,23 @@ class Alert(Base):
     alert_metadata = Column(JSON, nullable=True)
 
 
+class Notification(Base):
+    """Outbox of notifications (alert emails), sent by the notification worker, retried with backoff"""
+    __tablename__ = "notifications"
+    id = Column(Integer, primary_key=True, index=True)
+    create_ts = Column(DateTime, unique=False, index=False, nullable=False)
+    update_ts = Column(DateTime, unique=False, index=False, nullable=True)
+    status = Column(String(10), unique=False, index=False, nullable=False)  # pending, sending, sent or failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_ts = Column(DateTime, unique=False, index=False, nullable=False)
+    subject = Column(String(255), unique=False, index=False, nullable=False)
+    body = Column(String, unique=False, index=False, nullable=False)
+    attachment_path = Column(String(255), unique=False, index=False, nullable=True)
+    last_error = Column(String(500), unique=False, index=False, nullable=True)
+    # worker looks up notifications due to be sent
+    __table_args__ = (Index('ix_notifications_status_next_attempt_ts', 'status', 'next_attempt_ts'),)
+
+
 class HomeOccupancy(Base):
     __tablename__ = "home_occupancy"
     id = Column(Integer, primary_key=True, index=True)
@@ -48,6 +77,8 @@ class Detection(Base):
     w = Column(Integer, nullable=False)
     h = Column(Integer, nullable=False)
     area = Column(Integer, nullable=False)  # contour or bounding box area
+    zone = Column(String(50), unique=False, index=False, nullable=True)  # secure zone the detection falls in
+    camera_id = Column(String(25), unique=False, index=False, nullable=True)
 
 
 # (datetime.now(), (x, y, w, h), cv2.contourArea(cnt))
@@ -72,6 +103,21 @@ class ObjectDetection(Detection):
         self.cy = int((self.y + self.h) / 2)
 
 
+class MotionRollup(Base):
+    """Number of motion detections per hour (updated as detections are saved)"""
+    __tablename__ = "motion_rollups"
+    hour_ts = Column(DateTime, primary_key=True)
+    motion_count = Column(Integer, nullable=False, default=0)
+
+
+class ObjectRollup(Base):
+    """Number of distinct objects per hour and label (updated as detections are saved)"""
+    __tablename__ = "object_rollups"
+    hour_ts = Column(DateTime, primary_key=True)
+    label = Column(String(125), primary_key=True)
+    obj_count = Column(Integer, nullable=False, default=0)
+
+
 # create DB schema if this script is called directly
 if __name__ == "__main__":
     Base.metadata.create_all(engine)
@@ -0,0 +1,83 @@
+import logging
+
+import cv2
+import numpy as np
+
+import config
+
+
+class MotionDetector:
+    """
+    Background subtraction based motion detector. It can be fed either with the
+    whole (grayscale) frame or with a crop of it (e.g. secure zone ROI),
+    in which case offset of the crop is used to translate the results back
+    to the frame coordinates. Input can be also downscaled before the background
+    subtraction (its cost grows with the number of pixels), in which case boxes
+    and areas are projected back to the scale of the input frame.
+    """
+
+    def __init__(self, history: int = None, var_threshold: int = None, detect_shadows: bool = None,
+                 min_area: int = None):
+        self.history = config.BG_SUB_HISTORY if history is None else history
+        self.var_threshold = config.BG_SUB_THRESH if var_threshold is None else var_threshold
+        self.detect_shadows = config.BG_SUB_SHADOWS if detect_shadows is None else detect_shadows
+        self.min_area = min_area
+        self.bg_subtr = None
+        self.input_shape = None
+        # detector is not ready initially (it needs to have a few frames to learn the background)
+        self.frames_seen = 0
+        self.ready = False
+
+    def reset(self, input_shape: tuple):
+        """Create a new background model (needed when the size of the input changes)"""
+        logging.info(f'Initializing background subtractor for input of shape {input_shape}')
+        self.bg_subtr = cv2.createBackgroundSubtractorMOG2(history=self.history,
+                                                           varThreshold=self.var_threshold,
+                                                           detectShadows=self.detect_shadows)
+        self.input_shape = input_shape
+        self.frames_seen = 0
+        self.ready = False
+
+    def detect(self, frame_gray: np.ndarray, offset: tuple = (0, 0), scale: float = 1.0) -> list:
+        """
+        Update background model with the frame and return a list of
+        motion boxes: (x, y, w, h, contour area) in frame coordinates,
+        only contours with area of at least MIN_OBJ_AREA are returned
+        (area is always compared in the frame scale)
+        """
+        # downscale the input if motion detection runs at lower resolution
+        if scale != 1.0:
+            frame_gray = cv2.resize(frame_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        if frame_gray.shape != self.input_shape:
+            self.reset(frame_gray.shape)
+
+        # perform motion detection
+        mask = self.bg_subtr.apply(frame_gray)
+
+        # check if we have enough images to detect motion
+        self.frames_seen += 1
+        if not self.ready:
+            if self.frames_seen >= self.history:
+                logging.info(f'Motion detector ready (counter is {self.frames_seen})')
+                self.ready = True
+            return []
+
+        # find contours from motion detection algorithm
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        min_area = config.MIN_OBJ_AREA if self.min_area is None else self.min_area
+        off_x, off_y = offset
+        boxes = []
+        for cnt in contours:
+            # if area of a contour is less than a threshold, we don't have a motion
+            # (area is projected back to the frame scale, so the threshold keeps its meaning)
+            cnt_area = cv2.contourArea(cnt) / (scale * scale)
+            if cnt_area < min_area:
+                continue
+            # project the box back to the frame scale and shift it by the offset,
+            # so it's expressed in the frame coordinates
+            (x, y, w, h) = cv2.boundingRect(cnt)
+            boxes.append((int(x / scale) + off_x, int(y / scale) + off_y,
+                          int(round(w / scale)), int(round(h / scale)), cnt_area))
+        return boxes
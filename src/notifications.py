@@ -0,0 +1,147 @@
+# Notification outbox: the alert path only adds a notification row into the DB (in the same
+# transaction as the alert), and a single long-lived worker (in the backend process) sends the
+# pending notifications over a reused SMTP connection, failed ones are retried with exponential backoff.
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+import config
+from mailer import SmtpClient, send_email
+from models import Notification
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+def create_notification(subject: str, msg_body: str, attachment_path: str = None,
+                        now: datetime = None) -> Notification:
+    """Create a pending notification (caller adds it into its session and commits)"""
+    now = datetime.now() if now is None else now
+    return Notification(create_ts=now, update_ts=now, status=PENDING, attempts=0, next_attempt_ts=now,
+                        subject=subject, body=msg_body, attachment_path=attachment_path)
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds to wait before the next attempt (exponential backoff, capped)"""
+    return min(config.NOTIFICATION_RETRY_BASE_SEC * 2 ** (attempts - 1), config.NOTIFICATION_RETRY_MAX_SEC)
+
+
+class NotificationWorker:
+    """
+    Keep sending pending notifications from the outbox, checked every N-seconds (the outbox is polled,
+    as notifications are added by the camera worker processes). Notifications are claimed
+    (pending -> sending) before they are sent, so they are never sent twice, even if more workers were running.
+    After N failed attempts, notification is marked as failed and not retried anymore.
+    """
+
+    def __init__(self, db_engine, client: SmtpClient = None, poll_interval: float = None, max_attempts: int = None,
+                 batch_size: int = 10):
+        self.db_engine = db_engine
+        self.client = SmtpClient() if client is None else client
+        self.poll_interval = config.NOTIFICATION_POLL_INTERVAL_SEC if poll_interval is None else poll_interval
+        self.max_attempts = config.NOTIFICATION_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self.batch_size = batch_size
+        self.table = Notification.__table__
+        self.stopped = False
+        self._stop_event = threading.Event()  # interrupts the wait between outbox checks
+        self._thread = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.last_send_latency = 0.0
+        self.last_error = None
+
+    def start(self) -> 'NotificationWorker':
+        self.recover()
+        self._thread = threading.Thread(target=self._run, name='notification-worker')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10.0):
+        self.stopped = True
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        self.client.close()
+
+    def recover(self):
+        """Notifications left in sending status (worker stopped while sending) will be sent again"""
+        with self.db_engine.begin() as conn:
+            res = conn.execute(update(self.table).where(self.table.c.status == SENDING).values(status=PENDING))
+        if res.rowcount:
+            logging.info(f'{res.rowcount} notification(s) will be sent again')
+
+    def _run(self):
+        while not self.stopped:
+            try:
+                n_sent = self.process_due()
+            except Exception as e:
+                logging.error(f'Notification outbox check failed: {str(e)}')
+                n_sent = 0
+            if n_sent == 0:
+                self.client.close_if_idle()
+                self._stop_event.wait(self.poll_interval)
+
+    def claim(self, now: datetime) -> list:
+        """Fetch notifications due to be sent, and mark them as being sent"""
+        with self.db_engine.begin() as conn:
+            rows = conn.execute(select(self.table)
+                                .where(self.table.c.status == PENDING, self.table.c.next_attempt_ts <= now)
+                                .order_by(self.table.c.id)
+                                .limit(self.batch_size)).fetchall()
+            claimed = []
+            for row in rows:
+                res = conn.execute(update(self.table)
+                                   .where(self.table.c.id == row.id, self.table.c.status == PENDING)
+                                   .values(status=SENDING, update_ts=now))
+                if res.rowcount == 1:
+                    claimed.append(row)
+        return claimed
+
+    def process_due(self, now: datetime = None) -> int:
+        """Send due notifications, return number of notifications processed"""
+        now = datetime.now() if now is None else now
+        rows = self.claim(now)
+        for row in rows:
+            self.send(row)
+        return len(rows)
+
+    def send(self, row):
+        start_ts = time.perf_counter()
+        attempts = row.attempts + 1
+        try:
+            send_email(self.client, row.subject, row.body, row.attachment_path)
+        except Exception as e:
+            self.last_error = str(e)[:500]
+            now = datetime.now()
+            if attempts >= self.max_attempts:
+                self.failed += 1
+                values = {'status': FAILED}
+                logging.error(f'Notification {row.id} failed after {attempts} attempt(s): {str(e)}')
+            else:
+                self.retried += 1
+                delay = retry_delay(attempts)
+                values = {'status': PENDING, 'next_attempt_ts': now + timedelta(seconds=delay)}
+                logging.warning(f'Notification {row.id} failed (attempt {attempts}), retry in {delay:.0f} sec.:'
+                                f' {str(e)}')
+            self._update(row.id, attempts=attempts, last_error=self.last_error, update_ts=now, **values)
+            return
+        self.sent += 1
+        self.last_send_latency = time.perf_counter() - start_ts
+        self._update(row.id, status=SENT, attempts=attempts, update_ts=datetime.now())
+
+    def _update(self, notification_id: int, **values):
+        with self.db_engine.begin() as conn:
+            conn.execute(update(self.table).where(self.table.c.id == notification_id).values(**values))
+
+    def stats(self) -> dict:
+        return {'sent': self.sent, 'retried': self.retried, 'failed': self.failed, 'last_error': self.last_error,
+                'smtp_connects': self.client.connects, 'smtp_connected': self.client.server is not None,
+                'last_send_latency_ms': round(self.last_send_latency * 1000, 2)}
@@ -1,6 +1,32 @@
 # Slightly enriched version of the script from PySource:
 # https://pysource.com/2021/01/28/object-tracking-with-opencv-and-python/
+import logging
 import math
+import threading
+
+import numpy as np
+
+import config
+
+# optimal assignment (Hungarian algorithm) from scipy, imported on first use (scipy import is slow,
+# and would delay start up), greedy assignment is used if scipy is not installed
+linear_sum_assignment = None
+_solver_loaded = False
+_solver_lock = threading.Lock()
+
+
+def load_solver():
+    """Import scipy assignment solver (once), return None if scipy is not installed"""
+    global linear_sum_assignment, _solver_loaded
+    if not _solver_loaded:
+        with _solver_lock:
+            if not _solver_loaded:
+                try:
+                    from scipy.optimize import linear_sum_assignment
+                except ImportError:
+                    logging.info('scipy is not installed, object trackers will use greedy assignment')
+                _solver_loaded = True
+    return linear_sum_assignment
 
 
 class EuclideanDistTracker:
@@ -51,3 +77,177 @@ class EuclideanDistTracker:
         # Update dictionary with IDs not used removed
         self.center_points = new_center_points.copy()
         return objects_bbs_ids
+
+
+class ObjectTracker:
+    """
+    Drop-in replacement of the EuclideanDistTracker: cost of linking each new box with each tracked object
+    (distance between the centers, or 1 - IoU of the boxes) is computed with NumPy in one go, and boxes
+    are assigned optimally (Hungarian algorithm if scipy is installed, otherwise greedily by the lowest cost),
+    so two boxes can never take the same ID. Objects not matched in an update are kept for N updates
+    (max_missed), before their IDs are dropped, so short detection gaps do not create new IDs.
+    Each object also has a constant-velocity Kalman filter (per axis: position and velocity of the box center),
+    predict() advances objects between detections, and update() corrects them with the detected boxes.
+    Velocities are in pixels per second, objects are advanced by the time since the previous frame (frame
+    timestamps, in seconds), as the time between the processed frames varies (frames can be skipped or dropped).
+    """
+
+    def __init__(self, max_distance=25, id_start=0, max_missed=None, cost=None, min_iou=None):
+        # Store max distance between the centers of the boxes identified as same detection
+        self.max_distance = max_distance
+        self.max_missed = config.TRACKER_MAX_MISSED if max_missed is None else max_missed
+        # 'distance' or 'iou'
+        self.cost = config.TRACKER_COST if cost is None else cost
+        self.min_iou = config.TRACKER_MIN_IOU if min_iou is None else min_iou
+        # last ID given to an object
+        self.id_count = id_start
+        # tracked objects: IDs, boxes (x, y, w, h) and number of updates since they were last matched
+        self.ids = np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.float64)
+        self.missed = np.empty(0, dtype=np.int64)
+        # velocities of the box centers (pixels per second), and covariance of (position, velocity), shared by x and y
+        self.velocities = np.empty((0, 2), dtype=np.float64)
+        self.covariances = np.empty((0, 2, 2), dtype=np.float64)
+        self.meas_var = config.TRACKER_MEAS_STD ** 2
+        self.accel_var = config.TRACKER_ACCEL_STD ** 2
+        self.init_cov = np.diag([self.meas_var, config.TRACKER_INIT_VEL_STD ** 2])
+        # timestamp (seconds) of the frame the objects were last updated, predicted or held at
+        self.last_ts = None
+
+    @property
+    def center_points(self) -> dict:
+        centers = self.boxes[:, :2] + self.boxes[:, 2:] / 2
+        return {int(i): (int(cx), int(cy)) for i, (cx, cy) in zip(self.ids, centers)}
+
+    def cost_matrix(self, boxes: np.ndarray) -> tuple:
+        """Return cost of linking each tracked object (rows) with each box (columns), and mask of allowed links"""
+        if self.cost == 'iou':
+            iou = box_iou(self.boxes, boxes)
+            return 1.0 - iou, iou >= self.min_iou
+        centers = self.boxes[:, :2] + self.boxes[:, 2:] / 2
+        new_centers = boxes[:, :2] + boxes[:, 2:] / 2
+        dist = np.hypot(centers[:, None, 0] - new_centers[None, :, 0], centers[:, None, 1] - new_centers[None, :, 1])
+        return dist, dist < self.max_distance
+
+    def update(self, objects_rect, ts: float = None):
+        """
+        Link boxes with tracked objects, return [x, y, w, h, id] for each box (in the same order),
+        with the frame timestamp, objects are advanced to the frame before they are linked
+        """
+        if ts is not None:
+            self.advance(ts)
+        boxes = np.asarray(objects_rect, dtype=np.float64).reshape(-1, 4)
+        box_ids = np.full(len(boxes), -1, dtype=np.int64)
+        matched = np.zeros(len(self.ids), dtype=bool)
+        if len(boxes) and len(self.ids):
+            cost, allowed = self.cost_matrix(boxes)
+            rows, cols = assign(cost, allowed)
+            box_ids[cols] = self.ids[rows]
+            self.correct(rows, boxes[cols])
+            matched[rows] = True
+        # age objects not matched, and drop the ones missed for too long
+        self.missed[matched] = 0
+        self.missed[~matched] += 1
+        keep = self.missed <= self.max_missed
+        self.ids, self.boxes, self.missed = self.ids[keep], self.boxes[keep], self.missed[keep]
+        self.velocities, self.covariances = self.velocities[keep], self.covariances[keep]
+        # new objects get new IDs
+        new = np.flatnonzero(box_ids < 0)
+        if len(new):
+            box_ids[new] = np.arange(self.id_count, self.id_count + len(new))
+            self.id_count += len(new)
+            self.ids = np.concatenate([self.ids, box_ids[new]])
+            self.boxes = np.concatenate([self.boxes, boxes[new]])
+            self.missed = np.concatenate([self.missed, np.zeros(len(new), dtype=np.int64)])
+            self.velocities = np.concatenate([self.velocities, np.zeros((len(new), 2))])
+            self.covariances = np.concatenate([self.covariances, np.repeat(self.init_cov[None], len(new), axis=0)])
+        return [[x, y, w, h, int(obj_id)] for (x, y, w, h), obj_id in zip(objects_rect, box_ids)]
+
+    def correct(self, rows: np.ndarray, boxes: np.ndarray):
+        """
+        Kalman update of the matched objects with the detected boxes: velocities are corrected by the gain,
+        while boxes are taken as detected (detections are precise, and overlays should not lag behind them)
+        """
+        cov = self.covariances[rows]
+        innovation = boxes[:, :2] + boxes[:, 2:] / 2 - (self.boxes[rows, :2] + self.boxes[rows, 2:] / 2)
+        # gains of position and velocity
+        gain = cov[:, :, 0] / (cov[:, 0, 0] + self.meas_var)[:, None]
+        self.velocities[rows] += gain[:, 1:2] * innovation
+        self.covariances[rows] = cov - gain[:, :, None] * cov[:, 0, None, :]
+        self.boxes[rows] = boxes
+
+    def advance(self, ts: float):
+        """Advance all objects (constant velocity) to the frame timestamp"""
+        dt = 0.0 if self.last_ts is None else max(ts - self.last_ts, 0.0)
+        self.last_ts = ts
+        if dt == 0.0:
+            return
+        self.boxes[:, :2] += self.velocities * dt
+        p00, p01, p11 = self.covariances[:, 0, 0], self.covariances[:, 0, 1], self.covariances[:, 1, 1]
+        # P = F P F' + Q, for F = [[1, dt], [0, 1]] and white noise acceleration Q
+        q00, q01, q11 = self.accel_var * dt ** 4 / 4, self.accel_var * dt ** 3 / 2, self.accel_var * dt ** 2
+        self.covariances = np.stack([
+            np.stack([p00 + 2 * dt * p01 + dt ** 2 * p11 + q00, p01 + dt * p11 + q01], axis=-1),
+            np.stack([p01 + dt * p11 + q01, p11 + q11], axis=-1)], axis=1)
+
+    def hold(self, ts: float):
+        """Objects did not move until the frame timestamp (e.g. frames without motion)"""
+        self.last_ts = ts
+
+    def predict(self, ts: float) -> list:
+        """
+        Advance all objects to the frame timestamp (constant velocity), and return [x, y, w, h, id]
+        of the objects matched in the last update
+        """
+        self.advance(ts)
+        seen = self.missed == 0
+        return [[int(round(x)), int(round(y)), int(round(w)), int(round(h)), int(obj_id)]
+                for (x, y, w, h), obj_id in zip(self.boxes[seen], self.ids[seen])]
+
+    def active(self) -> bool:
+        """Check if any object was matched in the last update"""
+        return bool(np.any(self.missed == 0))
+
+    def uncertain(self, max_std: float = None) -> bool:
+        """Check if position of any of the active objects is too uncertain to keep predicting it"""
+        max_std = config.TRACKER_MAX_POSITION_STD if max_std is None else max_std
+        return bool(np.any(self.covariances[self.missed == 0, 0, 0] > max_std ** 2))
+
+
+def box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """Intersection over union of each pair of (x, y, w, h) boxes"""
+    a_x2, a_y2 = boxes_a[:, 0] + boxes_a[:, 2], boxes_a[:, 1] + boxes_a[:, 3]
+    b_x2, b_y2 = boxes_b[:, 0] + boxes_b[:, 2], boxes_b[:, 1] + boxes_b[:, 3]
+    inter_w = np.minimum(a_x2[:, None], b_x2[None, :]) - np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    inter_h = np.minimum(a_y2[:, None], b_y2[None, :]) - np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    area_a = boxes_a[:, 2] * boxes_a[:, 3]
+    area_b = boxes_b[:, 2] * boxes_b[:, 3]
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def assign(cost: np.ndarray, allowed: np.ndarray) -> tuple:
+    """
+    Assign rows to columns with the minimum total cost, only allowed links are used,
+    return (rows, cols) arrays of the assigned pairs
+    """
+    solver = load_solver()
+    if solver is not None:
+        # not allowed links get a cost higher than any allowed assignment, and are filtered out afterwards
+        big = cost[allowed].sum() + 1.0 if allowed.any() else 1.0
+        rows, cols = solver(np.where(allowed, cost, big))
+        ok = allowed[rows, cols]
+        return rows[ok], cols[ok]
+    # greedy: take allowed links from the lowest cost, skip rows or columns already assigned
+    cand_rows, cand_cols = np.nonzero(allowed)
+    order = np.argsort(cost[cand_rows, cand_cols], kind='stable')
+    used_rows = np.zeros(cost.shape[0], dtype=bool)
+    used_cols = np.zeros(cost.shape[1], dtype=bool)
+    rows, cols = [], []
+    for r, c in zip(cand_rows[order], cand_cols[order]):
+        if not used_rows[r] and not used_cols[c]:
+            used_rows[r] = used_cols[c] = True
+            rows.append(r)
+            cols.append(c)
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
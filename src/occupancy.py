@@ -0,0 +1,77 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import config
+from database import Session
+from events import EventPublisher, subscribe_events
+from models import HomeOccupancy
+
+
+def fetch_last_home_occupancy() -> HomeOccupancy:
+    """Get last occupancy recorded in the DB when home owners were at home"""
+    return (Session
+            .query(HomeOccupancy)
+            .filter(HomeOccupancy.occupancy_status == 'home')
+            .order_by(HomeOccupancy.update_ts.desc())
+            .first())
+
+
+class OccupancyState:
+    """
+    Home occupancy kept in memory, so alert checks do not need to query the DB: it is loaded
+    from the DB on startup, and then updated by the events published by the device finder.
+    Owners are considered at home for N-minutes (OWNERS_OUTSIDE_HOME_MIN) after their devices
+    were last seen in the network.
+    """
+
+    def __init__(self):
+        self.status = None
+        self.owners = []  # owners found at home last time
+        self.last_home_ts = None  # last time owners were found at home
+        self._lock = threading.Lock()
+
+    def update(self, status: str, owners: list, update_ts: datetime):
+        with self._lock:
+            self.status = status
+            if status == 'home':
+                self.owners = list(owners or [])
+                self.last_home_ts = update_ts
+
+    def owners_at_home(self, now: datetime = None) -> list:
+        """Return owners at home (or seen at home in the last N-minutes)"""
+        now = datetime.now() if now is None else now
+        with self._lock:
+            if self.last_home_ts is None or self.last_home_ts < now - timedelta(minutes=config.OWNERS_OUTSIDE_HOME_MIN):
+                return []
+            return list(self.owners)
+
+    def refresh_from_db(self):
+        """Load last home occupancy from the DB"""
+        try:
+            hoc = fetch_last_home_occupancy()
+            if hoc is not None:
+                with self._lock:
+                    self.owners = list(hoc.found_owners or [])
+                    self.last_home_ts = hoc.update_ts
+        finally:
+            Session.remove()
+
+    def on_event(self, topic: str, payload: dict):
+        """Update occupancy published by the device finder"""
+        self.update(payload['status'], payload.get('owners'), datetime.fromisoformat(payload['update_ts']))
+
+    def start_subscriber(self) -> 'OccupancyState':
+        """Keep occupancy up to date with the changes published by the device finder (in a background thread)"""
+        subscribe_events(config.OCCUPANCY_SUB_URL, ['occupancy'], self.on_event, bind=False)
+        return self
+
+
+def create_occupancy_publisher() -> EventPublisher:
+    """Create a PUB server, which occupancy subscribers (camera workers) connect to"""
+    logging.info(f'Starting occupancy publisher on {config.OCCUPANCY_PUB_URL}...')
+    return EventPublisher(config.OCCUPANCY_PUB_URL, bind=True)
+
+
+def publish_occupancy(publisher: EventPublisher, status: str, owners: list, update_ts: datetime):
+    publisher.publish('occupancy', {'status': status, 'owners': owners, 'update_ts': update_ts.isoformat()})
@@ -0,0 +1,165 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+# queue drop policies: drop the oldest item to make room for a new one,
+# or make the upstream stage wait until there is room in the queue
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+
+class StageQueue:
+    """Bounded queue connecting two pipeline stages"""
+
+    def __init__(self, name: str, maxsize: int = 2, policy: str = BLOCK):
+        if policy not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f'Unknown queue drop policy: {policy}')
+        self.name = name
+        self.policy = policy
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item, timeout: float = 0.5) -> bool:
+        """
+        Add item to the queue, return False only if a blocking queue
+        was still full after the timeout (caller can retry)
+        """
+        if self.policy == BLOCK:
+            try:
+                self._queue.put(item, timeout=timeout)
+                return True
+            except queue.Full:
+                return False
+        # drop the oldest item(s) until the new one fits
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return True
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout: float = 0.5):
+        """Get next item from the queue, raises queue.Empty after timeout"""
+        return self._queue.get(timeout=timeout)
+
+    def stats(self) -> dict:
+        """Return current depth and number of dropped items"""
+        return {'depth': self._queue.qsize(), 'maxsize': self.maxsize, 'policy': self.policy,
+                'dropped': self.dropped}
+
+
+class Stage:
+    """
+    Worker thread, which takes items from the input queue, applies the stage function,
+    and passes results to the output queue. Stage without input queue is a source,
+    and its function is called without arguments. Returning None from the stage
+    function means the item is not passed any further.
+    """
+
+    def __init__(self, name: str, func: Callable, in_queue: Optional[StageQueue] = None,
+                 out_queue: Optional[StageQueue] = None):
+        self.name = name
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.stopped = False
+        self._thread = None
+        # latency stats (in seconds)
+        self.processed = 0
+        self.errors = 0
+        self.last_latency = 0.0
+        self.avg_latency = 0.0  # exponential moving average
+        self.max_latency = 0.0
+
+    def start(self) -> 'Stage':
+        self._thread = threading.Thread(target=self._run, name=f'stage-{self.name}')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stopped = True
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+    def _run(self):
+        logging.info(f'Pipeline stage {self.name} started')
+        while not self.stopped:
+            if self.in_queue is not None:
+                try:
+                    item = self.in_queue.get()
+                except queue.Empty:
+                    continue
+            start_ts = time.perf_counter()
+            try:
+                result = self.func(item) if self.in_queue is not None else self.func()
+            except Exception as e:
+                self.errors += 1
+                logging.exception(f'Pipeline stage {self.name} failed: {str(e)}')
+                continue
+            self._record_latency(time.perf_counter() - start_ts)
+            if result is not None and self.out_queue is not None:
+                while not self.out_queue.put(result) and not self.stopped:
+                    pass
+        logging.info(f'Pipeline stage {self.name} stopped')
+
+    def _record_latency(self, latency: float):
+        self.processed += 1
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.avg_latency = latency if self.processed == 1 else 0.9 * self.avg_latency + 0.1 * latency
+
+    def stats(self) -> dict:
+        stats = {'processed': self.processed, 'errors': self.errors,
+                 'last_latency_ms': round(self.last_latency * 1000, 2),
+                 'avg_latency_ms': round(self.avg_latency * 1000, 2),
+                 'max_latency_ms': round(self.max_latency * 1000, 2)}
+        # stage functions can report their own stats
+        if hasattr(self.func, 'stats'):
+            stats.update(self.func.stats())
+        return stats
+
+
+class Pipeline:
+    """Chain of stages, each running in its own thread, connected with bounded queues"""
+
+    def __init__(self):
+        self.stages = []
+        self.queues = []
+
+    def add_stage(self, name: str, func: Callable, maxsize: int = 2, policy: str = BLOCK) -> 'Pipeline':
+        """
+        Append a stage to the pipeline, first stage is a source, and each next stage
+        reads from a queue (with given size and drop policy) fed by the previous stage
+        """
+        in_queue = None
+        if len(self.stages) > 0:
+            in_queue = StageQueue(name, maxsize=maxsize, policy=policy)
+            self.stages[-1].out_queue = in_queue
+            self.queues.append(in_queue)
+        self.stages.append(Stage(name, func, in_queue=in_queue))
+        return self
+
+    def start(self) -> 'Pipeline':
+        # start consumers first, so the source does not fill up the queues straight away
+        for stage in reversed(self.stages):
+            stage.start()
+        return self
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+
+    def stats(self) -> dict:
+        """Return per-stage latency and per-queue depth"""
+        return {
+            'stages': {s.name: s.stats() for s in self.stages},
+            'queues': {q.name: q.stats() for q in self.queues}
+        }
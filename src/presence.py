@@ -0,0 +1,185 @@
+# Detect presence of the home owners devices from the kernel neighbour (ARP) table,
+# instead of sweeping the whole subnet: known IPs of the configured devices are probed
+# with a unicast packet (which makes the kernel refresh their neighbour entries), and a full
+# nmap sweep only runs as a fallback, when a device can not be found in the table.
+
+import logging
+import re
+import socket
+import subprocess
+import time
+from typing import Callable
+
+import config
+
+# neighbour states, in which a device is considered present (COMPLETE is used for /proc/net/arp entries),
+# DELAY is not one of them, it is a stale entry waiting for confirmation, which may never come
+PRESENT_STATES = {'COMPLETE', 'REACHABLE', 'PERMANENT'}
+# states of an entry, which is being confirmed after the unicast probe (STALE -> DELAY -> PROBE, then
+# REACHABLE, or FAILED and the entry drops out), the kernel only starts probing ~5 sec. after the packet was sent
+PENDING_STATES = {'STALE', 'DELAY', 'PROBE'}
+
+MAC_RE = re.compile(r'(([0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2})')
+
+
+def parse_proc_arp(text: str) -> dict:
+    """Parse /proc/net/arp content into {MAC: (IP, state)}"""
+    neighbours = {}
+    for line in text.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) < 4:
+            continue
+        ip, flags, mac = parts[0], int(parts[2], 16), parts[3].lower()
+        # ATF_COM flag marks resolved entries, including the ones the kernel already considers STALE
+        # (/proc does not show neighbour states), so a device which left keeps its COMPLETE entry,
+        # until the entry is probed, and fails to be confirmed (see PresenceDetector)
+        neighbours[mac] = (ip, 'COMPLETE' if flags & 0x2 else 'INCOMPLETE')
+    return neighbours
+
+
+def parse_ip_neigh(text: str) -> dict:
+    """Parse `ip neigh show` output into {MAC: (IP, state)}, IPv4 entries only (devices are probed over IPv4)"""
+    neighbours = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if 'lladdr' not in parts or ':' in parts[0]:
+            continue
+        mac = parts[parts.index('lladdr') + 1].lower()
+        neighbours[mac] = (parts[0], parts[-1])
+    return neighbours
+
+
+def read_proc_arp(path: str = '/proc/net/arp') -> dict:
+    """Read IPv4 neighbour table from /proc (or a fixture file)"""
+    with open(path) as f:
+        return parse_proc_arp(f.read())
+
+
+def read_ip_neigh() -> dict:
+    """Read IPv4 neighbour table with `ip neigh` (includes neighbour states, e.g. REACHABLE, STALE)"""
+    out = subprocess.run(['ip', '-4', 'neigh', 'show'], capture_output=True, text=True, timeout=5).stdout
+    return parse_ip_neigh(out)
+
+
+# available neighbour table sources (see PRESENCE_NEIGHBOUR_SOURCE in the config)
+NEIGHBOUR_SOURCES = {'proc': read_proc_arp, 'ip': read_ip_neigh}
+
+
+def unicast_probe(ip: str):
+    """
+    Send an empty UDP packet to the IP (discard port), kernel will resolve (or re-confirm) its MAC address,
+    so the neighbour entry is refreshed, even if the device does not reply to the packet itself
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            s.sendto(b'', (ip, 9))
+        except OSError as e:
+            logging.debug(f'Probe to {ip} failed: {str(e)}')
+
+
+def nmap_sweep(subnet: str = None) -> set:
+    """Ping sweep of the whole subnet, return MAC addresses found"""
+    subnet = config.SUBNET_MASK if subnet is None else subnet
+    cmd = f'/usr/bin/sudo /usr/bin/nmap -sn {subnet}'
+    logging.info(f'Executing cmd: {cmd}')
+    out = subprocess.run(cmd.split(' '), capture_output=True, text=True).stdout
+    return {m[0].lower() for m in MAC_RE.findall(out)}
+
+
+class PresenceDetector:
+    """
+    Find which of the configured devices are present in the network. A device becomes present
+    as soon as it's seen, but it's only considered absent after it was missing in N consecutive
+    checks (hysteresis), as phones in power saving mode do not always answer straight away.
+    Entries of the probed devices are only trusted once the kernel confirmed them: /proc/net/arp
+    does not show whether an entry is stale, so it's read after the whole probe wait (a device which
+    left drops out by then), and a device with an entry still being confirmed is neither seen nor missed.
+    """
+
+    def __init__(self, devices: list, neighbour_source: Callable = None, probe: Callable = unicast_probe,
+                 sweep: Callable = nmap_sweep, away_misses: int = None, probe_wait: float = None,
+                 probe_poll: float = None, sweep_interval: float = None):
+        self.devices = devices
+        self.neighbour_source = NEIGHBOUR_SOURCES[config.PRESENCE_NEIGHBOUR_SOURCE] \
+            if neighbour_source is None else neighbour_source
+        self.probe = probe
+        self.sweep = sweep
+        self.away_misses = config.PRESENCE_AWAY_MISSES if away_misses is None else away_misses
+        self.probe_wait = config.PRESENCE_PROBE_WAIT_SEC if probe_wait is None else probe_wait
+        self.probe_poll = config.PRESENCE_PROBE_POLL_SEC if probe_poll is None else probe_poll
+        self.sweep_interval = config.PRESENCE_SWEEP_INTERVAL_SEC if sweep_interval is None else sweep_interval
+        self.macs = [d['mac_addr'].lower() for d in devices]
+        self.known_ips = {}  # MAC -> last known IP
+        self.misses = {mac: 0 for mac in self.macs}
+        self.present = {mac: False for mac in self.macs}
+        self.pending = set()  # devices with entries still being confirmed in the last check
+        self.last_sweep_ts = None
+        self.sweeps = 0
+
+    def _update_known_ips(self, neighbours: dict):
+        for mac in self.macs:
+            if mac in neighbours:
+                self.known_ips[mac] = neighbours[mac][0]
+
+    def _wait_for_probes(self, probed: set) -> dict:
+        """
+        Read the neighbour table until entries of the probed devices are confirmed, or the probe wait
+        is over, return the last table read (COMPLETE entries of /proc/net/arp can not be told apart
+        from the stale ones, so they are waited for too)
+        """
+        deadline = time.monotonic() + self.probe_wait
+        while True:
+            time.sleep(max(0.0, min(self.probe_poll, deadline - time.monotonic())))
+            neighbours = self.neighbour_source()
+            unconfirmed = {mac for mac in probed if mac in neighbours and
+                           neighbours[mac][1] in PENDING_STATES | {'COMPLETE'}}
+            if not unconfirmed or time.monotonic() >= deadline:
+                return neighbours
+
+    def find_devices(self) -> set:
+        """
+        Return MACs of the configured devices seen in the network right now (devices with entries
+        still being confirmed are kept in pending)
+        """
+        self._update_known_ips(self.neighbour_source())
+        # refresh neighbour entries of the known devices, and wait for the kernel to confirm them
+        probed = set()
+        if self.probe is not None and self.known_ips:
+            for ip in self.known_ips.values():
+                self.probe(ip)
+            probed = set(self.known_ips)
+            neighbours = self._wait_for_probes(probed)
+        else:
+            neighbours = self.neighbour_source()
+        self._update_known_ips(neighbours)
+        seen = {mac for mac in self.macs if mac in neighbours and neighbours[mac][1] in PRESENT_STATES}
+        self.pending = {mac for mac in probed if mac in neighbours and neighbours[mac][1] in PENDING_STATES}
+        # fall back to a full sweep (not more often than every N-seconds), if some devices were not found
+        missing = set(self.macs) - seen - self.pending
+        if missing and self.sweep is not None and \
+                (self.last_sweep_ts is None or time.time() - self.last_sweep_ts >= self.sweep_interval):
+            logging.info(f'Devices not found in the neighbour table: {", ".join(missing)}, running full sweep')
+            self.last_sweep_ts = time.time()
+            self.sweeps += 1
+            found = missing & self.sweep()
+            seen |= found
+            self.pending -= found
+            # sweep populates the neighbour table, so IPs of the found devices can be probed next time
+            self._update_known_ips(self.neighbour_source())
+        return seen
+
+    def check(self) -> list:
+        """Run presence check, return configured devices which are present (with hysteresis applied)"""
+        seen = self.find_devices()
+        for mac in self.macs:
+            if mac in self.pending:
+                # not confirmed yet, neither seen nor missed
+                continue
+            if mac in seen:
+                self.misses[mac] = 0
+                self.present[mac] = True
+            else:
+                self.misses[mac] += 1
+                if self.misses[mac] >= self.away_misses:
+                    self.present[mac] = False
+        return [d for d, mac in zip(self.devices, self.macs) if self.present[mac]]
@@ -0,0 +1,174 @@
+# Hourly rollups of detections (motion counts and distinct object counts per label),
+# updated incrementally as detections are saved, so the analysis does not need to read
+# all the raw detections of last N-days.
+
+# Usage (rebuild rollups from the raw detections): python rollups.py [--days 7]
+
+import argparse
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert
+
+import config
+from database import Session
+from models import MotionDetection, ObjectDetection, MotionRollup, ObjectRollup
+
+
+def hour_start(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+class RollupUpdater:
+    """
+    Compute rollup increments of the saved detections: each motion detection adds 1 to the motion
+    count of its hour, and each object (camera, label, object ID) adds 1 to the object count
+    of its hour and label the first time it is seen in that hour. Objects are marked as seen
+    only after the transaction with their increments is committed (mark_seen), and objects
+    already saved in the current hour are loaded on start up (seed), so a restart does not count them twice.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # hour -> objects (camera ID, label, object ID) already counted in the hour
+        self._seen = defaultdict(set)
+
+    def seed(self, db_conn, now: datetime = None):
+        """Mark objects saved in the current (and previous) hour as seen"""
+        now = datetime.now() if now is None else now
+        since = hour_start(now) - timedelta(hours=1)
+        with db_conn.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT DISTINCT strftime('%Y-%m-%d %H:00:00', create_ts), camera_id, label, obj_id
+                FROM object_detections
+                WHERE create_ts >= :since
+            """), {'since': str(since)}).fetchall()
+        seen = defaultdict(set)
+        for hour_ts, camera_id, label, obj_id in rows:
+            seen[datetime.fromisoformat(hour_ts)].add((camera_id, label, obj_id))
+        self.mark_seen(seen)
+
+    def increments(self, detections: list) -> tuple:
+        """
+        Return increments: ({hour: n_motions}, {(hour, label): n_new_objects}), and the new objects
+        ({hour: objects}), which should be marked as seen once the increments are committed
+        """
+        motion_inc = defaultdict(int)
+        obj_inc = defaultdict(int)
+        new_seen = defaultdict(set)
+        with self._lock:
+            for d in detections:
+                hour_ts = hour_start(d.create_ts)
+                if isinstance(d, MotionDetection):
+                    motion_inc[hour_ts] += 1
+                elif isinstance(d, ObjectDetection):
+                    key = (d.camera_id, d.label, d.obj_id)
+                    if key not in self._seen[hour_ts] and key not in new_seen[hour_ts]:
+                        new_seen[hour_ts].add(key)
+                        obj_inc[(hour_ts, d.label)] += 1
+        return motion_inc, obj_inc, new_seen
+
+    def mark_seen(self, new_seen: dict):
+        """Mark objects as counted (after their increments were committed)"""
+        with self._lock:
+            for hour_ts, keys in new_seen.items():
+                self._seen[hour_ts] |= keys
+            # objects are only tracked within the latest hour (and the previous one, while it is being saved)
+            if self._seen:
+                min_hour_ts = max(self._seen) - timedelta(hours=1)
+                for hour_ts in [h for h in self._seen if h < min_hour_ts]:
+                    del self._seen[hour_ts]
+
+    def update(self, session, detections: list) -> dict:
+        """
+        Add increments of the detections to the rollup tables (caller commits the transaction),
+        return the new objects, which the caller marks as seen (mark_seen) after the commit
+        """
+        motion_inc, obj_inc, new_seen = self.increments(detections)
+        if motion_inc:
+            stmt = insert(MotionRollup).values([{'hour_ts': h, 'motion_count': n} for h, n in motion_inc.items()])
+            session.execute(stmt.on_conflict_do_update(
+                index_elements=['hour_ts'],
+                set_={'motion_count': MotionRollup.motion_count + stmt.excluded.motion_count}))
+        if obj_inc:
+            stmt = insert(ObjectRollup).values([{'hour_ts': h, 'label': label, 'obj_count': n}
+                                                for (h, label), n in obj_inc.items()])
+            session.execute(stmt.on_conflict_do_update(
+                index_elements=['hour_ts', 'label'],
+                set_={'obj_count': ObjectRollup.obj_count + stmt.excluded.obj_count}))
+        return new_seen
+
+
+def fetch_motion_rollups(since: datetime) -> dict:
+    """Return {hour: motion count} since the given time"""
+    return {hour_ts: n for hour_ts, n in (Session
+                                          .query(MotionRollup.hour_ts, MotionRollup.motion_count)
+                                          .filter(MotionRollup.hour_ts >= since))}
+
+
+def fetch_object_rollups(since: datetime) -> dict:
+    """Return {label: {hour: distinct object count}} since the given time"""
+    results = defaultdict(dict)
+    for hour_ts, label, n in (Session
+                              .query(ObjectRollup.hour_ts, ObjectRollup.label, ObjectRollup.obj_count)
+                              .filter(ObjectRollup.hour_ts >= since)):
+        results[label][hour_ts] = n
+    return results
+
+
+def hourly_profile(counts: dict, now: datetime) -> list:
+    """
+    Convert {hour: count} into records of: Hour (of the day), Historical (avg count in this hour
+    of the previous days) and Today (count in this hour today). Hours without detections
+    after the first detection count as 0 in the historical average.
+    """
+    if not counts:
+        return []
+    today_start = datetime(now.year, now.month, now.day)
+    hist_sum, hist_n = defaultdict(float), defaultdict(int)
+    hour_ts, last_hist_ts = min(counts), min(max(counts), today_start - timedelta(hours=1))
+    while hour_ts <= last_hist_ts:
+        hist_sum[hour_ts.hour] += counts.get(hour_ts, 0)
+        hist_n[hour_ts.hour] += 1
+        hour_ts += timedelta(hours=1)
+    return [{'Hour': h, 'Historical': hist_sum[h] / hist_n[h],
+             'Today': counts.get(today_start + timedelta(hours=h), 0)} for h in sorted(hist_n)]
+
+
+def rebuild_rollups(since: datetime = None):
+    """Recompute rollups from the raw detections (since the given time, or all of them)"""
+    since = datetime.min if since is None else hour_start(since)
+    # hours are formatted as SQLAlchemy stores DateTime in SQLite, so they match the incremental updates
+    hour_expr = "strftime('%Y-%m-%d %H:00:00.000000', create_ts)"
+    params = {'since': str(since)}
+    Session.query(MotionRollup).filter(MotionRollup.hour_ts >= since).delete(synchronize_session=False)
+    Session.query(ObjectRollup).filter(ObjectRollup.hour_ts >= since).delete(synchronize_session=False)
+    Session.execute(text(f"""
+        INSERT INTO motion_rollups (hour_ts, motion_count)
+        SELECT {hour_expr}, COUNT(*)
+        FROM motion_detections
+        WHERE create_ts >= :since
+        GROUP BY 1
+    """), params)
+    Session.execute(text(f"""
+        INSERT INTO object_rollups (hour_ts, label, obj_count)
+        SELECT {hour_expr}, label, COUNT(DISTINCT COALESCE(camera_id, '') || ':' || obj_id)
+        FROM object_detections
+        WHERE create_ts >= :since
+        GROUP BY 1, 2
+    """), params)
+    Session.commit()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format=config.LOGGING_FORMAT, level=config.LOGGING_LEVEL, datefmt=config.LOGGING_DATE_FORMAT)
+    parser = argparse.ArgumentParser(description='Rebuild hourly rollups of detections')
+    parser.add_argument('--days', type=int, default=None, help='only rebuild last N-days (default: all)')
+    args = parser.parse_args()
+    since_ts = None if args.days is None else datetime.now() - timedelta(days=args.days)
+    logging.info(f'Rebuilding rollups since {since_ts or "the first detection"}')
+    rebuild_rollups(since_ts)
+    logging.info('Rollups rebuilt')
@@ -1,56 +1,20 @@
 from datetime import datetime, timedelta
 from typing import List
-import pandas as pd
 import config
 import logging
-import cv2
+import multiprocessing
+import queue
+import threading
 import numpy as np
-from models import ObjectDetection, Alert, HomeOccupancy
-from database import engine, Session
+import simplejpeg
+from models import ObjectDetection, Alert
+from database import Session
 from os import path, mkdir
 
-from mailer import send
-
-
-def find_owners_at_home(db_conn) -> list:
-    """Check if home owner device was detected in the last N-minutes"""
-
-    # TODO: Consider removing this function and use ORM instead for consistency in the app
-
-    # calculate curr time - N minutes
-    min_occupancy_time = str(datetime.now() - timedelta(minutes=config.OWNERS_OUTSIDE_HOME_MIN))
-
-    # fetch results from DB
-    df = pd.read_sql(f"""
-        SELECT found_owners
-        FROM home_occupancy
-        WHERE occupancy_status = 'home'
-            AND update_ts >= :min_occupancy_time
-        ORDER BY update_ts DESC
-        LIMIT 1
-    """, params={'min_occupancy_time': min_occupancy_time}, con=db_conn)
-    return df['found_owners'].values.tolist()
-
-
-def find_owners_at_home_orm() -> list:
-    """
-    Check if registered devices were detected on the Network in the last N-minutes.
-    This is a more orm-friendly alternative to find_owners_at_home.
-    """
-
-    # calculate curr time - N minutes
-    min_occupancy_time = str(datetime.now() - timedelta(minutes=config.OWNERS_OUTSIDE_HOME_MIN))
-    # find last entry which matches "home" status
-    devices_at_home = (Session
-                       .query(HomeOccupancy)
-                       .filter(HomeOccupancy.occupancy_status == 'home', HomeOccupancy.update_ts >= min_occupancy_time)
-                       .order_by(HomeOccupancy.update_ts.desc())
-                       .first())
-    # if entry is not found - return empty list
-    if devices_at_home is None:
-        return []
-    # otherwise, return a list of device owners
-    return devices_at_home.found_owners
+from notifications import create_notification
+from occupancy import OccupancyState
+from pipeline import StageQueue, DROP_OLDEST
+from image_catalog import add_image
 
 
 def fetch_last_alert() -> Alert:
@@ -61,113 +25,203 @@ def fetch_last_alert() -> Alert:
             .first())
 
 
-def check_alerts(detections: List[ObjectDetection], curr_frame: np.array) -> bool:
-    """Check if an alert needs to be triggered"""
-    logging.info(f'Security CheckAlerts running...')
-
-    # check if we are in the OVERRIDE hours,
-    # these will say, that no-matter if house is occupied,
-    # an alert will be triggered
-    now = datetime.now()
-    override_on = False
+def is_override_on(now: datetime) -> bool:
+    """
+    Check if we are in the OVERRIDE hours, these will say, that no-matter
+    if house is occupied, an alert will be triggered
+    """
     if config.SECURITY_ON_OVERRIDE_HOURS is not None:
         for hr_rg in config.SECURITY_ON_OVERRIDE_HOURS:
             if is_hr_between(now.hour, hr_rg):
                 logging.info(f'Alert override ON. Curr hr. ({now.hour}) is within override range {str(hr_rg)}')
-                override_on = True
-                break
-
-    # check if house is occupied (if the OVERRIDE above is not ON right now)
-    home_occupied = False
-    if not override_on:
-        # finally, if we still have potential intruders available,
-        # we can check if home owners are away, and only then trigger an alert,
-        # this check is left to the end as it's the slowest part (DB query)
-        home_owners = find_owners_at_home_orm()
-        if home_owners is not None and len(home_owners) > 0:
-            home_occupied = True
+                return True
+    return False
+
+
+class AlertWorker:
+    """
+    Long-lived alert worker: decides if an alert needs to be triggered, based on the last alert
+    time and home occupancy kept in memory (no DB queries), the cooldown between alerts is applied
+    before anything else. Saving of the intruder image, notification and the Alert record
+    are handed off to the worker thread, so the caller never waits for any I/O.
+    """
+
+    def __init__(self, occupancy: OccupancyState, last_alert_ts: datetime = None, shared_last_alert=None):
+        self.occupancy = occupancy
+        # time of the last triggered alert (cooldown) as epoch seconds (0 if none), shared by the workers
+        # of all cameras (multiprocessing Value), so an intruder seen by more cameras triggers a single alert
+        self.last_alert = multiprocessing.Value('d', 0.0) if shared_last_alert is None else shared_last_alert
+        if last_alert_ts is not None:
+            with self.last_alert.get_lock():
+                self.last_alert.value = max(self.last_alert.value, last_alert_ts.timestamp())
+        # image saves (no alert) are dropped if the worker can not keep up (e.g. the DB is locked),
+        # triggered alerts have their own unbounded queue, and are never dropped (cooldown is already applied)
+        self.queue = StageQueue('alerts', maxsize=10, policy=DROP_OLDEST)
+        self.triggered_queue = queue.Queue()
+        self.checked = 0
+        self.skipped_occupied = 0
+        self.triggered = 0
+        self.failed = 0
+
+    def start(self) -> 'AlertWorker':
+        t = threading.Thread(target=self._run, name='alert-worker')
+        t.daemon = True
+        t.start()
+        return self
+
+    @property
+    def last_alert_ts(self) -> datetime:
+        value = self.last_alert.value
+        return datetime.fromtimestamp(value) if value > 0 else None
+
+    def in_cooldown(self, now: datetime) -> bool:
+        """Check if alert has been triggered within last N-seconds (set in config)"""
+        return self.last_alert_ts is not None and \
+            self.last_alert_ts >= now - timedelta(seconds=config.MIN_SEC_BETWEEN_ALERTS)
+
+    def submit(self, detections: List[ObjectDetection], curr_frame: np.array, now: datetime = None) -> bool:
+        """
+        Check if an alert needs to be triggered, return True if it was
+        (intruder image is saved anyway, unless home owners are at home)
+        """
+        now = datetime.now() if now is None else now
+        self.checked += 1
+        # check if house is occupied (if the OVERRIDE is not ON right now)
+        override_on = is_override_on(now)
+        if not override_on and len(self.occupancy.owners_at_home(now)) > 0:
+            self.skipped_occupied += 1
             logging.info(f'Alert skipped. Owners are at home for at'
                          f' least {config.OWNERS_OUTSIDE_HOME_MIN} minute(s)')
             return False
-
-    # trigger alert if OVERRIDE is ON or house is not occupied
-    if override_on or not home_occupied:
-        # at this stage, we can trigger an alert to home owners as we do have a
-        # potential intruder in the security zone area and home owners are away
-        extra_text = 'alert override is ON' if override_on else 'house is not occupied'
-        logging.info(f'Trigger alert. Potential intruder(s) detected and {extra_text}')
-
+        # apply cooldown, last alert time is updated straight away (under the shared lock),
+        # so no other alert can be triggered (by any camera) while this one is being sent
+        with self.last_alert.get_lock():
+            prev_alert_ts = self.last_alert_ts
+            trigger = not self.in_cooldown(now)
+            if trigger:
+                self.last_alert.value = now.timestamp()
+        if trigger:
+            # at this stage, we can trigger an alert to home owners as we do have a
+            # potential intruder in the security zone area and home owners are away
+            extra_text = 'alert override is ON' if override_on else 'house is not occupied'
+            logging.info(f'Trigger alert. Potential intruder(s) detected and {extra_text}')
+            self.triggered += 1
+        else:
+            logging.info(f'Alert already triggered at {str(prev_alert_ts)}')
+        # save the image (and send the alert) in the worker thread
+        job = (detections, curr_frame, now, prev_alert_ts, trigger)
+        if trigger:
+            self.triggered_queue.put(job)
+        else:
+            self.queue.put(job)
+        return trigger
+
+    def _run(self):
+        n_uncommitted = 0  # catalog rows of the saved images, which are not committed yet
+        while True:
+            # triggered alerts first
+            try:
+                job = self.triggered_queue.get_nowait()
+            except queue.Empty:
+                try:
+                    job = self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    job = None
+            try:
+                if job is not None:
+                    self.process(*job)
+                    # triggered alert commits the pending rows together with the alert
+                    trigger = job[-1]
+                    n_uncommitted = 0 if trigger else n_uncommitted + 1
+                # commit image rows in batches (when idle), not for each image
+                if n_uncommitted > 0 and (job is None or n_uncommitted >= config.IMAGES_CATALOG_BATCH_SIZE):
+                    Session.commit()
+                    n_uncommitted = 0
+            except Exception as e:
+                self.failed += 1
+                logging.error(f'Alert processing failed: {str(e)}')
+                Session.rollback()
+                Session.remove()
+                n_uncommitted = 0
+
+    def process(self, detections: List[ObjectDetection], curr_frame: np.array, now: datetime,
+                prev_alert_ts: datetime, trigger: bool):
+        """Save intruder image, and if the alert was triggered, notify home owners and record the alert"""
         # create folder for current date if does not exist yet
         date_folder = f'{config.IMG_FOLDER}/{str(now.date())}'
         if not path.exists(date_folder):
             mkdir(date_folder)
         # save image in the images folder
         img_name = f"{str(now)[11:].replace(':', '')}_{config.INTRUDER_FILES_IDENTIFIER}.jpg"
-        cv2.imwrite(f'{date_folder}/{img_name}', curr_frame)
+        with open(f'{date_folder}/{img_name}', 'wb') as f:
+            f.write(simplejpeg.encode_jpeg(curr_frame, quality=config.INTRUDER_JPEG_QUALITY, colorspace='BGR'))
+        # catalog row is committed by the worker (in a batch, or with the alert)
+        add_image(f'{date_folder}/{img_name}', now, config.INTRUDER_FILES_IDENTIFIER, config.CAMERA_ID)
         logging.info(f'File {date_folder}/{img_name} saved')
-
-        # check if enough time has elapsed since last notification,
-        # for this, fetch the metadata for the last alert
-        last_alert = fetch_last_alert()
-        # calculate the time between now and -N seconds (set in config)
-        alert_check_time = now - timedelta(seconds=config.MIN_SEC_BETWEEN_ALERTS)
-        # if alert has been triggered recently, skip the next one
-        if last_alert.create_ts >= alert_check_time:
-            logging.info(f'Alert already triggered at {str(last_alert.create_ts)}')
-            return False
-
-        # before triggering alerts, add a record to DB indicating that triggering
-        # is in progress, which will prevent duplicated alerts
-        a = Alert(create_ts=now, title='Potential intruders detected', alert_status='pending', alert_metadata={})
-        Session.add(a)
-        Session.commit()
+        if not trigger:
+            return
 
         # trigger alert
-        logging.info(f'Last alert sent at {str(last_alert.create_ts)}. Trigger alert')
-        intruders = trigger_alert(detections, date_folder, img_name)
-
-        # update alert in the DB with other relevant info and indicate it was triggered
-        a.update_ts = datetime.now()
-        a.alert_status = 'triggered'
-        a.alert_metadata = {
-            'intruders': intruders,
-            'mail_resp': "OK",
-            'img_path': f'{date_folder}/{img_name}',
-            'prev_alert': str(last_alert.create_ts),
-            'checked_intruder_objects': config.INTRUDER_OBJECTS
-        }
+        logging.info(f'Last alert sent at {str(prev_alert_ts)}. Trigger alert')
+        intruders, notification = trigger_alert(detections, date_folder, img_name, now)
+
+        # record the alert in the DB with all relevant info (in the same transaction as the notification)
+        a = Alert(create_ts=now, update_ts=datetime.now(), title='Potential intruders detected',
+                  alert_status='triggered', alert_metadata={
+                      'intruders': intruders,
+                      'notification_id': None if notification is None else notification.id,
+                      'img_path': f'{date_folder}/{img_name}',
+                      'prev_alert': str(prev_alert_ts),
+                      'checked_intruder_objects': config.INTRUDER_OBJECTS
+                  })
         Session.add(a)
         Session.commit()
 
-        # return True, which indicates alert triggered
-        return True
+    def stats(self) -> dict:
+        return {'checked': self.checked, 'skipped_occupied': self.skipped_occupied, 'triggered': self.triggered,
+                'failed': self.failed, 'queue': self.queue.stats(), 'triggered_queue': self.triggered_queue.qsize(),
+                'owners_at_home': self.occupancy.owners_at_home(),
+                'last_alert_ts': None if self.last_alert_ts is None else str(self.last_alert_ts)}
 
-    # returning False indicates no alerts, code should not even get here
-    logging.info('Alert not triggered. Final check completed')
-    return False
+
+def create_alert_worker(shared_last_alert=None) -> AlertWorker:
+    """
+    Create alert worker with the last alert time and occupancy loaded from the DB,
+    last alert time can be shared with the workers of other cameras (multiprocessing Value)
+    """
+    try:
+        last_alert = fetch_last_alert()
+    finally:
+        Session.remove()
+    # occupancy is only read from the DB on startup, then it's pushed by the device finder
+    occupancy = OccupancyState()
+    occupancy.refresh_from_db()
+    occupancy.start_subscriber()
+    return AlertWorker(occupancy, None if last_alert is None else last_alert.create_ts, shared_last_alert).start()
 
 
-def trigger_alert(detections: List[ObjectDetection], img_folder: str, filename: str) -> list:
+def trigger_alert(detections: List[ObjectDetection], img_folder: str, filename: str, now: datetime = None) -> tuple:
     """
-    Send an email or/and sms notification to home owners
-    Returns a list of identified labels, sms ID (or None if disabled)
-    and email response data (or None if disabled)
+    Notify home owners: notification is only added into the outbox (current session), and it is sent
+    by the notification worker after the session is committed.
+    Returns a list of identified labels and the notification (or None if disabled)
     """
 
     # compose message body
     intruder_labels = [i.label for i in detections]
     msg_body = f'Third Eye registered potential silent intruders: {", ".join(intruder_labels)}.'
 
-    # send email
-    email_resp = None
+    # queue email
+    notification = None
     if config.EMAIL_NOTIFICATIONS_ENABLED:
-        logging.info('Sending Email Notification')
-
-        # Send mail
-        send(msg_body, f'{img_folder}/{filename}')
-
-        # return all elements
-        return intruder_labels
+        logging.info('Queueing Email Notification')
+        now = datetime.now() if now is None else now
+        notification = create_notification(f'Third Eye alert - {str(now)}', msg_body, f'{img_folder}/{filename}', now)
+        Session.add(notification)
+        Session.flush()
+
+    # return all elements
+    return intruder_labels, notification
 
 
 def is_hr_between(time: int, time_range: tuple) -> bool:
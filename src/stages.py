@@ -0,0 +1,366 @@
+import logging
+from datetime import datetime
+from typing import Callable
+
+import cv2
+import imutils
+import numpy as np
+import simplejpeg
+
+import config
+from cameras import get_device_name, reload_config
+from detections import DetectionWriter
+from detectors import DetectedObject, detect_tiles
+from motion import MotionDetector
+from models import MotionDetection, ObjectDetection
+from object_tracker import ObjectTracker
+from security import AlertWorker
+from video_capture import CaptureStream
+from zones import get_zone_set
+
+
+class FrameContext:
+    """State of a single frame, as it flows through the processing pipeline"""
+
+    def __init__(self, seq: int, ts: datetime, frame: np.ndarray):
+        self.seq = seq
+        self.ts = ts  # capture timestamp, detections are stamped with it
+        self.proc_start_ts = datetime.now()  # used to calculate time to process 1 frame
+        self.frame = frame  # full resolution frame
+        self.frame_sm = None  # resized (and masked) frame used by the detectors
+        self.frame_gray = None  # input of the motion detector (whole frame or secure zones ROI)
+        self.motion_offset = (0, 0)  # offset of frame_gray within frame_sm
+        self.zone_set = None  # secure zones compiled for the resized frame
+        self.motion = False  # set by motion stage when any motion was detected in the frame
+        self.run_inference = False  # set by motion stage when there are enough consecutive motion frames
+        self.motion_boxes = []  # (x, y, w, h, area) of motion contours in frame_sm coordinates
+        self.detections = []  # motion and object detections, which will be bulk-saved in the DB
+
+
+class CaptureStage:
+    """Source stage, read only new frames from the camera"""
+
+    def __init__(self, video_stream: CaptureStream):
+        self.video_stream = video_stream
+        self.last_frame_seq = 0
+
+    def __call__(self) -> FrameContext:
+        # if in debug mode, reimport the config on the fly (so we can
+        # tweak config values and see results immediately in the stream)
+        if config.APP_DEBUG_MODE:
+            reload_config()
+            # update stream properties in debug mode
+            for props in config.STREAM_PROPS:
+                self.video_stream.stream.set(props[0], props[1])
+
+        # read the next frame from the video stream (blocks until a new frame is
+        # grabbed, so the same frame is never processed twice)
+        captured = self.video_stream.read(self.last_frame_seq, timeout=config.CAPTURE_READ_TIMEOUT_SEC)
+        if captured is None:
+            logging.warning(f'No new frame received in {config.CAPTURE_READ_TIMEOUT_SEC} sec.')
+            return None
+        self.last_frame_seq = captured.seq
+        return FrameContext(captured.seq, captured.ts, captured.image)
+
+
+def orient_frame(frame: np.ndarray) -> np.ndarray:
+    """Mirror the camera frame (and flip it vertically if configured)"""
+    # mirror image horizontally to show the real "you"
+    frame = cv2.flip(frame, 1)
+
+    # check if camera hands upside down and vertical rotation is required
+    if config.FLIP_IMAGE:
+        frame = cv2.flip(frame, 0)
+    return frame
+
+
+class PreprocessStage:
+    """Orient, resize and mask the frame, and convert it to grayscale"""
+
+    def __call__(self, ctx: FrameContext) -> FrameContext:
+        frame = orient_frame(ctx.frame)
+        ctx.frame = frame
+
+        # resize image to boost the performance of detectors
+        frame_sm = imutils.resize(frame, width=400)
+
+        # get secure zones compiled for the frame size (masks are cached,
+        # and only rebuilt when zones in the config change)
+        ctx.zone_set = get_zone_set(frame_sm.shape)
+
+        # remove "public" area considered as not-secure (outside of secure area mask),
+        # this is done to adhere to government regulations about the on-premise CCTV
+        # https://www.dataprotection.ie/en/dpc-guidance/blogs/cctv-home
+        # TODO: apply this method to original image as well (pixelate area outside of secure zone)
+        frame_sm = ctx.zone_set.apply(frame_sm)
+
+        # convert to grayscale, if motion detection is restricted to the secure zones,
+        # only their bounding rectangle is converted (and later seen by the motion detector)
+        if config.MOTION_ROI_ONLY:
+            ctx.frame_gray = cv2.cvtColor(ctx.zone_set.crop(frame_sm), cv2.COLOR_BGR2GRAY)
+            ctx.motion_offset = ctx.zone_set.rect[:2]
+        else:
+            ctx.frame_gray = cv2.cvtColor(frame_sm, cv2.COLOR_BGR2GRAY)
+
+        # show secure zones in debug mode
+        if config.APP_DEBUG_MODE:
+            ctx.zone_set.draw(frame_sm)
+        ctx.frame_sm = frame_sm
+        return ctx
+
+
+class MotionStage:
+    """Detect motion with background subtraction, and decide if object detection is needed"""
+
+    def __init__(self):
+        self.motion_detector = MotionDetector()
+        # initialize variable to keep track of consecutive motion frames
+        self.motion_frames = 0
+
+    def __call__(self, ctx: FrameContext) -> FrameContext:
+        # motion detection can run at lower resolution than the analysis frame
+        # (boxes are projected back, so they are always in the analysis frame coordinates)
+        scale = 1.0
+        if config.MOTION_FRAME_WIDTH and config.MOTION_FRAME_WIDTH < ctx.frame_sm.shape[1]:
+            scale = config.MOTION_FRAME_WIDTH / ctx.frame_sm.shape[1]
+
+        # perform motion detection (returns contours large enough to be considered a motion)
+        motion_boxes = self.motion_detector.detect(ctx.frame_gray, offset=ctx.motion_offset, scale=scale)
+        ctx.motion = len(motion_boxes) > 0
+
+        # reset consecutive frames motion counter if no motion was detected in the frame
+        if len(motion_boxes) == 0:
+            self.motion_frames = 0
+            return ctx
+
+        # increment consecutive frames motion counter, and
+        # return early if we don't have enough consecutive frames with motion yet
+        self.motion_frames += 1
+        if self.motion_frames < config.MIN_MOTION_FRAMES:
+            return ctx
+
+        # at this stage we do have enough consecutive frames with motion
+        # reset consecutive frames motion counter
+        self.motion_frames = 0
+
+        # add motion to detections, which will be bulk-saved in the DB later
+        (x, y, w, h, cnt_area) = motion_boxes[0]
+        ctx.detections.append(MotionDetection(create_ts=ctx.ts, x=x, y=y, w=w, h=h, area=cnt_area,
+                                              zone=ctx.zone_set.zone_for_box(x, y, w, h),
+                                              camera_id=config.CAMERA_ID))
+
+        # now that we know we do have the motion, we can run object detection
+        ctx.motion_boxes = motion_boxes
+        ctx.run_inference = True
+        return ctx
+
+
+class InferenceStage:
+    """
+    Run object detection on frames with motion, and update object trackers. In the detection cadence
+    mode (DETECTION_INTERVAL_FRAMES > 1), while objects are tracked, detection only runs every N-th frame
+    with motion (or when tracked positions become uncertain), and tracked objects are predicted in between
+    """
+
+    def __init__(self, model, labels: dict, object_trackers: dict):
+        self.model = model
+        self.labels = labels
+        self.object_trackers = object_trackers
+        # initialize current day, as we need to reset object trackers on a new day
+        self.curr_day = datetime.now().day
+        # frames since object detection last ran (detection cadence mode)
+        self.frames_since_detection = 0
+        self.detected_frames = 0
+        self.predicted_frames = 0
+
+    def __call__(self, ctx: FrameContext) -> FrameContext:
+        # check day, and if it's changed - reset object trackers
+        if ctx.ts.day != self.curr_day:
+            self.curr_day = ctx.ts.day
+            self.object_trackers = {label: ObjectTracker(config.MAX_SAME_OBJ_DIST) for
+                                    label in config.TRACK_OBJECTS}
+            logging.info(f'Beginning of a new day: {self.curr_day}. Object trackers have been reset.')
+
+        # tracked objects are advanced by the time since the previous frame (in seconds),
+        # except frames without motion, in which objects are not moving
+        frame_ts = ctx.ts.timestamp()
+        if not ctx.motion:
+            for tracker in self.object_trackers.values():
+                tracker.hold(frame_ts)
+        # in the detection cadence mode, advance tracked objects to the current frame
+        if config.DETECTION_INTERVAL_FRAMES > 1 and ctx.motion and \
+                any(t.active() for t in self.object_trackers.values()):
+            self.frames_since_detection += 1
+            predicted = {label: tracker.predict(frame_ts) for label, tracker in self.object_trackers.items()}
+            if self.frames_since_detection < config.DETECTION_INTERVAL_FRAMES and \
+                    not any(t.uncertain() for t in self.object_trackers.values()):
+                for label, label_ids in predicted.items():
+                    for x, y, w, h, obj_id in label_ids:
+                        self.add_object_detection(ctx, label, x, y, w, h, obj_id, None)
+                self.predicted_frames += 1
+                return ctx
+        elif not ctx.run_inference:
+            return ctx
+
+        self.frames_since_detection = 0
+        self.detected_frames += 1
+        frame_sm = ctx.frame_sm
+        if config.OBJ_DET_MODE == 'tiles' and len(ctx.motion_boxes) > 0:
+            obj_det_results = self.detect_motion_tiles(ctx)
+        else:
+            # run object detection only on the part of the frame covered by the secure zones,
+            # so the model does not waste its input resolution on the blacked out area
+            roi_x, roi_y, _, _ = ctx.zone_set.rect
+            obj_det_results = [DetectedObject(r.label_id, r.score, (r.box[0] + roi_x, r.box[1] + roi_y,
+                                                                    r.box[2] + roi_x, r.box[3] + roi_y))
+                               for r in self.model.detect(ctx.zone_set.crop(frame_sm),
+                                                          threshold=config.PRED_CONFIDENCE)]
+        # filter out unwanted objects
+        obj_det_results = [r for r in obj_det_results if self.labels.get(r.label_id) in config.TRACK_OBJECTS]
+        logging.debug(f'{len(obj_det_results)} object(s) detected')
+        # group bounding boxes (and scores) by label, as each label has its own object tracker
+        object_coordinates = {}
+        object_scores = {}
+        for r in obj_det_results:
+            # extract the bounding box and predicted class label
+            (start_x, start_y, end_x, end_y) = [int(v) for v in r.box]
+            label = self.labels[r.label_id]
+            object_coordinates.setdefault(label, []).append((start_x, start_y, end_x - start_x, end_y - start_y))
+            object_scores.setdefault(label, []).append(r.score)
+        # now update all object trackers (trackers of the labels not in the frame age their objects)
+        for label, tracker in self.object_trackers.items():
+            label_ids = tracker.update(object_coordinates.get(label, []), frame_ts)
+            # tracker returns boxes in the same order as they were passed in
+            for label_id, score in zip(label_ids, object_scores.get(label, [])):
+                x, y, w, h, obj_id = label_id
+                self.add_object_detection(ctx, label, x, y, w, h, obj_id, score)
+        return ctx
+
+    def add_object_detection(self, ctx: FrameContext, label: str, x: int, y: int, w: int, h: int, obj_id: int,
+                             score: float = None):
+        """Add object to detections (predicted objects have no score), and draw it in debug mode"""
+        logging.debug(f'Object: {label}; x={x}, y={y}, w={w}, h={h};'
+                      f' id={obj_id}; score={"predicted" if score is None else f"{score:.2f}"}')
+        # add to detections, which will be bulk-saved in the DB later
+        obj_detection = ObjectDetection(create_ts=ctx.ts, x=int(x), y=int(y),
+                                        w=int(w), h=int(h), area=int(w * h), label=label,
+                                        obj_id=obj_id, score=score,
+                                        zone=ctx.zone_set.zone_for_box(x, y, w, h),
+                                        camera_id=config.CAMERA_ID)
+        ctx.detections.append(obj_detection)
+        # draw the bounding box and label+id on the image (in debug mode), predicted objects in yellow
+        if config.APP_DEBUG_MODE:
+            color = (0, 255, 0) if score is not None else (0, 255, 255)
+            # draw bounding box
+            cv2.rectangle(ctx.frame_sm, (x, y), (x + w, y + h), color, 1)
+            # label/score/tracking ID
+            cv2.putText(ctx.frame_sm, f'{label}:{"-" if score is None else f"{score:.2f}"}:ID#{obj_id}',
+                        (x, y - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
+            # draw a dot for bounding box centroid
+            cv2.circle(ctx.frame_sm, (obj_detection.cx, obj_detection.cy), 0, color, -1)
+
+    def stats(self) -> dict:
+        return {'detected_frames': self.detected_frames, 'predicted_frames': self.predicted_frames}
+
+    def detect_motion_tiles(self, ctx: FrameContext) -> list:
+        """
+        Run object detection on model-sized tiles cropped around the motion boxes from
+        the full resolution frame (small, distant objects keep more pixels this way),
+        and return results in frame_sm coordinates
+        """
+        scale = ctx.frame.shape[1] / ctx.frame_sm.shape[1]
+        boxes = [(int(x * scale), int(y * scale), int((x + w) * scale), int((y + h) * scale))
+                 for (x, y, w, h, _) in ctx.motion_boxes]
+        results = []
+        for r in detect_tiles(self.model, ctx.frame, boxes, threshold=config.PRED_CONFIDENCE):
+            box = tuple(v / scale for v in r.box)
+            # full resolution frame is not masked, so drop objects outside of the secure zones
+            x, y, w, h = int(box[0]), int(box[1]), int(box[2] - box[0]), int(box[3] - box[1])
+            if ctx.zone_set.zone_for_box(x, y, w, h) is None:
+                continue
+            results.append(DetectedObject(r.label_id, r.score, box))
+        return results
+
+
+def encode_heart_beat_image(frame: np.ndarray) -> bytes:
+    """Encode heart beat image as JPEG (optionally downscaled)"""
+    if config.HEART_BEAT_IMG_WIDTH and config.HEART_BEAT_IMG_WIDTH < frame.shape[1]:
+        frame = imutils.resize(frame, width=config.HEART_BEAT_IMG_WIDTH)
+    return simplejpeg.encode_jpeg(frame, quality=config.HEART_BEAT_JPEG_QUALITY, colorspace='BGR')
+
+
+class PersistStage:
+    """Save detections, check alerts, send heart beats and publish the output frame"""
+
+    def __init__(self, hb_sender, on_output_frame: Callable, detection_writer: DetectionWriter,
+                 alert_worker: AlertWorker, video_stream: CaptureStream = None):
+        self.hb_sender = hb_sender
+        self.detection_writer = detection_writer
+        self.alert_worker = alert_worker
+        self.on_output_frame = on_output_frame
+        self.video_stream = video_stream
+        # is checking for alerts needed, initialize by True,
+        # and then after each alert check set to False for N-seconds,
+        # so we are not constantly saving intruder images
+        # (alert check is handed off to the alert worker)
+        self.is_check_alert = True
+        self.last_alert_check_ts = None
+        # initialize params used to measure single frame processing time
+        self.counter = 0
+        self.proc_times = []
+        # initialize device name (heart beats are sent for each camera)
+        self.device_name = get_device_name()
+
+    def __call__(self, ctx: FrameContext) -> None:
+        curr_frame_ts = ctx.ts
+        detections = ctx.detections
+
+        # keep only valid object detections from detections list
+        valid_obj_detections = [d for d in detections if isinstance(d, ObjectDetection)
+                                and d.label in config.INTRUDER_OBJECTS]
+        # calculate number of seconds since last alert check
+        if len(valid_obj_detections) > 0 and self.last_alert_check_ts is not None and \
+                (curr_frame_ts - self.last_alert_check_ts).total_seconds() > config.MIN_SEC_ALERT_CHECK:
+            logging.info(f'Set is_check_alert to True, curr_frame_ts is {str(curr_frame_ts)} and'
+                         f' last_alert_check_ts is {str(self.last_alert_check_ts)}')
+            self.is_check_alert = True
+        # check for alerts if we have valid objects detected,
+        # and N-seconds elapsed from previous check
+        if len(valid_obj_detections) > 0 and self.is_check_alert is True:
+            # check which frame to pass to security module (based on the debug switch)
+            curr_frame = ctx.frame_sm if config.APP_DEBUG_MODE else ctx.frame
+            # check alerts (decision is made in memory, image and notification are handled by the alert worker)
+            self.alert_worker.submit(valid_obj_detections, curr_frame, curr_frame_ts)
+            # disable alert checks for N-seconds
+            self.is_check_alert = False
+            self.last_alert_check_ts = curr_frame_ts
+            logging.debug(f'Set is_check_alert to False and last_alert_check_ts to {str(curr_frame_ts)}')
+        # save detections in the DB (queued, and written in batches by the writer thread)
+        if len(detections) > 0:
+            self.detection_writer.put(detections)
+
+        # calculate processing time (from the moment frame entered the pipeline)
+        time_diff = (datetime.now() - ctx.proc_start_ts).total_seconds()
+
+        # perform some heart-beat actions every N-frames:
+        # - send heart beat to Message Queue
+        # - calculate average processing time for each frame
+        if self.counter != 0 and self.counter % config.HEART_BEAT_INTERVAL_N_FRAMES == 0:
+            # send periodic image as a heart beat (non-blocking operation),
+            # image is sent as JPEG, so the hub can save it without re-encoding
+            if self.hb_sender is not None:
+                self.hb_sender.send_jpg(self.device_name, encode_heart_beat_image(ctx.frame))
+            # display avg processing time
+            logging.debug(f'Avg processing time per frame:'
+                          f' {sum(self.proc_times) / config.HEART_BEAT_INTERVAL_N_FRAMES:.2f} sec.')
+            if self.video_stream is not None:
+                logging.debug(f'Capture stats: {self.video_stream.stats()}')
+            self.counter = 0
+            self.proc_times = []
+        else:
+            self.proc_times.append(time_diff)
+            self.counter += 1
+
+        # publish the output frame (frames are not modified after this stage, so no copy is needed)
+        self.on_output_frame(ctx.frame_sm if config.APP_DEBUG_MODE else ctx.frame)
+        return None
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+PENDING = 'pending'
+STARTING = 'starting'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class ComponentStartup:
+    """
+    Start app components concurrently (e.g. model load, camera open and DB warm-up, which mostly
+    wait for I/O or native code, so threads are enough), and keep state and start up time of each
+    component, reported by the readiness endpoint. Components are added with add(name, func),
+    and results of the funcs are returned by run() by the component name.
+    """
+
+    def __init__(self, name: str, on_change: Callable = None):
+        self.name = name
+        self.funcs = {}
+        self.components = {}
+        self.results = {}
+        self.on_change = on_change
+        self.start_ts = None
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, func: Callable) -> 'ComponentStartup':
+        self.funcs[name] = func
+        self.components[name] = {'state': PENDING, 'duration_sec': None, 'error': None}
+        return self
+
+    def _set(self, name: str, **values):
+        with self._lock:
+            self.components[name].update(values)
+        if self.on_change is not None:
+            self.on_change(self.stats())
+
+    def _start_component(self, name: str):
+        start_ts = time.perf_counter()
+        self._set(name, state=STARTING)
+        try:
+            self.results[name] = self.funcs[name]()
+        except Exception as e:
+            self._set(name, state=FAILED, duration_sec=round(time.perf_counter() - start_ts, 3), error=str(e))
+            raise
+        self._set(name, state=READY, duration_sec=round(time.perf_counter() - start_ts, 3))
+
+    def run(self, parallel: bool = True) -> dict:
+        """Start all components (concurrently, or one by one), raise the first error if any of them failed"""
+        self.start_ts = time.perf_counter()
+        errors = []
+        if parallel:
+            # wait for all components, so a failed start up does not leave others starting in the background
+            with ThreadPoolExecutor(max_workers=max(len(self.funcs), 1), thread_name_prefix='startup') as executor:
+                futures = [executor.submit(self._start_component, name) for name in self.funcs]
+            errors = [f.exception() for f in futures if f.exception() is not None]
+        else:
+            for name in self.funcs:
+                try:
+                    self._start_component(name)
+                except Exception as e:
+                    errors.append(e)
+                    break
+        self.duration = time.perf_counter() - self.start_ts
+        if errors:
+            raise errors[0]
+        logging.info(f'{self.name} started in {self.duration:.2f} sec. ({self.summary()})')
+        return dict(self.results)
+
+    def summary(self) -> str:
+        """Start up time of each component, e.g. 'model: 1.20s, camera: 0.45s'"""
+        return ', '.join(f'{name}: {c["duration_sec"]:.2f}s' for name, c in self.components.items()
+                         if c['duration_sec'] is not None)
+
+    def ready(self) -> bool:
+        return all(c['state'] == READY for c in self.components.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            components = {name: dict(c) for name, c in self.components.items()}
+        return {'ready': all(c['state'] == READY for c in components.values()),
+                'duration_sec': None if self.duration is None else round(self.duration, 3),
+                'components': components}
@@ -0,0 +1,93 @@
+/**
+ * Image gallery of the forensics section: small thumbnails (/thumbs) are shown in a grid,
+ * full size images (/images) are only downloaded by the lightbox, when a thumbnail is opened
+ */
+const Gallery = (() => {
+    'use strict';
+
+    /**
+     * Convert a page of images returned by /get-images into gallery items
+     * @param {object} page {files, timestamps}
+     * @param {function} formatTs returns [title, full date] of the image timestamp
+     * @returns {array}
+     */
+    const toItems = (page, formatTs) => page.files.map((el, i) => {
+        const [title, fullDate] = formatTs(page.timestamps[i]);
+        return {
+            thumb: `/thumbs/${el}`,
+            src: `/images/${el}`,
+            title: title,
+            description: `Full Date: ${fullDate} | Image Type: ${el.split('_')[1].split('.')[0]}`
+        };
+    });
+
+    /**
+     * Add thumbnails of the items into the grid, tapping a thumbnail calls onOpen with its index
+     * @param {object} container grid element
+     * @param {array} items gallery items
+     * @param {number} offset index of the first item (items already in the grid)
+     * @param {function} onOpen
+     */
+    const renderThumbnails = (container, items, offset, onOpen) => {
+        items.forEach((item, i) => {
+            const img = container.ownerDocument.createElement('img');
+            img.src = item.thumb;
+            img.alt = item.title;
+            img.title = item.title;
+            img.loading = 'lazy';
+            img.className = 'gallery-thumb rounded';
+            img.addEventListener('click', () => onOpen(offset + i));
+            container.appendChild(img);
+        });
+    };
+
+    /**
+     * Fetch pages of the found images (/get-images) one at a time, only when they are needed,
+     * so a search over many days does not download the whole list of images up front
+     */
+    class ImagePager {
+        /**
+         * @param {string} query query string of the search (without the cursor)
+         * @param {function} fetchFn
+         */
+        constructor(query, fetchFn) {
+            this.query = query;
+            this.fetchFn = fetchFn || ((...args) => fetch(...args));
+            this.cursor = null;
+            this.done = false;
+            this.loading = false;
+        }
+
+        /**
+         * Fetch the next page of images {files, timestamps}, return null if there are no more
+         * pages, or the next page is already being fetched
+         * @returns {object}
+         */
+        async next() {
+            if (this.done || this.loading) {
+                return null;
+            }
+            this.loading = true;
+            try {
+                const cursorParam = this.cursor ? `&cursor=${encodeURIComponent(this.cursor)}` : '';
+                const response = await this.fetchFn(`/get-images?${this.query}${cursorParam}`);
+                if (response.status !== 200) {
+                    throw new Error(`ERROR. Code: ${response.status}, msg: ${response.statusText}`);
+                }
+                const page = await response.json();
+                this.cursor = page.next_cursor;
+                this.done = !page.next_cursor;
+                return page;
+            } finally {
+                this.loading = false;
+            }
+        }
+    }
+
+    return {toItems, renderThumbnails, ImagePager};
+})();
+
+// also loadable as a module (tests)
+if (typeof module !== 'undefined') {
+    module.exports = Gallery;
+}
@@ -227,6 +227,8 @@
     const toDate = document.querySelector('#to-date');
     const fromTime = document.querySelector('#from-time');
     const toTime = document.querySelector('#to-time');
+    const galleryGrid = document.querySelector('#gallery');
+    const galleryEnd = document.querySelector('#gallery-end');
 
     // use to emulate touch events in the browser
     TouchEmulator();
@@ -263,7 +265,53 @@
         displayContent(contentIdx);
     });
 
-    // add tap event to SHow Slideshow button in Forensics section
+    // images of the current search (in the gallery grid)
+    let imagePager = null;
+    let galleryItems = [];
+
+    const formatImageTs = ts => {
+        const imgTs = moment(ts);
+        return [imgTs.calendar(), imgTs.format('llll')];
+    };
+
+    // fetch next page of the found images, and add their thumbnails into the grid
+    // (full size image is only loaded by the lightbox)
+    const loadNextImages = async () => {
+        const pager = imagePager;
+        if (!pager) {
+            return;
+        }
+        let page;
+        try {
+            page = await pager.next();
+        } catch (e) {
+            // @TODO: Handle errors more gracefully here
+            console.error('**ERROR**', e);
+            window.alert(e.message);
+            return;
+        }
+        // no more pages (or a page is being fetched already), or a new search was started meanwhile
+        if (!page || pager !== imagePager) {
+            return;
+        }
+        const items = Gallery.toItems(page, formatImageTs);
+        // spotlight index starts from 1
+        Gallery.renderThumbnails(galleryGrid, items, galleryItems.length,
+            idx => Spotlight.show(galleryItems, {index: idx + 1}));
+        galleryItems.push(...items);
+        // keep loading while the end of the grid is still visible (first pages may not fill the screen)
+        if (galleryEnd.getBoundingClientRect().top < window.innerHeight) {
+            await loadNextImages();
+        }
+    };
+
+    new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadNextImages();
+        }
+    }).observe(galleryEnd);
+
+    // add tap event to Show Images button in Forensics section
     new Hammer(btnShowSlideshow).on('tap', async ev => {
         // get checked image types
         const imTypes = ['HEART-BEAT', 'INTRUDER'].map(el => {
@@ -282,33 +330,17 @@
             window.alert('Please make sure that all date and time inputs are provided');
             return;
         }
-        // send a request to API to retrieve relevant images
+        // start a new search, only the first page of images is fetched now,
+        // next pages are fetched when the end of the grid is scrolled into view
+        imagePager = new Gallery.ImagePager(`inc_im_types=${imTypes}&from_date=${fromDateVal}` +
+            `&to_date=${toDateVal}&from_time=${fromTimeVal}&to_time=${toTimeVal}`);
+        galleryItems = [];
+        galleryGrid.replaceChildren();
         showSpinner('Fetching results...');
-        const response = await fetch(`/get-images?inc_im_types=${imTypes}&from_date=${fromDateVal}
-            &to_date=${toDateVal}&from_time=${fromTimeVal}&to_time=${toTimeVal}`);
-        hideSpinner()
-        if (response.status === 200) {
-            const results = await response.json();
-            if (results.files.length === 0) {
-                window.alert('Search criteria did not return any images, try to refine it')
-                return;
-            }
-            let i = 0;
-            const gallery = results.files.map(el => {
-                const imgTs = moment(results.timestamps[i]);
-                i++;
-                return {
-                    src: `/images/${el}`,
-                    title: imgTs.calendar(),
-                    description: `Full Date: ${imgTs.format('llll')} | Image Type: ${el.split('_')[1].split('.')[0]}`
-                };
-            });
-            Spotlight.show(gallery);
-        } else {
-            // @TODO: Handle errors more gracefully here
-            console.error('**ERROR**', response.status, response.statusText);
-            window.alert(`ERROR. Code: ${response.status}, msg: ${response.statusText}`)
-            return null;
+        await loadNextImages();
+        hideSpinner();
+        if (imagePager.done && galleryItems.length === 0) {
+            window.alert('Search criteria did not return any images, try to refine it');
         }
     });
 
@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+
+import config
+
+
+def get_pragmas(read_only: bool = False) -> dict:
+    """Return SQLite pragmas of the storage profile (set in the config), applied to each new connection"""
+    pragmas = {
+        'busy_timeout': config.STORAGE_BUSY_TIMEOUT_MS,
+        'cache_size': -config.STORAGE_CACHE_SIZE_KB,  # negative value is in KiB (not pages)
+        'mmap_size': config.STORAGE_MMAP_SIZE,
+        'temp_store': config.STORAGE_TEMP_STORE,
+    }
+    if not read_only:
+        # journal mode and checkpointing can only be changed by connections which can write
+        pragmas = {'journal_mode': config.STORAGE_JOURNAL_MODE,
+                   'synchronous': config.STORAGE_SYNCHRONOUS,
+                   'wal_autocheckpoint': config.STORAGE_WAL_AUTOCHECKPOINT_PAGES,
+                   **pragmas}
+    return pragmas
+
+
+def create_storage_engine(db_file_path: str, read_only: bool = False, pragmas: dict = None,
+                          echo: bool = False) -> Engine:
+    """
+    Create SQLite engine with the storage profile: WAL journal (readers do not block the writer),
+    synchronous=NORMAL (no fsync on each commit in WAL mode), larger page cache, memory mapped reads
+    and temp tables in memory. Read only engine opens the DB file in read only mode.
+    """
+    pragmas = get_pragmas(read_only) if pragmas is None else pragmas
+    url = f'sqlite:///file:{db_file_path}?mode=ro&uri=true' if read_only else f'sqlite:///{db_file_path}'
+    engine = create_engine(url, connect_args={'check_same_thread': False,
+                                              'timeout': config.STORAGE_BUSY_TIMEOUT_MS / 1000}, echo=echo)
+
+    @event.listens_for(engine, 'connect')
+    def apply_pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    return engine
+
+
+class WalCheckpointer:
+    """
+    Checkpoint the WAL file every N-seconds in a background thread (passive checkpoints do not wait
+    for readers or writers), and truncate the WAL file when it grows over the size limit,
+    so it does not keep growing on the SD card between the automatic checkpoints
+    """
+
+    def __init__(self, engine: Engine, db_file_path: str, interval_sec: float = 300,
+                 truncate_size_mb: float = 64):
+        self.engine = engine
+        self.wal_file_path = f'{db_file_path}-wal'
+        self.interval_sec = interval_sec
+        self.truncate_size = truncate_size_mb * 1024 * 1024
+        self.checkpoints = 0
+        self.last_result = None  # (busy, WAL pages, checkpointed pages)
+        self.last_duration = 0.0
+        self.stopped = False
+
+    def checkpoint(self, mode: str = 'PASSIVE') -> tuple:
+        start_ts = time.perf_counter()
+        with self.engine.connect() as conn:
+            result = tuple(conn.execute(text(f'PRAGMA wal_checkpoint({mode})')).fetchone())
+        self.last_duration = time.perf_counter() - start_ts
+        self.last_result = result
+        self.checkpoints += 1
+        logging.debug(f'WAL checkpoint ({mode}): {result} in {self.last_duration:.3f} sec.')
+        return result
+
+    def wal_size(self) -> int:
+        return os.path.getsize(self.wal_file_path) if os.path.exists(self.wal_file_path) else 0
+
+    def _run(self):
+        while not self.stopped:
+            time.sleep(self.interval_sec)
+            try:
+                self.checkpoint('TRUNCATE' if self.wal_size() > self.truncate_size else 'PASSIVE')
+            except Exception as e:
+                logging.error(f'WAL checkpoint failed: {str(e)}')
+
+    def start(self) -> 'WalCheckpointer':
+        t = threading.Thread(target=self._run, name='wal-checkpointer')
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        self.stopped = True
+
+    def stats(self) -> dict:
+        return {'checkpoints': self.checkpoints, 'last_result': self.last_result,
+                'last_duration_ms': round(self.last_duration * 1000, 2), 'wal_size_kb': self.wal_size() // 1024}
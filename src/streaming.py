@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+
+import cv2
+import numpy as np
+import simplejpeg
+
+
+class FrameBroadcaster:
+    """
+    Encode each new output frame to JPEG only once, keep the latest JPEG bytes
+    with a version counter, and wake up all the (async) clients streaming it.
+    Frames can be downscaled and rate limited (stream profile), and they are only
+    encoded while at least one client is watching (or when a snapshot is requested).
+    """
+
+    def __init__(self, quality: int = 90, width: int = None, max_fps: float = None):
+        self.quality = quality
+        self.width = width
+        self.max_fps = max_fps
+        self.jpeg = None
+        self.version = 0  # version of the frame the current JPEG was encoded from
+        self.encoded = 0
+        self._frame = None
+        self._frame_version = 0
+        self._last_encode_ts = 0.0
+        self._lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+        # (event loop, asyncio.Event) of each client waiting for a new frame
+        self._waiters = set()
+
+    def publish(self, frame: np.ndarray):
+        """Pass a new frame to the broadcaster (called from the thread receiving frames)"""
+        with self._lock:
+            self._frame = frame
+            self._frame_version += 1
+            has_clients = len(self._waiters) > 0
+        # nobody is watching, frame will be encoded on demand
+        if not has_clients:
+            return
+        # skip the frame if max FPS of the stream would be exceeded
+        if self.max_fps and time.time() - self._last_encode_ts < 1.0 / self.max_fps:
+            return
+        self.encode()
+
+    def encode(self):
+        """Encode the latest frame (if not encoded yet), and notify clients"""
+        with self._encode_lock:
+            with self._lock:
+                frame, frame_version = self._frame, self._frame_version
+            if frame is None or frame_version == self.version:
+                return
+            if self.width and self.width < frame.shape[1]:
+                height = int(frame.shape[0] * self.width / frame.shape[1])
+                frame = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+            # simplejpeg is faster than cv2.imencode, which is actually a bottleneck in RPi
+            jpeg = simplejpeg.encode_jpeg(frame, quality=self.quality, colorspace='BGR')
+            self._last_encode_ts = time.time()
+            with self._lock:
+                self.jpeg = jpeg
+                self.version = frame_version
+                self.encoded += 1
+                waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def latest(self) -> tuple:
+        """Return (version, JPEG bytes) of the latest encoded frame"""
+        with self._lock:
+            return self.version, self.jpeg
+
+    def snapshot(self) -> bytes:
+        """Return JPEG bytes of the latest frame (encode it if needed)"""
+        self.encode()
+        return self.latest()[1]
+
+    async def frames(self):
+        """Async generator of JPEG bytes, yields each new frame once"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            # the stream may have been idle, so make sure the client does not start with a stale frame
+            await loop.run_in_executor(None, self.encode)
+            last_version = 0
+            while True:
+                if self.version == last_version:
+                    event.clear()
+                    # check again, as the frame might have been published before the event was cleared
+                    if self.version == last_version:
+                        await event.wait()
+                last_version, jpeg = self.latest()
+                if jpeg is not None:
+                    yield jpeg
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    async def stream(self):
+        """Async generator of multipart (MJPEG) chunks"""
+        async for jpeg in self.frames():
+            yield b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+
+    def clients(self) -> int:
+        """Return number of clients currently streaming"""
+        with self._lock:
+            return len(self._waiters)
+
+    def stats(self) -> dict:
+        return {'clients': self.clients(), 'encoded_frames': self.encoded}
+
+
+def create_broadcasters(profiles: dict) -> dict:
+    """Create a broadcaster for each stream profile: {name: {'width', 'quality', 'max_fps'}}"""
+    return {name: FrameBroadcaster(quality=p.get('quality', 90), width=p.get('width'), max_fps=p.get('max_fps'))
+            for name, p in profiles.items()}
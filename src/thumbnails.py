@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+from os import path
+
+import cv2
+import simplejpeg
+
+import config
+
+
+class ThumbnailCache:
+    """
+    Thumbnails of the images in the images folder, created on the first request and stored
+    in the cache folder (mirroring the images folder structure). Cache size is capped,
+    least recently used thumbnails are evicted (modification time is used as the last access time,
+    as SD cards are usually mounted with noatime).
+    """
+
+    def __init__(self, img_folder: str, cache_folder: str, width: int = 320, quality: int = 75,
+                 max_bytes: int = 200 * 1024 * 1024):
+        self.img_folder = path.realpath(img_folder)
+        self.cache_folder = path.realpath(cache_folder)
+        self.width = width
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_folder, exist_ok=True)
+        self.size_bytes = sum(size for _, _, size in self._cached_files())
+
+    def _cached_files(self) -> list:
+        """Return (mtime, path, size) of all the thumbnails in the cache"""
+        files = []
+        for root, _, names in os.walk(self.cache_folder):
+            for name in names:
+                f = path.join(root, name)
+                try:
+                    st = os.stat(f)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, f, st.st_size))
+        return files
+
+    def source_path(self, im_filename: str) -> str:
+        """Return full path of the image, or raise ValueError if it is outside of the images folder"""
+        src = path.realpath(path.join(self.img_folder, im_filename))
+        if not src.startswith(self.img_folder + os.sep):
+            raise ValueError(f'Invalid image path: {im_filename}')
+        return src
+
+    def make_thumbnail(self, src: str) -> bytes:
+        """Decode the image (JPEGs are downscaled already while decoding), resize it and encode it to JPEG"""
+        with open(src, 'rb') as f:
+            data = f.read()
+        if simplejpeg.is_jpeg(data):
+            # DCT scaling (1/2, 1/4, 1/8), decoded image will still be at least thumbnail width
+            image = simplejpeg.decode_jpeg(data, colorspace='BGR', fastdct=True, min_width=self.width)
+        else:
+            image = cv2.imread(src)
+            if image is None:
+                raise ValueError(f'Could not read image: {src}')
+        if image.shape[1] > self.width:
+            height = int(image.shape[0] * self.width / image.shape[1])
+            image = cv2.resize(image, (self.width, height), interpolation=cv2.INTER_AREA)
+        return simplejpeg.encode_jpeg(image, quality=self.quality, colorspace='BGR')
+
+    def get(self, im_filename: str) -> str:
+        """
+        Return path of the thumbnail of the image (path relative to the images folder),
+        raise FileNotFoundError if the image does not exist
+        """
+        src = self.source_path(im_filename)
+        thumb = path.join(self.cache_folder, path.relpath(src, self.img_folder))
+        if path.exists(thumb):
+            # mark as recently used
+            os.utime(thumb)
+            self.hits += 1
+            return thumb
+        if not path.exists(src):
+            raise FileNotFoundError(im_filename)
+        self.misses += 1
+        data = self.make_thumbnail(src)
+        os.makedirs(path.dirname(thumb), exist_ok=True)
+        # write to a temp file first, so a partial thumbnail is never served
+        tmp = f'{thumb}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, thumb)
+        with self._lock:
+            self.size_bytes += len(data)
+            if self.size_bytes > self.max_bytes:
+                self._evict()
+        return thumb
+
+    def _evict(self):
+        """Remove least recently used thumbnails, until the cache is at 90% of its max size"""
+        files = sorted(self._cached_files())
+        self.size_bytes = sum(size for _, _, size in files)
+        for _, f, size in files:
+            if self.size_bytes <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.unlink(f)
+            except FileNotFoundError:
+                pass
+            self.size_bytes -= size
+            self.evicted += 1
+        logging.info(f'Thumbnail cache evicted to {self.size_bytes / 1024 / 1024:.1f} MB')
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'evicted': self.evicted,
+                'size_mb': round(self.size_bytes / 1024 / 1024, 2)}
+
+
+def create_thumbnail_cache() -> ThumbnailCache:
+    """Create thumbnail cache with the config settings"""
+    return ThumbnailCache(config.IMG_FOLDER, config.THUMBS_FOLDER, width=config.THUMB_WIDTH,
+                          quality=config.THUMB_JPEG_QUALITY, max_bytes=config.THUMBS_CACHE_MAX_MB * 1024 * 1024)
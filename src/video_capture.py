@@ -0,0 +1,99 @@
+import threading
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+
+class Frame(NamedTuple):
+    """Single frame grabbed from the camera, stamped by the capture thread"""
+    seq: int  # monotonically increasing sequence number (starts at 1)
+    ts: datetime  # capture timestamp
+    image: np.ndarray
+
+
+class CaptureStream:
+    """
+    Grab frames from the camera in a dedicated thread and stamp each of them
+    with a sequence number and capture time, so the consumer can tell if a frame
+    is new (unlike imutils VideoStream, which keeps returning the latest frame).
+    """
+
+    def __init__(self, src: int = 0, resolution: tuple = (1280, 720)):
+        # keep the name of the cv2.VideoCapture attribute compatible with imutils,
+        # as stream properties (brightness, contrast, etc.) are set through it
+        self.stream = cv2.VideoCapture(src)
+        self.stream.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+        self.stream.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+        self.stopped = False
+        # latest frame and a condition used to wake up the consumer when a new one arrives
+        self._frame = None
+        self._cond = threading.Condition()
+        self._thread = None
+        # counters reported by stats()
+        self.frames_grabbed = 0
+        self.frames_failed = 0
+        self.frames_dropped = 0  # frames grabbed by the camera, which the consumer never saw
+        self.frames_repeated = 0  # reads, which would have returned an already processed frame
+
+    def start(self) -> 'CaptureStream':
+        """Start grabbing frames in a daemon thread"""
+        self._thread = threading.Thread(target=self._update, name='capture')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _update(self):
+        """Keep grabbing frames from the camera until stopped"""
+        while not self.stopped:
+            grabbed, image = self.stream.read()
+            if not grabbed:
+                # camera hiccup, back off for a moment (stalled stream is
+                # picked up by the heart beat monitor)
+                self.frames_failed += 1
+                time.sleep(0.01)
+                continue
+            with self._cond:
+                self.frames_grabbed += 1
+                self._frame = Frame(seq=self.frames_grabbed, ts=datetime.now(), image=image)
+                self._cond.notify_all()
+        self.stream.release()
+
+    def read(self, last_seq: int = 0, timeout: float = 1.0) -> Optional[Frame]:
+        """
+        Return the first frame newer than last_seq, block until it arrives
+        (or until timeout in seconds elapses, in which case None is returned)
+        """
+        with self._cond:
+            if self._frame is None or self._frame.seq <= last_seq:
+                # consumer is faster than the camera, wait for a new frame
+                # instead of processing the same one again
+                self.frames_repeated += 1
+                self._cond.wait_for(lambda: self.stopped or (self._frame is not None and
+                                                             self._frame.seq > last_seq), timeout=timeout)
+            frame = self._frame
+        if frame is None or frame.seq <= last_seq:
+            return None
+        # any frames between the last seen one and the current one were never processed
+        if last_seq > 0:
+            self.frames_dropped += frame.seq - last_seq - 1
+        return frame
+
+    def stats(self) -> dict:
+        """Return capture counters"""
+        return {
+            'grabbed': self.frames_grabbed,
+            'failed': self.frames_failed,
+            'dropped': self.frames_dropped,
+            'repeated': self.frames_repeated
+        }
+
+    def stop(self):
+        """Stop the capture thread (camera is released by the thread itself)"""
+        self.stopped = True
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
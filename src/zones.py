@@ -0,0 +1,95 @@
+import logging
+import threading
+from typing import Optional
+
+import cv2
+import numpy as np
+
+import config
+
+
+class Zone:
+    """Named polygon (convex or not) compiled into a mask and a bounding rectangle"""
+
+    def __init__(self, name: str, poly: list, frame_shape: tuple):
+        self.name = name
+        self.pts = np.array(poly, np.int32).reshape((-1, 1, 2))
+        self.mask = np.zeros(frame_shape[:2], np.uint8)
+        cv2.fillPoly(self.mask, [self.pts], 255)
+        # (x, y, w, h) of the polygon, clipped to the frame
+        self.rect = cv2.boundingRect(self.mask)
+
+
+class ZoneSet:
+    """
+    All secure zones compiled for a given frame shape, i.e. a single mask covering all the zones,
+    the tight bounding rectangle of that mask (ROI), and a label map used to tag detections
+    with the zone they fall in
+    """
+
+    def __init__(self, zones: dict, frame_shape: tuple):
+        self.frame_shape = frame_shape
+        self.zones = [Zone(name, poly, frame_shape) for name, poly in zones.items()]
+        self.mask = np.zeros(frame_shape[:2], np.uint8)
+        # each pixel holds index of the zone + 1 (0 means outside of any zone),
+        # when zones overlap, the one defined later wins
+        self.label_map = np.zeros(frame_shape[:2], np.uint8)
+        for idx, zone in enumerate(self.zones):
+            self.mask = cv2.bitwise_or(self.mask, zone.mask)
+            self.label_map[zone.mask > 0] = idx + 1
+        self.rect = cv2.boundingRect(self.mask)
+        x, y, w, h = self.rect
+        self.roi_mask = self.mask[y:y + h, x:x + w]
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """Black out everything outside of the secure zones"""
+        return cv2.bitwise_and(frame, frame, mask=self.mask)
+
+    def crop(self, frame: np.ndarray) -> np.ndarray:
+        """Return view of the frame cropped to the ROI (no copy is made)"""
+        x, y, w, h = self.rect
+        return frame[y:y + h, x:x + w]
+
+    def zone_at(self, x: int, y: int) -> Optional[str]:
+        """Return name of the zone at given point (or None if it's outside of all zones)"""
+        height, width = self.label_map.shape
+        idx = self.label_map[min(max(y, 0), height - 1), min(max(x, 0), width - 1)]
+        return self.zones[idx - 1].name if idx > 0 else None
+
+    def zone_for_box(self, x: int, y: int, w: int, h: int) -> Optional[str]:
+        """Return name of the zone, which contains centroid of the bounding box"""
+        return self.zone_at(x + w // 2, y + h // 2)
+
+    def draw(self, frame: np.ndarray):
+        """Draw zone outlines and names on the frame (used in debug mode)"""
+        for zone in self.zones:
+            cv2.polylines(frame, [zone.pts], True, (0, 0, 255))
+            cv2.putText(frame, zone.name, (zone.rect[0] + 5, zone.rect[1] + zone.rect[3] - 5),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.3, (0, 0, 255), 1)
+
+
+def get_secure_zones() -> dict:
+    """Return secure zones defined in the config as {name: polygon}"""
+    if getattr(config, 'SECURE_ZONES', None):
+        return config.SECURE_ZONES
+    return {'secure': config.SECURE_ZONE_POLY}
+
+
+# compiled zones are cached, and only rebuilt when zones in the config
+# (or the frame shape) change, e.g. when config is reloaded in debug mode
+_cache_lock = threading.Lock()
+_cache_key = None
+_cache_zone_set = None
+
+
+def get_zone_set(frame_shape: tuple, zones: dict = None) -> ZoneSet:
+    """Return compiled zones for the frame shape, compile them only if needed"""
+    global _cache_key, _cache_zone_set
+    zones = get_secure_zones() if zones is None else zones
+    key = (tuple(frame_shape[:2]), tuple((name, tuple(map(tuple, poly))) for name, poly in zones.items()))
+    with _cache_lock:
+        if key != _cache_key:
+            logging.info(f'Compiling secure zones: {", ".join(zones.keys())}')
+            _cache_zone_set = ZoneSet(zones, frame_shape)
+            _cache_key = key
+        return _cache_zone_set
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# config reads SMTP settings from the environment (tests only ever talk to a local SMTP server)
+for name, value in {'SMTP_SERVER_HOST': '127.0.0.1', 'SMTP_SERVER_PORT': '587',
+                    'EMAIL_SENDER_ADDRESS': 'third-eye@localhost', 'EMAIL_SENDER_PASSWORD': '',
+                    'RECEIVER_EMAIL_ADDRESSES': 'owner@localhost'}.items():
+    os.environ.setdefault(name, value)
+
+# app modules are imported from src, as when the app is run from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+@pytest.fixture
+def db_engine(tmp_path):
+    """Engine of an empty DB (with all tables) in a temporary folder, the scoped session is bound to it"""
+    from database import Base, Session
+    from storage import create_storage_engine
+    import models  # noqa: F401 (registers the tables)
+    engine = create_storage_engine(str(tmp_path / 'app.db'))
+    Base.metadata.create_all(engine)
+    Session.configure(bind=engine)
+    yield engine
+    Session.remove()
+    engine.dispose()
@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cache import TTLCache
+
+
+class Counter:
+    """Compute function, which counts its calls (and can be held until released)"""
+
+    def __init__(self, hold: bool = False):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return self.calls
+
+
+def test_hits_and_misses():
+    cache = TTLCache(ttl=0.2)
+    compute = Counter()
+    assert cache.get('a', compute) == 1
+    assert cache.get('a', compute) == 1
+    assert cache.get('b', compute) == 2
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'coalesced': 0, 'invalidations': 0, 'debounced': 0,
+                             'entries': 2}
+    # expired
+    time.sleep(0.25)
+    assert cache.get('a', compute) == 3
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_concurrent_misses_are_coalesced():
+    cache = TTLCache(ttl=10)
+    compute = Counter(hold=True)
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        first = executor.submit(cache.get, 'a', compute)
+        assert compute.started.wait(5)
+        others = [executor.submit(cache.get, 'a', compute) for _ in range(4)]
+        # wait until all the callers are waiting for the value being computed
+        deadline = time.time() + 5
+        while cache.coalesced < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        compute.release.set()
+        results = [first.result()] + [f.result() for f in others]
+    assert results == [1] * 5
+    assert compute.calls == 1
+    assert (cache.misses, cache.coalesced, cache.hits) == (1, 4, 0)
+    assert cache.get('a', compute) == 1
+    assert cache.hits == 1
+
+
+def test_failed_computation_is_shared_and_not_cached():
+    cache = TTLCache(ttl=10)
+
+    def fail():
+        raise ValueError('DB is locked')
+
+    with pytest.raises(ValueError):
+        cache.get('a', fail)
+    assert cache.get('a', Counter()) == 1
+    assert cache.misses == 2
+
+
+def test_value_computed_across_invalidation_is_not_stored():
+    cache = TTLCache(ttl=10)
+    compute = Counter(hold=True)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        f = executor.submit(cache.get, 'a', compute)
+        assert compute.started.wait(5)
+        assert cache.invalidate()
+        compute.release.set()
+        # the caller still gets the value
+        assert f.result() == 1
+    assert cache.get('a', compute) == 2
+    assert cache.misses == 2
+
+
+def test_debounced_invalidation_expires_entries_at_the_end_of_the_interval():
+    cache = TTLCache(ttl=10)
+    compute = Counter()
+    assert cache.invalidate(min_interval=0.2)
+    assert cache.get('a', compute) == 1
+    # too soon after the previous invalidation, the entry is kept until the interval is over
+    assert not cache.invalidate(min_interval=0.2)
+    assert cache.get('a', compute) == 1
+    time.sleep(0.25)
+    assert cache.get('a', compute) == 2
+    assert (cache.invalidations, cache.debounced) == (1, 1)
+    # interval is independent of the TTL
+    assert cache.invalidate(min_interval=0.2)
+    assert cache.get('a', compute) == 3
@@ -0,0 +1,63 @@
+import os
+import signal
+import time
+
+import numpy as np
+import pytest
+
+from cameras import SharedFrame, mp_ctx
+
+SHAPE = (72, 128, 3)
+
+
+def hold_lock(shared_frame: SharedFrame):
+    """Worker which dies while holding the lock of the shared frame"""
+    shared_frame.write(np.ones(SHAPE, np.uint8))
+    shared_frame.lock.acquire()
+    time.sleep(60)
+
+
+@pytest.fixture
+def shared_frame():
+    shared_frame = SharedFrame(SHAPE, lock_timeout=0.2)
+    yield shared_frame
+    shared_frame.close()
+
+
+def test_write_and_read(shared_frame):
+    frame = np.random.default_rng(0).integers(0, 255, size=(36, 64, 3), dtype=np.uint8)
+    shared_frame.write(frame)
+    seq, read_frame = shared_frame.read(0, timeout=0.1)
+    assert seq == 1
+    np.testing.assert_array_equal(read_frame, frame)
+    # no newer frame
+    assert shared_frame.read(seq, timeout=0.05) == (seq, None)
+
+
+def test_frame_too_large_is_skipped(shared_frame):
+    shared_frame.write(np.zeros((100, 200, 3), np.uint8))
+    assert shared_frame.read(0, timeout=0.05) == (0, None)
+
+
+def test_read_after_close(shared_frame):
+    shared_frame.write(np.zeros(SHAPE, np.uint8))
+    shared_frame.close()
+    assert shared_frame.read(0, timeout=0.05) == (0, None)
+    # closing again does nothing
+    shared_frame.close()
+
+
+def test_killed_worker_holding_lock_does_not_block_reader(shared_frame):
+    p = mp_ctx.Process(target=hold_lock, args=(shared_frame,))
+    p.start()
+    try:
+        deadline = time.monotonic() + 30
+        while shared_frame.meta[0] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.2)
+    finally:
+        os.kill(p.pid, signal.SIGKILL)
+        p.join()
+    start_ts = time.monotonic()
+    assert shared_frame.read(0, timeout=0.1) == (0, None)
+    assert time.monotonic() - start_ts < 1.0
@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+GALLERY_JS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'static', 'gallery.js')
+
+pytestmark = pytest.mark.skipif(shutil.which('node') is None, reason='node is not installed')
+
+
+def run_js(script: str):
+    """Run the script in node (with the gallery module loaded as Gallery), return what it printed as JSON"""
+    out = subprocess.run(['node', '-e', f'const Gallery = require({json.dumps(GALLERY_JS)});\n{script}'],
+                         capture_output=True, text=True, timeout=30, check=True).stdout
+    return json.loads(out)
+
+
+def test_items_use_thumbnails_and_full_size_images():
+    items = run_js("""
+        const page = {files: ['2024-05-01/120000.000000_INTRUDER.jpg'], timestamps: ['2024-05-01T12:00:00']};
+        console.log(JSON.stringify(Gallery.toItems(page, ts => ['today', ts])));
+    """)
+    assert items == [{'thumb': '/thumbs/2024-05-01/120000.000000_INTRUDER.jpg',
+                      'src': '/images/2024-05-01/120000.000000_INTRUDER.jpg', 'title': 'today',
+                      'description': 'Full Date: 2024-05-01T12:00:00 | Image Type: INTRUDER'}]
+
+
+def test_grid_requests_thumbnails_and_opens_lightbox():
+    res = run_js("""
+        const listeners = [];
+        const container = {
+            children: [],
+            appendChild(el) { this.children.push(el); },
+            ownerDocument: {createElement: tag => ({tag, addEventListener: (ev, f) => listeners.push(f)})}
+        };
+        const items = [{thumb: '/thumbs/a.jpg', src: '/images/a.jpg', title: 'a'},
+                       {thumb: '/thumbs/b.jpg', src: '/images/b.jpg', title: 'b'}];
+        const opened = [];
+        Gallery.renderThumbnails(container, items, 10, idx => opened.push(idx));
+        listeners[1]();
+        console.log(JSON.stringify({srcs: container.children.map(el => el.src), opened}));
+    """)
+    # grid only loads thumbnails, full size images are left to the lightbox
+    assert res == {'srcs': ['/thumbs/a.jpg', '/thumbs/b.jpg'], 'opened': [11]}
+
+
+def test_pages_are_fetched_on_demand():
+    res = run_js("""
+        const urls = [];
+        const pages = {'': {files: ['a'], timestamps: ['t1'], next_cursor: 'c1'},
+                       'c1': {files: ['b'], timestamps: ['t2'], next_cursor: null}};
+        const fetchFn = async url => {
+            urls.push(url);
+            const cursor = url.includes('cursor=') ? url.split('cursor=')[1] : '';
+            return {status: 200, json: async () => pages[cursor]};
+        };
+        (async () => {
+            const pager = new Gallery.ImagePager('inc_im_types=INTRUDER', fetchFn);
+            const first = await pager.next();
+            const fetchedFirst = urls.length;
+            // concurrent call, while a page is being fetched, does not fetch the same page again
+            const [second, concurrent] = await Promise.all([pager.next(), pager.next()]);
+            const last = await pager.next();
+            console.log(JSON.stringify({first: first.files, fetchedFirst, second: second.files, concurrent, last,
+                                        done: pager.done, urls}));
+        })();
+    """)
+    assert res == {'first': ['a'], 'fetchedFirst': 1, 'second': ['b'], 'concurrent': None, 'last': None,
+                   'done': True, 'urls': ['/get-images?inc_im_types=INTRUDER',
+                                          '/get-images?inc_im_types=INTRUDER&cursor=c1']}
+
+
+def test_failed_page_can_be_fetched_again():
+    res = run_js("""
+        let calls = 0;
+        const fetchFn = async url => {
+            calls++;
+            if (calls === 1) {
+                return {status: 500, statusText: 'Internal Server Error'};
+            }
+            return {status: 200, json: async () => ({files: ['a'], timestamps: ['t1'], next_cursor: null})};
+        };
+        (async () => {
+            const pager = new Gallery.ImagePager('inc_im_types=INTRUDER', fetchFn);
+            let error = null;
+            try {
+                await pager.next();
+            } catch (e) {
+                error = e.message;
+            }
+            const page = await pager.next();
+            console.log(JSON.stringify({error, files: page.files, done: pager.done}));
+        })();
+    """)
+    assert res == {'error': 'ERROR. Code: 500, msg: Internal Server Error', 'files': ['a'], 'done': True}
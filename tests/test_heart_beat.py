@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import config
+from database import Session
+from heart_beat import HeartBeatImages, HeartBeatState, find_stalled_cameras, get_monitored_camera_ids
+from models import Image
+
+
+@pytest.fixture
+def img_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'IMG_FOLDER', str(tmp_path / 'images'))
+    (tmp_path / 'images').mkdir()
+    return config.IMG_FOLDER
+
+
+def test_images_saved_once_per_minute_for_each_device(db_engine, img_folder):
+    state = HeartBeatState()
+    images = HeartBeatImages(state)
+    now = datetime(2024, 5, 1, 12, 30, 5)
+    first = images.save('pi:cam0', b'cam0-1', now)
+    # other camera in the same minute still gets its own image
+    other = images.save('pi:cam1', b'cam1-1', now + timedelta(seconds=1))
+    assert other != first
+    # same camera in the same minute keeps its last image
+    assert images.save('pi:cam0', b'cam0-2', now + timedelta(seconds=30)) == first
+    assert images.save('pi:cam1', b'cam1-2', now + timedelta(seconds=31)) == other
+    with open(first, 'rb') as f:
+        assert f.read() == b'cam0-1'
+    with open(other, 'rb') as f:
+        assert f.read() == b'cam1-1'
+    # new minute (the same minute of the next hour too)
+    assert images.save('pi:cam0', b'cam0-3', now + timedelta(minutes=1)) != first
+    assert images.save('pi:cam1', b'cam1-3', now + timedelta(hours=1)) != other
+    # catalog rows are only written with the next batch of heart beats
+    assert Session.query(Image).count() == 0
+    state.flush()
+    assert sorted(camera_id for camera_id, in Session.query(Image.camera_id)) == ['cam0', 'cam0', 'cam1', 'cam1']
+
+
+def test_stalled_cameras():
+    now = datetime(2024, 5, 1, 12, 0)
+    start_ts = now - timedelta(minutes=10)
+    state = HeartBeatState()
+    state.update('pi:cam0', now - timedelta(seconds=10), 'a.jpg')
+    state.update('pi:cam1', now - timedelta(minutes=5), 'b.jpg')
+    assert find_stalled_cameras(state, ['cam0', 'cam1'], start_ts, now) == ['cam1']
+    # camera without any heart beat is given time to start
+    assert find_stalled_cameras(state, ['cam0', 'cam2'], now - timedelta(seconds=30), now) == []
+    assert find_stalled_cameras(state, ['cam0', 'cam2'], start_ts, now) == ['cam2']
+
+
+def test_devices_not_configured_are_forgotten():
+    now = datetime(2024, 5, 1, 12, 0)
+    state = HeartBeatState()
+    state.update('pi:cam0', now, 'a.jpg')
+    state.update('pi:removed', now, 'b.jpg')
+    # still sending heart beats, so it is kept (and never reported as stalled)
+    assert find_stalled_cameras(state, ['cam0'], now, now) == []
+    assert set(state.devices()) == {'pi:cam0', 'pi:removed'}
+    later = now + timedelta(seconds=config.HEART_BEAT_INTERVAL_MAX_IDLE_N_SEC + 1)
+    assert find_stalled_cameras(state, ['cam0'], now, later) == ['cam0']
+    assert set(state.devices()) == {'pi:cam0'}
+
+
+def test_monitored_cameras(monkeypatch):
+    monkeypatch.setattr(config, 'CAMERAS', [{'id': 'cam0', 'src': 0},
+                                            {'id': 'cam1', 'src': 1, 'config': {'HEART_BEAT_ENABLED': False}}])
+    assert get_monitored_camera_ids() == ['cam0']
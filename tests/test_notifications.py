@@ -0,0 +1,136 @@
+import smtplib
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+from sqlalchemy import select
+
+import config
+from database import Session
+from mailer import SmtpClient
+from models import Notification
+from notifications import FAILED, PENDING, SENDING, SENT, NotificationWorker, create_notification, retry_delay
+
+
+class RecordingHandler:
+    """Keep received messages, and the client address of each of them (a new port means a new connection)"""
+
+    def __init__(self):
+        self.messages = []
+        self.peers = []
+        self.reject = False
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.reject:
+            return '554 Transaction failed'
+        self.messages.append(envelope.content)
+        self.peers.append(session.peer)
+        return '250 Message accepted for delivery'
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    """Local SMTP server without STARTTLS (like a local relay)"""
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+def insecure_client(smtp_server) -> SmtpClient:
+    return SmtpClient(host=smtp_server.hostname, port=smtp_server.port, password='', timeout=5, allow_insecure=True)
+
+
+def add_notifications(n: int, now: datetime, status: str = PENDING) -> list:
+    notifications = [create_notification(f'Alert {i}', 'Potential intruders detected', now=now) for i in range(n)]
+    for notification in notifications:
+        notification.status = status
+    Session.add_all(notifications)
+    Session.commit()
+    return [notification.id for notification in notifications]
+
+
+def fetch_notifications(db_engine) -> list:
+    table = Notification.__table__
+    with db_engine.connect() as conn:
+        return conn.execute(select(table).order_by(table.c.id)).fetchall()
+
+
+def test_connection_is_reused(db_engine, smtp_server):
+    worker = NotificationWorker(db_engine, client=insecure_client(smtp_server))
+    now = datetime.now()
+    add_notifications(3, now)
+    assert worker.process_due(now) == 3
+    add_notifications(2, now)
+    assert worker.process_due(now) == 2
+    assert [row.status for row in fetch_notifications(db_engine)] == [SENT] * 5
+    assert len(smtp_server.handler.messages) == 5
+    # single connection (and EHLO) for all the emails
+    assert worker.client.connects == 1
+    assert len(set(smtp_server.handler.peers)) == 1
+    worker.client.close()
+
+
+def test_failed_notification_is_retried_with_backoff(db_engine, smtp_server, monkeypatch):
+    monkeypatch.setattr(config, 'NOTIFICATION_RETRY_BASE_SEC', 30)
+    monkeypatch.setattr(config, 'NOTIFICATION_RETRY_MAX_SEC', 100)
+    smtp_server.handler.reject = True
+    worker = NotificationWorker(db_engine, client=insecure_client(smtp_server), max_attempts=4)
+    now = datetime.now()
+    add_notifications(1, now)
+    delays = []
+    for attempt in range(1, 4):
+        assert worker.process_due(now) == 1
+        row, = fetch_notifications(db_engine)
+        assert (row.status, row.attempts) == (PENDING, attempt)
+        delays.append((row.next_attempt_ts - row.update_ts).total_seconds())
+        # not due yet
+        assert worker.process_due(row.next_attempt_ts - timedelta(seconds=1)) == 0
+        now = row.next_attempt_ts
+    # 30 * 2^(n-1), capped
+    assert delays == [30, 60, 100] == [retry_delay(attempt) for attempt in range(1, 4)]
+    # given up after max attempts
+    assert worker.process_due(now) == 1
+    row, = fetch_notifications(db_engine)
+    assert (row.status, row.attempts) == (FAILED, 4)
+    assert row.last_error.startswith('(554')
+    assert worker.process_due(now + timedelta(days=1)) == 0
+    assert (worker.retried, worker.failed, worker.sent) == (3, 1, 0)
+    # rejected emails do not drop the connection
+    assert worker.client.connects == 1
+    worker.client.close()
+
+
+def test_notifications_left_sending_are_recovered(db_engine, smtp_server):
+    now = datetime.now()
+    add_notifications(1, now, status=SENDING)
+    add_notifications(1, now)
+    worker = NotificationWorker(db_engine, client=insecure_client(smtp_server))
+    # claimed by a worker which stopped before sending it
+    assert worker.process_due(now) == 1
+    worker.recover()
+    assert worker.process_due(now) == 1
+    assert [row.status for row in fetch_notifications(db_engine)] == [SENT, SENT]
+    assert len(smtp_server.handler.messages) == 2
+    worker.client.close()
+
+
+def test_server_without_starttls_is_refused(smtp_server, monkeypatch):
+    client = SmtpClient(host=smtp_server.hostname, port=smtp_server.port, password='secret', timeout=5)
+    with pytest.raises(smtplib.SMTPNotSupportedError):
+        client.connect()
+    assert client.server is None
+    # unless unencrypted connections are allowed (no login then)
+    monkeypatch.setattr(config, 'SMTP_ALLOW_INSECURE', True)
+    client = SmtpClient(host=smtp_server.hostname, port=smtp_server.port, password='secret', timeout=5)
+    client.connect()
+    assert client.connects == 1
+    client.close()
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+import object_tracker
+from object_tracker import ObjectTracker, assign, box_iou
+
+
+@pytest.fixture(params=['hungarian', 'greedy'])
+def solver(request, monkeypatch):
+    """Run the test with the optimal (scipy) and the greedy assignment"""
+    if request.param == 'greedy':
+        monkeypatch.setattr(object_tracker, 'load_solver', lambda: None)
+    return request.param
+
+
+def ids(tracked: list) -> list:
+    return [obj[4] for obj in tracked]
+
+
+def test_ids_are_kept_for_moving_objects(solver):
+    tracker = ObjectTracker(max_distance=25, max_missed=0)
+    assert ids(tracker.update([[10, 10, 20, 20], [100, 100, 20, 20]])) == [0, 1]
+    # order of the boxes does not matter
+    assert ids(tracker.update([[105, 103, 20, 20], [14, 12, 20, 20]])) == [1, 0]
+    # too far from any object, new ID
+    assert ids(tracker.update([[18, 14, 20, 20], [200, 200, 20, 20]])) == [0, 2]
+    assert tracker.center_points == {0: (28, 24), 2: (210, 210)}
+
+
+def test_boxes_never_share_an_id(solver):
+    tracker = ObjectTracker(max_distance=25, max_missed=0)
+    tracker.update([[10, 10, 20, 20]])
+    # both boxes are close enough to the object, only the closest one gets its ID
+    assert ids(tracker.update([[18, 10, 20, 20], [12, 10, 20, 20]])) == [1, 0]
+
+
+def test_crossing_objects_are_assigned_optimally():
+    tracker = ObjectTracker(max_distance=30, max_missed=0)
+    tracker.update([[0, 0, 10, 10], [20, 0, 10, 10]])
+    # greedy would give the box at 12 to object 1 (distance 8), and leave object 0 without a match
+    assert ids(tracker.update([[12, 0, 10, 10], [40, 0, 10, 10]])) == [0, 1]
+
+
+def test_missed_objects_are_kept_for_max_missed_updates(solver):
+    tracker = ObjectTracker(max_distance=25, max_missed=2)
+    tracker.update([[10, 10, 20, 20]])
+    tracker.update([])
+    tracker.update([])
+    # short gap, same ID
+    assert ids(tracker.update([[12, 10, 20, 20]])) == [0]
+    for _ in range(3):
+        tracker.update([])
+    assert not tracker.active() and len(tracker.ids) == 0
+    assert ids(tracker.update([[12, 10, 20, 20]])) == [1]
+
+
+def test_iou_cost(solver):
+    tracker = ObjectTracker(max_missed=0, cost='iou', min_iou=0.3)
+    tracker.update([[0, 0, 100, 100]])
+    # centers are far apart, but the boxes overlap
+    assert ids(tracker.update([[0, 0, 100, 60]])) == [0]
+    assert ids(tracker.update([[0, 50, 100, 60]])) == [1]
+
+
+def test_objects_are_advanced_by_their_velocity():
+    tracker = ObjectTracker(max_distance=50, max_missed=0)
+    # object moves 20 px per second to the right
+    for i in range(10):
+        tracker.update([[100 + 2 * i, 50, 20, 20]], ts=i * 0.1)
+    assert tracker.velocities[0] == pytest.approx([20, 0], abs=2)
+    assert not tracker.uncertain(max_std=12)
+    (x, y, w, h, obj_id), = tracker.predict(1.4)
+    assert (x, y, w, h, obj_id) == (pytest.approx(128, abs=1), 50, 20, 20, 0)
+    # no motion between the frames, objects stay where they are
+    tracker.hold(2.0)
+    (x, _, _, _, _), = tracker.predict(2.0)
+    assert x == pytest.approx(128, abs=1)
+    # prediction gets uncertain over time
+    tracker.predict(10.0)
+    assert tracker.uncertain(max_std=12)
+
+
+def test_box_iou():
+    a = np.array([[0, 0, 10, 10], [0, 0, 0, 0]], dtype=np.float64)
+    b = np.array([[0, 0, 10, 10], [5, 0, 10, 10], [20, 20, 5, 5]], dtype=np.float64)
+    assert box_iou(a, b) == pytest.approx(np.array([[1, 50 / 150, 0], [0, 0, 0]]))
+
+
+def test_assign_only_uses_allowed_links(solver):
+    cost = np.array([[1.0, 2.0], [0.5, 9.0]])
+    rows, cols = assign(cost, cost < 5)
+    assert sorted(zip(rows.tolist(), cols.tolist())) == [(0, 1), (1, 0)]
+    rows, cols = assign(cost, np.zeros_like(cost, dtype=bool))
+    assert len(rows) == len(cols) == 0
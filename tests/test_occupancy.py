@@ -0,0 +1,62 @@
+import os
+import runpy
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import config
+from database import Session
+from models import HomeOccupancy
+from occupancy import OccupancyState
+
+FAKE_OCCUPANCY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src',
+                                   'fake_occupancy.py')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def add_home_occupancy(owners: list, update_ts: datetime):
+    Session.add(HomeOccupancy(create_ts=update_ts, update_ts=update_ts, occupancy_status='home', found_owners=owners))
+    Session.commit()
+
+
+def run_fake_occupancy(monkeypatch, *args: str) -> threading.Thread:
+    """Run the stand-in publisher (fake_occupancy.py) in a thread"""
+    monkeypatch.setattr(sys, 'argv', ['fake_occupancy.py', *args])
+    t = threading.Thread(target=runpy.run_path, args=(FAKE_OCCUPANCY_PATH,), kwargs={'run_name': '__main__'})
+    t.daemon = True
+    t.start()
+    return t
+
+
+def test_occupancy_is_read_from_db_on_start_up_then_updated_by_events(db_engine, monkeypatch):
+    url = f'tcp://127.0.0.1:{free_port()}'
+    monkeypatch.setattr(config, 'OCCUPANCY_PUB_URL', url)
+    monkeypatch.setattr(config, 'OCCUPANCY_SUB_URL', url)
+    now = datetime.now()
+    add_home_occupancy(['Edo'], now - timedelta(minutes=5))
+    state = OccupancyState()
+    state.refresh_from_db()
+    assert state.owners_at_home() == ['Edo']
+    # DB is not read after start up
+    add_home_occupancy(['Enio'], now)
+    assert state.owners_at_home() == ['Edo']
+    assert state.owners_at_home(now + timedelta(minutes=config.OWNERS_OUTSIDE_HOME_MIN)) == []
+
+    # occupancy published by the stand-in of the device finder is applied in memory
+    state.start_subscriber()
+    t = run_fake_occupancy(monkeypatch, '--status', 'home', '--owners', 'Fake,Owner', '--interval', '0.05',
+                           '--count', '40')
+    deadline = time.time() + 5
+    while state.owners_at_home() != ['Fake', 'Owner'] and time.time() < deadline:
+        time.sleep(0.02)
+    assert state.owners_at_home() == ['Fake', 'Owner']
+    assert state.status == 'home'
+    t.join(10)
+    assert Session.query(HomeOccupancy).count() == 2
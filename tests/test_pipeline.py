@@ -0,0 +1,71 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from pipeline import BLOCK, DROP_OLDEST, Pipeline, StageQueue
+
+
+def test_drop_oldest_keeps_newest_items():
+    q = StageQueue('test', maxsize=2, policy=DROP_OLDEST)
+    for i in range(5):
+        assert q.put(i)
+    assert [q.get(timeout=0.1), q.get(timeout=0.1)] == [3, 4]
+    assert q.stats() == {'depth': 0, 'maxsize': 2, 'policy': DROP_OLDEST, 'dropped': 3}
+
+
+def test_block_rejects_item_after_timeout():
+    q = StageQueue('test', maxsize=1, policy=BLOCK)
+    assert q.put(1)
+    start_ts = time.perf_counter()
+    assert not q.put(2, timeout=0.05)
+    assert time.perf_counter() - start_ts >= 0.05
+    assert q.get(timeout=0.1) == 1
+    assert q.stats()['dropped'] == 0
+
+
+def test_block_waits_for_consumer():
+    q = StageQueue('test', maxsize=1, policy=BLOCK)
+    q.put(1)
+    threading.Timer(0.05, q.get).start()
+    assert q.put(2, timeout=1.0)
+    assert q.get(timeout=0.1) == 2
+
+
+def test_get_raises_empty_after_timeout():
+    with pytest.raises(queue.Empty):
+        StageQueue('test').get(timeout=0.01)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        StageQueue('test', policy='drop_newest')
+
+
+def test_pipeline_passes_items_through_stages():
+    items = iter(range(10))
+    results = []
+    done = threading.Event()
+
+    def source():
+        item = next(items, None)
+        if item is None:
+            time.sleep(0.01)
+        return item
+
+    def collect(item):
+        results.append(item)
+        if len(results) == 10:
+            done.set()
+
+    pipeline = (Pipeline()
+                .add_stage('source', source)
+                .add_stage('double', lambda item: item * 2, maxsize=10, policy=BLOCK)
+                .add_stage('sink', collect, maxsize=10, policy=BLOCK)
+                .start())
+    try:
+        assert done.wait(timeout=5)
+    finally:
+        pipeline.stop()
+    assert results == [i * 2 for i in range(10)]
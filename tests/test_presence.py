@@ -0,0 +1,143 @@
+import os
+import time
+
+from conftest import FIXTURES_DIR
+from presence import PresenceDetector, parse_ip_neigh, parse_proc_arp, read_proc_arp
+
+PHONE = '14:f2:87:0e:9a:54'
+TABLET = '44:f2:1b:29:c3:ed'
+DEVICES = [{'mac_addr': PHONE.upper(), 'owner': 'A', 'device': 'phone'},
+           {'mac_addr': TABLET.upper(), 'owner': 'B', 'device': 'tablet'}]
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return f.read()
+
+
+def test_parse_proc_arp():
+    neighbours = parse_proc_arp(read_fixture('proc_net_arp'))
+    assert neighbours == {'aa:bb:cc:dd:ee:01': ('192.168.1.1', 'COMPLETE'),
+                          PHONE: ('192.168.1.10', 'COMPLETE'),
+                          '00:00:00:00:00:00': ('192.168.1.11', 'INCOMPLETE'),
+                          TABLET: ('192.168.1.12', 'COMPLETE')}
+    assert read_proc_arp(os.path.join(FIXTURES_DIR, 'proc_net_arp')) == neighbours
+
+
+def test_parse_ip_neigh():
+    # entries without MAC address (FAILED, INCOMPLETE) and IPv6 entries are skipped
+    assert parse_ip_neigh(read_fixture('ip_neigh')) == {'aa:bb:cc:dd:ee:01': ('192.168.1.1', 'REACHABLE'),
+                                                        PHONE: ('192.168.1.10', 'STALE'),
+                                                        TABLET: ('192.168.1.12', 'DELAY'),
+                                                        '02:00:00:00:00:14': ('192.168.1.14', 'PERMANENT')}
+
+
+class FakeNeighbours:
+    """Neighbour table of the kernel: probed entries go through the given states, one state per table read"""
+
+    def __init__(self, table: dict):
+        self.table = dict(table)
+        self.after_probe = {}  # MAC -> states the entry goes through after it was probed
+        self.probed = []
+        self.reads = 0
+
+    def __call__(self) -> dict:
+        self.reads += 1
+        for mac, states in self.after_probe.items():
+            if mac in self.probed and mac in self.table and states:
+                state = states.pop(0)
+                if state is None:
+                    self.table.pop(mac, None)
+                else:
+                    self.table[mac] = (self.table[mac][0], state)
+        return dict(self.table)
+
+    def probe(self, ip: str):
+        self.probed += [mac for mac, (mac_ip, _) in self.table.items() if mac_ip == ip]
+
+
+def create_detector(neighbours: FakeNeighbours, sweep=None, **kwargs) -> PresenceDetector:
+    kwargs = {'probe': neighbours.probe, 'away_misses': 2, 'probe_wait': 0.5, 'probe_poll': 0.01,
+              'sweep_interval': 300, **kwargs}
+    return PresenceDetector(DEVICES, neighbour_source=neighbours, sweep=sweep, **kwargs)
+
+
+def test_device_is_away_after_consecutive_misses():
+    neighbours = FakeNeighbours({PHONE: ('192.168.1.10', 'REACHABLE')})
+    detector = create_detector(neighbours, probe=None)
+    assert [d['owner'] for d in detector.check()] == ['A']
+    del neighbours.table[PHONE]
+    # first miss is tolerated
+    assert [d['owner'] for d in detector.check()] == ['A']
+    assert detector.check() == []
+    # present again as soon as it's seen
+    neighbours.table[PHONE] = ('192.168.1.10', 'REACHABLE')
+    assert [d['owner'] for d in detector.check()] == ['A']
+    assert detector.misses[PHONE] == 0
+
+
+def test_stale_entry_is_confirmed_after_probe():
+    neighbours = FakeNeighbours({PHONE: ('192.168.1.10', 'STALE'), TABLET: ('192.168.1.12', 'STALE')})
+    # phone answers the probe, tablet left (its entry fails and drops out)
+    neighbours.after_probe = {PHONE: ['DELAY', 'DELAY', 'PROBE', 'REACHABLE'],
+                              TABLET: ['DELAY', 'DELAY', 'PROBE', 'PROBE', None]}
+    detector = create_detector(neighbours)
+    start_ts = time.monotonic()
+    assert detector.find_devices() == {PHONE}
+    # table is read until the entries are resolved, not for the whole wait
+    assert time.monotonic() - start_ts < detector.probe_wait
+    assert sorted(neighbours.probed) == [PHONE, TABLET]
+    assert detector.pending == set()
+
+
+def test_entry_being_confirmed_is_not_a_miss():
+    neighbours = FakeNeighbours({PHONE: ('192.168.1.10', 'REACHABLE'), TABLET: ('192.168.1.12', 'REACHABLE')})
+    detector = create_detector(neighbours, away_misses=1, probe_wait=0.1)
+    assert [d['owner'] for d in detector.check()] == ['A', 'B']
+    # tablet is still in DELAY at the end of the wait
+    neighbours.table[TABLET] = ('192.168.1.12', 'STALE')
+    neighbours.after_probe = {TABLET: ['DELAY'] * 1000}
+    assert [d['owner'] for d in detector.check()] == ['A', 'B']
+    assert detector.pending == {TABLET}
+    assert detector.misses[TABLET] == 0
+    # failed to be confirmed
+    del neighbours.table[TABLET]
+    assert [d['owner'] for d in detector.check()] == ['A']
+    assert detector.pending == set()
+
+
+def test_proc_entries_are_trusted_after_the_whole_wait():
+    neighbours = FakeNeighbours({PHONE: ('192.168.1.10', 'COMPLETE'), TABLET: ('192.168.1.12', 'COMPLETE')})
+    # tablet left, its entry is removed once the kernel fails to confirm it
+    neighbours.after_probe = {TABLET: ['COMPLETE'] * 5 + [None]}
+    detector = create_detector(neighbours, probe_wait=0.2)
+    start_ts = time.monotonic()
+    assert detector.find_devices() == {PHONE}
+    assert time.monotonic() - start_ts >= detector.probe_wait
+    assert detector.pending == set()
+
+
+def test_sweep_fallback():
+    neighbours = FakeNeighbours({PHONE: ('192.168.1.10', 'REACHABLE')})
+    swept = []
+
+    def sweep():
+        # sweep populates the neighbour table
+        swept.append(True)
+        neighbours.table[TABLET] = ('192.168.1.12', 'REACHABLE')
+        return {TABLET, 'aa:bb:cc:dd:ee:01'}
+
+    detector = create_detector(neighbours, sweep=sweep)
+    assert detector.find_devices() == {PHONE, TABLET}
+    assert detector.known_ips[TABLET] == '192.168.1.12'
+    # devices in the table are probed, no sweep needed
+    assert detector.find_devices() == {PHONE, TABLET}
+    assert TABLET in neighbours.probed
+    # sweep is not run more often than every N-seconds
+    del neighbours.table[TABLET]
+    detector.known_ips.pop(TABLET)
+    assert detector.find_devices() == {PHONE}
+    assert len(swept) == detector.sweeps == 1
+    detector.sweep_interval = 0
+    assert detector.find_devices() == {PHONE, TABLET}
+    assert len(swept) == detector.sweeps == 2
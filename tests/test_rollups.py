@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from database import Session
+from models import MotionDetection, MotionRollup, ObjectDetection, ObjectRollup
+from rollups import RollupUpdater, rebuild_rollups
+
+HOUR = datetime(2024, 5, 1, 12)
+
+
+def motion(ts: datetime) -> MotionDetection:
+    return MotionDetection(create_ts=ts, x=0, y=0, w=10, h=10, area=100, camera_id='cam0')
+
+
+def obj(ts: datetime, label: str, obj_id: int, camera_id: str = 'cam0') -> ObjectDetection:
+    return ObjectDetection(create_ts=ts, x=0, y=0, w=10, h=10, area=100, camera_id=camera_id, label=label,
+                           obj_id=obj_id)
+
+
+def test_increments():
+    updater = RollupUpdater()
+    detections = [motion(HOUR), motion(HOUR + timedelta(minutes=30)), motion(HOUR + timedelta(hours=1)),
+                  obj(HOUR, 'person', 1), obj(HOUR + timedelta(minutes=1), 'person', 1),
+                  # same object ID from another camera is another object
+                  obj(HOUR, 'person', 1, camera_id='cam1'), obj(HOUR, 'car', 2),
+                  # object is counted again in the next hour
+                  obj(HOUR + timedelta(hours=1), 'person', 1)]
+    motion_inc, obj_inc, new_seen = updater.increments(detections)
+    assert motion_inc == {HOUR: 2, HOUR + timedelta(hours=1): 1}
+    assert obj_inc == {(HOUR, 'person'): 2, (HOUR, 'car'): 1, (HOUR + timedelta(hours=1), 'person'): 1}
+    assert new_seen == {HOUR: {('cam0', 'person', 1), ('cam1', 'person', 1), ('cam0', 'car', 2)},
+                        HOUR + timedelta(hours=1): {('cam0', 'person', 1)}}
+
+
+def test_objects_are_counted_once_marked_as_seen():
+    updater = RollupUpdater()
+    detections = [obj(HOUR, 'person', 1)]
+    _, obj_inc, new_seen = updater.increments(detections)
+    # transaction not committed yet (or rolled back), object is counted again
+    assert updater.increments(detections)[1] == obj_inc == {(HOUR, 'person'): 1}
+    updater.mark_seen(new_seen)
+    assert updater.increments(detections + [motion(HOUR)])[:2] == ({HOUR: 1}, {})
+
+
+def test_only_latest_hours_are_kept():
+    updater = RollupUpdater()
+    for h in range(4):
+        updater.mark_seen(updater.increments([obj(HOUR + timedelta(hours=h), 'person', 1)])[2])
+    assert sorted(updater._seen) == [HOUR + timedelta(hours=2), HOUR + timedelta(hours=3)]
+
+
+def fetch_rollups() -> tuple:
+    Session.expire_all()
+    return (sorted(Session.query(MotionRollup.hour_ts, MotionRollup.motion_count)),
+            sorted(Session.query(ObjectRollup.hour_ts, ObjectRollup.label, ObjectRollup.obj_count)))
+
+
+def save(updater: RollupUpdater, detections: list):
+    Session.add_all(detections)
+    new_seen = updater.update(Session, detections)
+    Session.commit()
+    updater.mark_seen(new_seen)
+
+
+def test_seed_and_update_match_rebuilt_rollups(db_engine):
+    now = HOUR + timedelta(minutes=40)
+    save(RollupUpdater(), [obj(HOUR + timedelta(minutes=5), 'person', 1), motion(HOUR + timedelta(minutes=5))])
+    # restarted updater does not count objects saved in the current hour again
+    updater = RollupUpdater()
+    updater.seed(db_engine, now)
+    save(updater, [obj(now, 'person', 1), obj(now, 'person', 3), obj(now, 'dog', 4), motion(now), motion(now)])
+    expected = ([(HOUR, 3)], [(HOUR, 'dog', 1), (HOUR, 'person', 2)])
+    assert fetch_rollups() == expected
+    rebuild_rollups()
+    assert fetch_rollups() == expected
@@ -0,0 +1,34 @@
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import config
+from database import Session
+from models import Image
+from occupancy import OccupancyState
+from security import AlertWorker
+
+
+@pytest.fixture
+def img_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'IMG_FOLDER', str(tmp_path / 'images'))
+    (tmp_path / 'images').mkdir()
+    return config.IMG_FOLDER
+
+
+def test_saved_images_are_committed_when_idle(db_engine, img_folder):
+    worker = AlertWorker(OccupancyState())
+    frame = np.zeros((225, 400, 3), dtype=np.uint8)
+    now = datetime(2024, 5, 1, 12, 0)
+    # image saves only (no alert)
+    for i in range(3):
+        worker.queue.put(([], frame, now + timedelta(seconds=i), None, False))
+    worker.start()
+    deadline = time.time() + 5
+    while Session.query(Image).count() < 3 and time.time() < deadline:
+        Session.remove()
+        time.sleep(0.05)
+    assert Session.query(Image).count() == 3
+    assert worker.failed == 0
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from startup import FAILED, READY, STARTING, ComponentStartup
+
+LATENCIES = {'model': 0.3, 'camera': 0.2, 'db': 0.1}
+
+
+def sleeper(name: str, latency: float):
+    def start():
+        time.sleep(latency)
+        return name
+    return start
+
+
+def create_startup(latencies: dict) -> ComponentStartup:
+    startup = ComponentStartup('Test')
+    for name, latency in latencies.items():
+        startup.add(name, sleeper(name, latency))
+    return startup
+
+
+def test_parallel_start_up_takes_as_long_as_the_slowest_component():
+    startup = create_startup(LATENCIES)
+    start_ts = time.perf_counter()
+    assert startup.run(parallel=True) == {name: name for name in LATENCIES}
+    wall_time = time.perf_counter() - start_ts
+    slowest, total = max(LATENCIES.values()), sum(LATENCIES.values())
+    assert slowest <= wall_time < slowest + 0.1 < total
+    assert startup.ready()
+    for name, latency in LATENCIES.items():
+        assert startup.components[name]['duration_sec'] == pytest.approx(latency, abs=0.05)
+
+
+def test_serial_start_up_takes_the_sum():
+    startup = create_startup(LATENCIES)
+    start_ts = time.perf_counter()
+    startup.run(parallel=False)
+    assert time.perf_counter() - start_ts >= sum(LATENCIES.values())
+
+
+def test_state_is_reported_while_starting():
+    release = threading.Event()
+    startup = create_startup({'db': 0.0}).add('camera', release.wait)
+    t = threading.Thread(target=startup.run)
+    t.start()
+    deadline = time.time() + 5
+    while startup.components['db']['state'] != READY and time.time() < deadline:
+        time.sleep(0.01)
+    stats = startup.stats()
+    assert not stats['ready'] and stats['duration_sec'] is None
+    assert stats['components']['camera']['state'] == STARTING
+    release.set()
+    t.join(5)
+    assert startup.ready()
+
+
+def test_failed_component():
+    def fail():
+        raise RuntimeError('camera not found')
+
+    startup = create_startup({'db': 0.0}).add('camera', fail)
+    with pytest.raises(RuntimeError, match='camera not found'):
+        startup.run()
+    assert startup.components['camera']['state'] == FAILED
+    assert startup.components['camera']['error'] == 'camera not found'
+    assert not startup.ready()
@@ -0,0 +1,55 @@
+import numpy as np
+
+import zones
+from zones import ZoneSet, get_zone_set
+
+FRAME_SHAPE = (100, 200, 3)
+# driveway is non-convex (L-shaped), garden overlaps its right part
+ZONES = {'driveway': [[10, 10], [60, 10], [60, 40], [30, 40], [30, 80], [10, 80]],
+         'garden': [[50, 20], [150, 20], [150, 60], [50, 60]]}
+
+
+def test_mask_and_roi():
+    zone_set = ZoneSet(ZONES, FRAME_SHAPE)
+    assert zone_set.rect == (10, 10, 141, 71)
+    assert zone_set.mask[50, 20] == 255
+    # inside the bounding rectangle of the driveway, but outside of its polygon
+    assert zone_set.mask[70, 50] == 0
+    assert zone_set.roi_mask.shape == (71, 141)
+
+
+def test_apply_and_crop():
+    zone_set = ZoneSet(ZONES, FRAME_SHAPE)
+    frame = np.full(FRAME_SHAPE, 255, np.uint8)
+    masked = zone_set.apply(frame)
+    assert masked[50, 20].tolist() == [255, 255, 255]
+    assert masked[5, 5].tolist() == [0, 0, 0]
+    crop = zone_set.crop(frame)
+    assert crop.shape == (71, 141, 3)
+    # crop is a view of the frame, not a copy
+    assert np.shares_memory(crop, frame)
+
+
+def test_zone_at():
+    zone_set = ZoneSet(ZONES, FRAME_SHAPE)
+    assert zone_set.zone_at(20, 70) == 'driveway'
+    assert zone_set.zone_at(100, 30) == 'garden'
+    # zone defined later wins where zones overlap
+    assert zone_set.zone_at(55, 30) == 'garden'
+    assert zone_set.zone_at(50, 70) is None
+    # points outside of the frame are clipped to it
+    assert zone_set.zone_at(-5, -5) is None
+
+
+def test_zone_for_box_uses_centroid():
+    zone_set = ZoneSet(ZONES, FRAME_SHAPE)
+    assert zone_set.zone_for_box(0, 60, 40, 20) == 'driveway'
+    assert zone_set.zone_for_box(140, 50, 40, 40) is None
+
+
+def test_zone_set_is_cached_until_zones_change(monkeypatch):
+    monkeypatch.setattr(zones, '_cache_key', None)
+    zone_set = get_zone_set(FRAME_SHAPE, ZONES)
+    assert get_zone_set(FRAME_SHAPE, dict(ZONES)) is zone_set
+    assert get_zone_set((120, 200, 3), ZONES) is not zone_set
+    assert get_zone_set(FRAME_SHAPE, {'driveway': ZONES['driveway']}).zones[0].name == 'driveway'